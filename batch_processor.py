@@ -0,0 +1,172 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from image_processor import optimize_image_iteratively
+from image_cache import OptimizedImageCache
+from metrics import record_stage, flush_metrics, configure_metrics, configure_metrics_from_environment
+
+# Extensiones que se recogen al procesar una carpeta completa
+BATCH_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# Trabajos en cola por worker: limita la memoria y el número de futures vivos (back-pressure)
+BATCH_QUEUE_FACTOR = 2
+BATCH_SUMMARY_FILENAME = "batch_summary.json"
+
+def iter_batch_inputs(source, recursive=False):
+    """
+    Genera pares (ruta_imagen, subcarpeta_relativa) a partir de una carpeta o de
+    un manifiesto (.json con una lista de rutas, o texto con una ruta por línea).
+    Se recorre de forma perezosa para no cargar listados enormes en memoria.
+    """
+    if os.path.isdir(source):
+        for dir_path, dir_names, file_names in os.walk(source):
+            dir_names.sort()
+            relative_dir = os.path.relpath(dir_path, source)
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(BATCH_EXTENSIONS):
+                    yield os.path.join(dir_path, file_name), "" if relative_dir == "." else relative_dir
+            if not recursive:
+                break
+        return
+
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as manifest_file:
+        if source.lower().endswith(".json"):
+            entries = json.load(manifest_file)
+        else:
+            entries = (line.strip() for line in manifest_file)
+        for entry in entries:
+            if not entry or entry.startswith("#"):
+                continue
+            # Las rutas relativas del manifiesto se resuelven respecto al propio manifiesto
+            yield os.path.join(manifest_dir, entry), ""
+
+def _optimize_one(input_image_path, output_dir, pngquant_exe_rel_path, search_mode, max_workers, cache, backend, min_ssim=None):
+    report = {}
+    start = time.perf_counter()
+    output_path = optimize_image_iteratively(
+        input_image_path,
+        output_dir=output_dir,
+        pngquant_exe_rel_path=pngquant_exe_rel_path,
+        search_mode=search_mode,
+        report=report,
+        max_workers=max_workers,
+        cache=cache,
+        backend=backend,
+        min_ssim=min_ssim
+    )
+    return {
+        "input": input_image_path,
+        "output": output_path,
+        "ok": bool(output_path),
+        "original_size": report.get("original_size"),
+        "final_size": report.get("final_size"),
+        "quality": report.get("quality"),
+        "ssim": report.get("ssim"),
+        "pngquant_calls": report.get("pngquant_calls"),
+        "cache_hit": report.get("cache_hit", False),
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+def optimize_batch(source, output_dir="optimized_images", workers=None, search_mode="bisect",
+                   pngquant_exe_rel_path="tools/pngquant.exe", recursive=False, summary_path=None, cache_dir=None,
+                   backend="pngquant", min_ssim=None):
+    """
+    Optimiza todas las imágenes de una carpeta o manifiesto repartiéndolas entre
+    'workers' hilos (por defecto uno por núcleo). Cada hilo solo espera a su
+    proceso pngquant, que es el que consume CPU, así que un hilo por núcleo
+    ocupa todos los núcleos sin sobresuscribirlos. Con search_mode="parallel"
+    los núcleos se reparten entre imágenes y rangos de calidad.
+
+    Con cache_dir se reutilizan los resultados de lotes anteriores para las
+    imágenes que no han cambiado (ver image_cache). min_ssim fija la calidad
+    perceptual mínima de cada imagen (ver optimize_image_iteratively).
+
+    Escribe un resumen JSON (por defecto 'batch_summary.json' en output_dir) y
+    devuelve el dict del resumen.
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, workers or cpu_count)
+    per_image_workers = max(1, cpu_count // workers) if search_mode == "parallel" else None
+    max_in_flight = workers * BATCH_QUEUE_FACTOR
+    cache = OptimizedImageCache(cache_dir) if cache_dir else None
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    summary_path = summary_path or os.path.join(output_dir, BATCH_SUMMARY_FILENAME)
+
+    print(f"Lote: '{source}' -> '{output_dir}' con {workers} workers (modo {search_mode})")
+    batch_start = time.perf_counter()
+    results = []
+    inputs = iter_batch_inputs(source, recursive=recursive)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for input_image_path, relative_dir in inputs:
+            # Back-pressure: no encolar más trabajos hasta que termine alguno
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            image_output_dir = os.path.join(output_dir, relative_dir)
+            in_flight.add(executor.submit(_optimize_one, input_image_path, image_output_dir,
+                                          pngquant_exe_rel_path, search_mode, per_image_workers, cache, backend, min_ssim))
+        for future in in_flight:
+            results.append(future.result())
+
+    results.sort(key=lambda result: result["input"])
+    succeeded = [result for result in results if result["ok"]]
+    summary = {
+        "source": source,
+        "output_dir": output_dir,
+        "workers": workers,
+        "search_mode": search_mode,
+        "backend": backend,
+        "min_ssim": min_ssim,
+        "images": len(results),
+        "failed": len(results) - len(succeeded),
+        "total_original_size": sum(result["original_size"] or 0 for result in succeeded),
+        "total_final_size": sum(result["final_size"] or 0 for result in succeeded),
+        "total_pngquant_calls": sum(result["pngquant_calls"] or 0 for result in succeeded),
+        "cache_hits": sum(1 for result in succeeded if result["cache_hit"]),
+        "seconds": round(time.perf_counter() - batch_start, 3),
+        "results": results
+    }
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, indent=2, ensure_ascii=False)
+    record_stage("batch", summary["seconds"], images=summary["images"], failed=summary["failed"],
+                 bytes_in=summary["total_original_size"], bytes_out=summary["total_final_size"],
+                 iterations=summary["total_pngquant_calls"])
+    flush_metrics()
+
+    print(f"\nLote terminado: {summary['images']} imágenes ({summary['failed']} con error) en {summary['seconds']:.2f} s")
+    print(f"  Tamaño total: {summary['total_original_size'] / 1024:.2f} KB -> {summary['total_final_size'] / 1024:.2f} KB")
+    print(f"  Resumen guardado en: {summary_path}")
+    return summary
+
+# --- Bloque de pruebas ---
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Optimiza en lote una carpeta o manifiesto de imágenes.")
+    parser.add_argument("source", help="Carpeta de imágenes o manifiesto (.json o .txt)")
+    parser.add_argument("output_dir", help="Carpeta de salida")
+    parser.add_argument("--workers", type=int, default=None, help="Número de workers (por defecto, uno por núcleo)")
+    parser.add_argument("--mode", default="bisect", help="Modo de búsqueda de calidad (linear, bisect, parallel)")
+    parser.add_argument("--backend", default="pngquant", help="Backend de cuantización (pngquant, pillow)")
+    parser.add_argument("--recursive", action="store_true", help="Recorrer subcarpetas")
+    parser.add_argument("--cache-dir", default=None, help="Carpeta de caché de resultados (desactivada si se omite)")
+    parser.add_argument("--min-ssim", type=float, default=None, help="Calidad perceptual mínima (SSIM, p. ej. 0.95)")
+    parser.add_argument("--metrics-jsonl", default=None, help="Registrar métricas por etapa en este archivo JSON lines")
+    parser.add_argument("--metrics-prom", default=None, help="Escribir totales por etapa en este archivo de texto de Prometheus")
+    args = parser.parse_args()
+
+    if args.metrics_jsonl or args.metrics_prom:
+        configure_metrics(args.metrics_jsonl, args.metrics_prom)
+    else:
+        configure_metrics_from_environment()
+
+    batch_summary = optimize_batch(args.source, args.output_dir, workers=args.workers,
+                                   search_mode=args.mode, recursive=args.recursive, cache_dir=args.cache_dir, backend=args.backend,
+                                   min_ssim=args.min_ssim)
+    exit(1 if batch_summary["failed"] else 0)
@@ -0,0 +1,84 @@
+"""
+Compara los backends de cuantización de image_processor (pngquant como
+proceso externo frente a Pillow dentro del proceso) sobre una imagen
+sintética: tiempo de preparación (decodificación), tiempo por calidad y
+tamaño resultante.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_backends.py [--size 2000x1500] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_processor
+from image_processor import create_quantizer_backend, _find_pngquant_exe, _linear_quality_levels
+
+def make_synthetic_png(width, height):
+    """PNG RGBA con degradado, ruido y zonas transparentes (parecido a un primer plano real)."""
+    import io
+    import random
+    from PIL import Image, ImageDraw
+
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGBA")
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(42)
+    for _ in range(300):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(5, max(6, width // 10))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randrange(64, 256))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    draw.rectangle((0, 0, width // 3, height // 3), fill=(0, 0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def bench_backend(backend, source_bytes, pngquant_exe, repeat):
+    levels = _linear_quality_levels()
+    setup_times, quantize_times, sizes = [], [], {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        quantizer = create_quantizer_backend(backend, source_bytes, pngquant_exe)
+        setup_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for quality_min, quality_max in levels:
+            output_bytes = quantizer.quantize(quality_min, quality_max)
+            sizes[f"{quality_min}-{quality_max}"] = len(output_bytes) if output_bytes else None
+        quantize_times.append(time.perf_counter() - start)
+    return {
+        "setup_ms": min(setup_times) * 1000,
+        "per_quality_ms": min(quantize_times) * 1000 / len(levels),
+        "sizes": sizes
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="2000x1500", help="Tamaño de la imagen sintética (ANCHOxALTO)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se toma el mejor tiempo)")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    source_bytes = make_synthetic_png(width, height)
+    print(f"Imagen sintética {width}x{height}: {len(source_bytes) / 1024:.2f} KB")
+
+    # Silenciar los mensajes por iteración de image_processor durante la medición
+    devnull = open(os.devnull, "w")
+    pngquant_exe = _find_pngquant_exe("tools/pngquant.exe")
+    results = {}
+    for backend in image_processor.BACKENDS:
+        if backend == "pngquant" and not pngquant_exe:
+            print("pngquant no disponible: se omite ese backend.")
+            continue
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            results[backend] = bench_backend(backend, source_bytes, pngquant_exe, args.repeat)
+        finally:
+            sys.stdout = stdout
+
+    print(f"\n{'backend':<10} {'preparación':>12} {'por calidad':>12}  tamaños (KB)")
+    for backend, result in results.items():
+        sizes = ", ".join(f"{quality}: {size / 1024:.0f}" if size else f"{quality}: -" for quality, size in result["sizes"].items())
+        print(f"{backend:<10} {result['setup_ms']:>10.1f}ms {result['per_quality_ms']:>10.1f}ms  {sizes}")
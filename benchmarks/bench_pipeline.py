@@ -0,0 +1,281 @@
+"""
+Banco de pruebas repetible de la cadena completa: optimize_image_iteratively
+sobre primeros planos sintéticos (varias resoluciones y niveles de entropía) y
+create_final_svg sobre fondos sintéticos de 10 a 100k paths. De cada caso se
+mide el tiempo de pared, la memoria pico (RSS) y el tamaño de la salida.
+
+Cada caso se ejecuta en un proceso nuevo para que la memoria pico sea solo la
+suya. Los resultados se comparan con una línea base guardada
+(benchmarks/baseline.json por defecto) y se marcan las regresiones; la salida
+es distinta de cero si hay alguna. La línea base guarda también el backend y
+la máquina con que se midió (ver benchmarks/README.md).
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_pipeline.py [--quick] [--backend pillow] [--save-baseline]
+    python benchmarks/bench_pipeline.py --only compose --repeat 3 --output resultados.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+DEFAULT_BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_CORPUS_DIR = os.path.join(BENCH_DIR, ".corpus")
+
+FOREGROUND_SIZES = ((640, 480), (1920, 1080), (4000, 3000))
+FOREGROUND_ENTROPIES = ("low", "medium", "high")
+BACKGROUND_PATH_COUNTS = (10, 1000, 10000, 100000)
+COMPOSE_MODES = ("tree", "stream")
+# Primer plano que se usa en los casos de composición
+COMPOSE_FOREGROUND = ((1920, 1080), "medium")
+# Objetivo de los casos de optimización como fracción del PNG de entrada: así todos
+# cuantifican (con el objetivo de producción los pequeños solo se copiarían)
+DEFAULT_TARGET_RATIO = 0.25
+
+# Tolerancias antes de considerar que un caso ha empeorado respecto a la línea base
+REGRESSION_TOLERANCE = {"seconds": 0.25, "peak_rss_bytes": 0.20, "output_bytes": 0.05}
+# Por debajo de esto las diferencias de tiempo son ruido
+MIN_SECONDS_FOR_REGRESSION = 0.05
+
+def make_foreground_png(path, width, height, entropy):
+    """PNG RGBA sintético: 'low' colores planos, 'medium' degradado y formas, 'high' ruido."""
+    from PIL import Image, ImageDraw, ImageFilter
+    from bench_backends import make_synthetic_png
+
+    if entropy == "medium":
+        with open(path, "wb") as png_file:
+            png_file.write(make_synthetic_png(width, height))
+        return
+    if entropy == "low":
+        image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        rng = random.Random(7)
+        for _ in range(40):
+            x, y = rng.randrange(width), rng.randrange(height)
+            side = rng.randrange(10, max(11, width // 4))
+            draw.rectangle((x, y, x + side, y + side), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256), 255))
+    else:
+        rng = random.Random(11) # Ruido con semilla: el corpus debe ser idéntico entre ejecuciones
+        noise = [Image.frombytes("L", (width, height), rng.randbytes(width * height)).filter(ImageFilter.GaussianBlur(0.6))
+                 for _ in range(3)]
+        image = Image.merge("RGB", noise).convert("RGBA")
+        image.putalpha(noise[0].point(lambda value: 255 if value > 40 else 0))
+    image.save(path, format="PNG")
+
+def make_background_svg(path, path_count):
+    """SVG de fondo sintético con path_count paths (curvas), un degradado en <defs> y clases CSS."""
+    rng = random.Random(path_count)
+    with open(path, "w", encoding="utf-8") as svg_file:
+        svg_file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                       '<svg xmlns="http://www.w3.org/2000/svg" width="1920" height="1080" viewBox="0 0 1920 1080">\n'
+                       '<defs><linearGradient id="g"><stop offset="0" stop-color="#09f"/>'
+                       '<stop offset="1" stop-color="#f90"/></linearGradient></defs>\n'
+                       '<style>.a{fill:url(#g)} .b{fill:#336;opacity:.6}</style>\n')
+        for index in range(path_count):
+            x, y = rng.uniform(0, 1920), rng.uniform(0, 1080)
+            points = " ".join(f"{rng.uniform(-80, 80):.3f},{rng.uniform(-80, 80):.3f}" for _ in range(6))
+            svg_file.write(f'<path class="{"ab"[index % 2]}" d="M{x:.3f},{y:.3f} c{points} z"/>\n')
+        svg_file.write('</svg>\n')
+
+def build_corpus(corpus_dir, cases):
+    """Genera (una sola vez; se reutilizan entre ejecuciones) las entradas que necesitan los casos."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    for case in cases:
+        for path_key, maker in (("foreground", make_foreground_png), ("background", make_background_svg)):
+            spec = case.get(path_key + "_spec")
+            if spec and not os.path.exists(case[path_key]):
+                print(f"  Generando {os.path.basename(case[path_key])}...")
+                maker(case[path_key], *spec)
+
+def plan_cases(corpus_dir, only=None, quick=False):
+    sizes = FOREGROUND_SIZES[:2] if quick else FOREGROUND_SIZES
+    path_counts = BACKGROUND_PATH_COUNTS[:3] if quick else BACKGROUND_PATH_COUNTS
+
+    def foreground(size, entropy):
+        return os.path.join(corpus_dir, f"fg_{size[0]}x{size[1]}_{entropy}.png"), (size[0], size[1], entropy)
+
+    cases = []
+    if only in (None, "optimize"):
+        for size in sizes:
+            for entropy in FOREGROUND_ENTROPIES:
+                path, spec = foreground(size, entropy)
+                cases.append({"name": f"optimize/{size[0]}x{size[1]}/{entropy}", "kind": "optimize",
+                              "foreground": path, "foreground_spec": spec})
+    if only in (None, "compose"):
+        fg_path, fg_spec = foreground(*COMPOSE_FOREGROUND)
+        for path_count in path_counts:
+            for mode in COMPOSE_MODES:
+                cases.append({"name": f"compose/{path_count}paths/{mode}", "kind": "compose", "mode": mode,
+                              "foreground": fg_path, "foreground_spec": fg_spec,
+                              "background": os.path.join(corpus_dir, f"bg_{path_count}.svg"),
+                              "background_spec": (path_count,)})
+    return cases
+
+def _peak_rss_bytes():
+    """Memoria pico del proceso actual, o None si la plataforma no la expone."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return getattr(psutil.Process().memory_info(), "peak_wset", None)
+        except ImportError:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux lo da en KB
+
+def run_case(case, backend, repeat, work_dir, target_ratio=DEFAULT_TARGET_RATIO):
+    """Ejecuta un caso (en el proceso actual) y devuelve sus medidas."""
+    from image_processor import optimize_image_iteratively
+    from svg_generator import create_final_svg, clear_compiled_backgrounds
+    from PIL import Image
+
+    devnull = open(os.devnull, "w")
+    times = []
+    output_bytes = None
+    for _ in range(repeat):
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            if case["kind"] == "optimize":
+                report = {}
+                target_size_bytes = int(os.path.getsize(case["foreground"]) * target_ratio) or None
+                start = time.perf_counter()
+                output_path = optimize_image_iteratively(case["foreground"], output_dir=work_dir, search_mode="bisect",
+                                                         backend=backend, report=report, target_size_bytes=target_size_bytes)
+                times.append(time.perf_counter() - start)
+                ok = bool(output_path)
+                output_bytes = report.get("final_size")
+            else:
+                with Image.open(case["foreground"]) as image:
+                    width, height = image.size
+                clear_compiled_backgrounds() # Medir el parseo del fondo en cada repetición
+                output_path = os.path.join(work_dir, "bench.svg")
+                start = time.perf_counter()
+                ok = create_final_svg(output_path, case["background"], case["foreground"], width, height,
+                                      stream_output=case["mode"] == "stream", background_mode=case["mode"])
+                times.append(time.perf_counter() - start)
+                output_bytes = os.path.getsize(output_path) if ok else None
+        finally:
+            sys.stdout = stdout
+        if not ok:
+            return {"name": case["name"], "ok": False}
+    return {"name": case["name"], "ok": True, "seconds": round(min(times), 4),
+            "peak_rss_bytes": _peak_rss_bytes(), "output_bytes": output_bytes}
+
+def run_case_isolated(case, backend, repeat, work_dir, target_ratio=DEFAULT_TARGET_RATIO):
+    """Ejecuta el caso en un proceso nuevo y devuelve el JSON que imprime."""
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case),
+               "--backend", backend, "--repeat", str(repeat), "--work-dir", work_dir,
+               "--target-ratio", str(target_ratio)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    try:
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {"name": case["name"], "ok": False, "error": completed.stderr.strip()[-500:]}
+
+def compare_with_baseline(results, baseline):
+    """Devuelve una lista de (caso, métrica, base, actual) que superan la tolerancia."""
+    regressions = []
+    baseline_by_name = {result["name"]: result for result in baseline.get("results", [])}
+    for result in results:
+        previous = baseline_by_name.get(result["name"])
+        if not previous or not previous.get("ok"):
+            continue
+        if not result.get("ok"):
+            regressions.append((result["name"], "ok", True, False))
+            continue
+        for metric, tolerance in REGRESSION_TOLERANCE.items():
+            before, after = previous.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if metric == "seconds" and after < MIN_SECONDS_FOR_REGRESSION:
+                continue
+            if after > before * (1 + tolerance):
+                regressions.append((result["name"], metric, before, after))
+    return regressions
+
+def _format_bytes(value):
+    return "-" if value is None else f"{value / (1024 * 1024):.1f} MB" if value >= 1024 * 1024 else f"{value / 1024:.1f} KB"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=("optimize", "compose"), default=None, help="Ejecutar solo un grupo de casos")
+    parser.add_argument("--quick", action="store_true", help="Omitir los casos más grandes")
+    parser.add_argument("--backend", default="pngquant", help="Backend de cuantización (pngquant, pillow)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por caso (se toma el mejor tiempo)")
+    parser.add_argument("--target-ratio", type=float, default=DEFAULT_TARGET_RATIO,
+                        help="Objetivo de optimización como fracción del PNG de entrada (0 = objetivo de producción)")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Carpeta del corpus sintético")
+    parser.add_argument("--work-dir", default=None, help="Carpeta para las salidas temporales")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Archivo de línea base")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar los resultados como nueva línea base")
+    parser.add_argument("--output", default=None, help="Guardar también los resultados en este JSON")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS) # Uso interno: un caso en este proceso
+    args = parser.parse_args()
+
+    import tempfile
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="svgcreator_bench_")
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case), args.backend, args.repeat, work_dir, args.target_ratio)))
+        sys.exit(0)
+
+    backend = args.backend
+    if backend == "pngquant":
+        from image_processor import _find_pngquant_exe
+        if not _find_pngquant_exe("tools/pngquant.exe"):
+            print("pngquant no disponible: se usa el backend pillow.")
+            backend = "pillow"
+
+    cases = plan_cases(args.corpus_dir, args.only, args.quick)
+    print(f"Corpus sintético en '{args.corpus_dir}'")
+    build_corpus(args.corpus_dir, cases)
+
+    results = []
+    print(f"\n{'caso':<32} {'tiempo':>9} {'RSS pico':>10} {'salida':>10}")
+    for case in cases:
+        result = run_case_isolated(case, backend, args.repeat, work_dir, args.target_ratio)
+        results.append(result)
+        if result.get("ok"):
+            print(f"{result['name']:<32} {result['seconds']:>8.3f}s {_format_bytes(result['peak_rss_bytes']):>10} {_format_bytes(result['output_bytes']):>10}")
+        else:
+            print(f"{case['name']:<32} ERROR {result.get('error', '')}")
+
+    run_info = {"backend": backend, "repeat": args.repeat, "target_ratio": args.target_ratio, "quick": args.quick,
+                "only": args.only, "python": sys.version.split()[0], "platform": sys.platform,
+                "platform_detail": platform.platform(), "machine": platform.machine(), "cpu_count": os.cpu_count(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(run_info, output_file, indent=2)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(run_info, baseline_file, indent=2)
+        print(f"\nLínea base guardada en '{args.baseline}'.")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        # Los tiempos solo son comparables en la misma máquina y con el mismo backend
+        for key in ("backend", "machine", "cpu_count"):
+            if baseline.get(key) != run_info[key]:
+                print(f"\nAviso: la línea base tiene {key}={baseline.get(key)!r} y esta ejecución {run_info[key]!r}.")
+        regressions = compare_with_baseline(results, baseline)
+        if regressions:
+            print("\nRegresiones respecto a la línea base:")
+            for name, metric, before, after in regressions:
+                print(f"  {name}: {metric} {before} -> {after}")
+        else:
+            print("\nSin regresiones respecto a la línea base.")
+    else:
+        print(f"\nNo hay línea base en '{args.baseline}' (use --save-baseline para crearla).")
+
+    sys.exit(1 if regressions or not all(result.get("ok") for result in results) else 0)
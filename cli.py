@@ -0,0 +1,363 @@
+"""
+Interfaz de línea de comandos de SVGCreator (sin GUI): optimiza cada imagen de
+primer plano con optimize_image_iteratively y la compone sobre el fondo con
+create_final_svg.
+
+Uso:
+    python cli.py run --background fondo.svg --foreground "fotos/*.png" --output-dir salida [--json]
+    python cli.py run --job trabajos.json [--json]
+    python cli.py watch --job trabajos.json [--interval 1] [--debounce 2]
+    python cli.py gui
+
+Un archivo de trabajos es un JSON con una lista de trabajos, o un objeto
+{"defaults": {...}, "jobs": [...]}. Cada trabajo admite las mismas opciones
+que 'run' con guiones bajos (background, foreground, output_dir, search_mode,
+backend, ...); 'foreground' puede ser un patrón glob o una lista de ellos y las
+rutas relativas se resuelven respecto al archivo de trabajos.
+
+'watch' se queda vigilando las entradas de los trabajos y reconstruye solo los
+SVG cuyo primer plano o fondo cambió de contenido (ver watch_folder).
+
+Código de salida: 0 si todo fue bien, 1 si falló alguna composición, 2 si los
+argumentos o el archivo de trabajos no son válidos.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Opciones de un trabajo y su valor por defecto
+JOB_DEFAULTS = {
+    "background": None,
+    "foreground": None,
+    "output_dir": None,
+    "search_mode": "bisect",
+    "backend": "pngquant",
+    "pngquant_exe_rel_path": "tools/pngquant.exe",
+    "cache_dir": None,
+    "min_ssim": None,
+    "stream_output": False,
+    "background_mode": "tree",
+    "compact": False,
+    "precision": None,
+    "foreground_encoding": "png",
+    "foreground_layout": "full",
+    "merge_defs": False,
+    "asset_mode": "inline",
+    "asset_dir": None,
+    "asset_base_url": None,
+    "simplify_tolerance": None,
+}
+# Subcarpeta de salida de las imágenes optimizadas (la misma que usa la GUI)
+OPTIMIZED_SUBDIR = "optimized_main_image"
+
+class JobError(Exception):
+    """Trabajo mal definido (falta una opción, opción desconocida, patrón sin coincidencias...)."""
+
+def load_job_file(job_path):
+    """Lee un archivo de trabajos y devuelve la lista de trabajos con los valores por defecto aplicados."""
+    with open(job_path, "r", encoding="utf-8") as job_file:
+        data = json.load(job_file)
+    defaults = {}
+    if isinstance(data, dict):
+        defaults, data = data.get("defaults", {}), data.get("jobs", [])
+    base_dir = os.path.dirname(os.path.abspath(job_path))
+    jobs = []
+    for entry in data:
+        job = {**defaults, **entry}
+        for key in ("background", "output_dir", "cache_dir", "asset_dir"):
+            if job.get(key):
+                job[key] = os.path.join(base_dir, job[key])
+        patterns = job.get("foreground")
+        if patterns:
+            patterns = [patterns] if isinstance(patterns, str) else patterns
+            job["foreground"] = [os.path.join(base_dir, pattern) for pattern in patterns]
+        jobs.append(job)
+    return jobs
+
+def _option_choices():
+    """Valores admitidos de las opciones con una lista cerrada de valores."""
+    from image_processor import SEARCH_MODES, BACKENDS
+    from svg_generator import BACKGROUND_MODES, FOREGROUND_ENCODINGS, FOREGROUND_LAYOUTS, ASSET_MODES
+    return {"search_mode": SEARCH_MODES, "backend": BACKENDS, "background_mode": BACKGROUND_MODES,
+            "foreground_encoding": FOREGROUND_ENCODINGS, "foreground_layout": FOREGROUND_LAYOUTS,
+            "asset_mode": ASSET_MODES}
+
+def normalize_job(job):
+    unknown = set(job) - set(JOB_DEFAULTS)
+    if unknown:
+        raise JobError(f"opciones desconocidas: {', '.join(sorted(unknown))}")
+    job = {**JOB_DEFAULTS, **job}
+    for key in ("background", "foreground", "output_dir"):
+        if not job[key]:
+            raise JobError(f"falta la opción '{key}'")
+    if isinstance(job["foreground"], str):
+        job["foreground"] = [job["foreground"]]
+    for key, choices in _option_choices().items():
+        if job[key] not in choices:
+            raise JobError(f"valor no válido para '{key}': {job[key]!r} (use uno de {', '.join(choices)})")
+    if job["simplify_tolerance"] is not None and not job["simplify_tolerance"] > 0:
+        raise JobError(f"'simplify_tolerance' debe ser mayor que 0 (se recibió {job['simplify_tolerance']})")
+    return job
+
+def positive_float(text):
+    """Tipo de argparse: número real mayor que 0."""
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' no es un número")
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"debe ser mayor que 0: {text}")
+    return value
+
+def _pattern_base(pattern):
+    """Carpeta fija de un patrón: la parte de su directorio anterior al primer comodín."""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep)[:-1]:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or (os.sep if pattern.startswith(os.sep) else ".")
+
+def expand_foregrounds(patterns, allow_empty=False):
+    """
+    Expande los patrones glob (admite '**') sin duplicados y en orden estable.
+    Devuelve pares (ruta, subcarpeta relativa a la base del patrón), como
+    batch_processor.iter_batch_inputs, para reproducir las subcarpetas en la salida.
+    """
+    paths, seen = [], set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        if not matches and not allow_empty:
+            raise JobError(f"el patrón '{pattern}' no coincide con ningún archivo")
+        base_dir = _pattern_base(pattern)
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                relative_dir = os.path.relpath(os.path.dirname(path) or ".", base_dir)
+                paths.append((path, "" if relative_dir == "." else relative_dir))
+    return paths
+
+def plan_composites(jobs, allow_empty=False):
+    """
+    Lista de tareas (trabajo, primer plano, subcarpeta relativa) de todos los
+    trabajos. Se omiten los archivos de las carpetas de salida (p. ej. las
+    imágenes optimizadas) y lanza JobError si dos imágenes fueran a escribir el
+    mismo SVG.
+    """
+    output_dirs = [os.path.abspath(job["output_dir"]) + os.sep for job in jobs]
+    tasks, owners = [], {}
+    for job in jobs:
+        for foreground_path, relative_dir in expand_foregrounds(job["foreground"], allow_empty):
+            if any(os.path.abspath(foreground_path).startswith(output_dir) for output_dir in output_dirs):
+                continue
+            svg_path = os.path.abspath(composite_path(job, foreground_path, relative_dir))
+            if svg_path in owners:
+                raise JobError(f"'{owners[svg_path]}' y '{foreground_path}' escribirían el mismo SVG '{svg_path}'")
+            owners[svg_path] = foreground_path
+            tasks.append((job, foreground_path, relative_dir))
+    return tasks
+
+def process_foreground(job, foreground_path, relative_dir="", optimized_path=None):
+    """
+    Optimiza y compone una imagen; devuelve un dict con el resultado (nunca lanza).
+    relative_dir es la subcarpeta de la imagen respecto a la base de su patrón y
+    se reproduce en la salida. Con optimized_path (una optimización anterior de
+    la misma imagen) solo se recompone.
+    """
+    from image_processor import optimize_image_iteratively, read_image_size
+    from image_cache import OptimizedImageCache
+    from svg_generator import create_final_svg
+
+    start = time.perf_counter()
+    result = {"foreground": foreground_path, "background": job["background"], "ok": False}
+    try:
+        optimized_dir = os.path.join(job["output_dir"], OPTIMIZED_SUBDIR, relative_dir)
+        cache = OptimizedImageCache(job["cache_dir"]) if job["cache_dir"] else None
+        optimize_report = {}
+        if not optimized_path or not os.path.exists(optimized_path):
+            optimized_path = optimize_image_iteratively(
+                foreground_path, output_dir=optimized_dir, pngquant_exe_rel_path=job["pngquant_exe_rel_path"],
+                search_mode=job["search_mode"], report=optimize_report, cache=cache, backend=job["backend"],
+                min_ssim=job["min_ssim"])
+        result.update({"optimized": optimized_path, "original_size": optimize_report.get("original_size"),
+                       "optimized_size": optimize_report.get("final_size"), "quality": optimize_report.get("quality")})
+        if not optimized_path:
+            result["error"] = "falló la optimización"
+            return result
+
+        fg_size = read_image_size(optimized_path)
+        if fg_size is None:
+            result["error"] = "no se pudo leer el tamaño de la imagen optimizada"
+            return result
+        fg_width, fg_height = fg_size
+        svg_path = composite_path(job, foreground_path, relative_dir)
+        os.makedirs(os.path.dirname(svg_path), exist_ok=True)
+        svg_report = {}
+        svg_ok = create_final_svg(
+            svg_path, job["background"], optimized_path, fg_width, fg_height,
+            stream_output=job["stream_output"], background_mode=job["background_mode"], compact=job["compact"],
+            precision=job["precision"], report=svg_report, foreground_encoding=job["foreground_encoding"],
+            foreground_layout=job["foreground_layout"], merge_defs=job["merge_defs"], asset_mode=job["asset_mode"],
+            asset_dir=job["asset_dir"], asset_base_url=job["asset_base_url"],
+            simplify_tolerance=job["simplify_tolerance"])
+        result.update({"svg": svg_path if svg_ok else None, "svg_size": svg_report.get("output_size"),
+                       "width": fg_width, "height": fg_height, "ok": bool(svg_ok)})
+        if not svg_ok:
+            result["error"] = "falló la creación del SVG"
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+def composite_path(job, foreground_path, relative_dir=""):
+    """Ruta del SVG que se genera para una imagen de primer plano."""
+    return os.path.join(job["output_dir"], relative_dir,
+                        os.path.splitext(os.path.basename(foreground_path))[0] + ".svg")
+
+def run_jobs(jobs, workers=None):
+    """Procesa todos los trabajos (las imágenes de todos ellos en paralelo) y devuelve la lista de resultados."""
+    for job in jobs:
+        os.makedirs(job["output_dir"], exist_ok=True)
+    tasks = plan_composites(jobs)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda task: process_foreground(*task), tasks))
+
+def _job_from_args(args):
+    job = {key: getattr(args, key) for key in JOB_DEFAULTS if getattr(args, key, None) is not None}
+    for flag in ("stream_output", "compact", "merge_defs"):
+        if not job.get(flag):
+            job.pop(flag, None)
+    return job
+
+def _load_jobs(args, allow_empty=False):
+    """Trabajos normalizados a partir de --job o de las opciones; None (con el error en stderr) si no son válidos."""
+    try:
+        jobs = load_job_file(args.job) if args.job else [_job_from_args(args)]
+        jobs = [normalize_job(job) for job in jobs]
+        plan_composites(jobs, allow_empty) # Validar patrones y rutas de salida antes de empezar
+    except (OSError, ValueError, JobError) as e:
+        print(f"Error en los trabajos: {e}", file=sys.stderr)
+        return None
+    if not jobs:
+        print("Error en los trabajos: la lista está vacía", file=sys.stderr)
+        return None
+    return jobs
+
+def _configure_metrics(args):
+    if args.metrics_jsonl or args.metrics_prom:
+        from metrics import configure_metrics
+        configure_metrics(args.metrics_jsonl, args.metrics_prom)
+
+def command_run(args):
+    jobs = _load_jobs(args)
+    if jobs is None:
+        return 2
+    _configure_metrics(args)
+
+    start = time.perf_counter()
+    # Con --json, stdout queda solo para el resultado: los mensajes de progreso van a stderr
+    log_stream = sys.stderr if args.json else sys.stdout
+    with contextlib.redirect_stdout(log_stream):
+        results = run_jobs(jobs, args.workers)
+    failed = [result for result in results if not result["ok"]]
+    summary = {"ok": not failed, "images": len(results), "failed": len(failed),
+               "seconds": round(time.perf_counter() - start, 3), "results": results}
+
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+    else:
+        for result in results:
+            status = f"OK  -> {result['svg']}" if result["ok"] else f"ERROR: {result.get('error')}"
+            print(f"{result['foreground']}: {status}")
+        print(f"{summary['images'] - summary['failed']}/{summary['images']} SVG generados en {summary['seconds']:.2f} s")
+    return 1 if failed else 0
+
+def command_watch(args):
+    from watch_folder import WatchDaemon
+    # Las carpetas vigiladas pueden estar vacías al arrancar: los patrones no se validan
+    jobs = _load_jobs(args, allow_empty=True)
+    if jobs is None:
+        return 2
+    _configure_metrics(args)
+    timing = {name: value for name, value in (("poll_interval", args.interval), ("debounce", args.debounce))
+              if value is not None}
+    daemon = WatchDaemon(jobs, state_path=args.state, workers=args.workers, **timing)
+    results = daemon.run(once=args.once)
+    return 1 if any(not result["ok"] for result in results) else 0
+
+def command_gui(args):
+    from main import App # customtkinter solo se importa al abrir la GUI
+    App().mainloop()
+    return 0
+
+def _add_job_arguments(parser):
+    choices = _option_choices()
+    parser.add_argument("--job", help="Archivo de trabajos JSON (sustituye a las opciones de entrada)")
+    parser.add_argument("--background", help="SVG de fondo")
+    parser.add_argument("--foreground", nargs="+", help="Imágenes de primer plano (rutas o patrones glob)")
+    parser.add_argument("--output-dir", dest="output_dir", help="Carpeta de salida")
+    parser.add_argument("--mode", dest="search_mode", choices=choices["search_mode"],
+                        help="Búsqueda de calidad: linear, bisect (por defecto) o parallel")
+    parser.add_argument("--backend", choices=choices["backend"],
+                        help="Backend de cuantización: pngquant (por defecto) o pillow")
+    parser.add_argument("--pngquant", dest="pngquant_exe_rel_path", help="Ruta de pngquant relativa al directorio actual")
+    parser.add_argument("--cache-dir", dest="cache_dir", help="Caché de imágenes optimizadas")
+    parser.add_argument("--min-ssim", dest="min_ssim", type=float, help="Calidad perceptual mínima (SSIM)")
+    parser.add_argument("--stream", dest="stream_output", action="store_true", help="Escribir el SVG en streaming")
+    parser.add_argument("--background-mode", dest="background_mode", choices=choices["background_mode"],
+                        help="Lectura del fondo: tree (por defecto) o stream")
+    parser.add_argument("--compact", action="store_true", help="SVG compacto (sin pretty-print, fondo minimizado)")
+    parser.add_argument("--precision", type=int, help="Decimales de las coordenadas del fondo")
+    parser.add_argument("--encoding", dest="foreground_encoding", choices=choices["foreground_encoding"],
+                        help="Codificación del primer plano: png o auto")
+    parser.add_argument("--layout", dest="foreground_layout", choices=choices["foreground_layout"],
+                        help="Disposición del primer plano: full, crop o tiles")
+    parser.add_argument("--merge-defs", dest="merge_defs", action="store_true",
+                        help="Fusionar definiciones y reglas CSS repetidas del fondo y prefijar sus IDs")
+    parser.add_argument("--assets", dest="asset_mode", choices=choices["asset_mode"],
+                        help="Imágenes incrustadas en Base64 (inline, por defecto) o en archivos aparte con hash (external)")
+    parser.add_argument("--asset-dir", dest="asset_dir", help="Carpeta de los recursos externos (por defecto <salida>/assets)")
+    parser.add_argument("--asset-base-url", dest="asset_base_url", help="URL base de los recursos externos (en lugar de la ruta relativa)")
+    parser.add_argument("--simplify", dest="simplify_tolerance", type=positive_float,
+                        help="Simplificar los trazados del fondo con esta tolerancia (unidades del lienzo; requiere NumPy)")
+    parser.add_argument("--workers", type=int, default=None, help="Imágenes en paralelo (por defecto, una por núcleo)")
+    parser.add_argument("--metrics-jsonl", default=None, help="Registrar métricas por etapa en este archivo JSON lines")
+    parser.add_argument("--metrics-prom", default=None, help="Escribir totales por etapa en este archivo de Prometheus")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="svgcreator", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Optimizar y componer SVGs sin GUI")
+    _add_job_arguments(run)
+    run.add_argument("--json", action="store_true", help="Escribir el resultado en JSON por stdout")
+    run.set_defaults(handler=command_run)
+
+    watch = subparsers.add_parser("watch", help="Vigilar las entradas y reconstruir los SVG que cambien")
+    _add_job_arguments(watch)
+    watch.add_argument("--interval", type=float, default=None, help="Segundos entre sondeos (por defecto 1)")
+    watch.add_argument("--debounce", type=float, default=None,
+                       help="Segundos sin cambios antes de reconstruir (por defecto 2)")
+    watch.add_argument("--state", default=None, help="Archivo de estado (por defecto <salida>/.svgcreator_watch.json)")
+    watch.add_argument("--once", action="store_true", help="Reconstruir lo que haya cambiado y salir")
+    watch.set_defaults(handler=command_watch)
+
+    gui = subparsers.add_parser("gui", help="Abrir la interfaz gráfica")
+    gui.set_defaults(handler=command_gui)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import io
+import math
+
+from PIL import Image, ImageChops, ImageStat, features
+
+# Codificaciones candidatas para la imagen de primer plano incrustada en el SVG
+ENCODING_CANDIDATES = ("png", "webp", "jpeg+mask")
+# Calidad mínima aceptable frente al PNG de partida (PSNR en dB, canal a canal)
+MIN_PSNR_DB = 36.0
+WEBP_QUALITY = 85
+JPEG_QUALITY = 85
+# Niveles de la máscara de transparencia (4 bits: 16 niveles de gris)
+MASK_LEVELS = 16
+# Lado (px) de los mosaicos en los que se divide el primer plano con foreground_layout="tiles"
+TILE_SIZE = 256
+
+class EncodedForeground(object):
+    """Una codificación candidata: imagen principal, máscara opcional y su calidad medida."""
+
+    def __init__(self, name, mime_type, data, mask_data=None, psnr=math.inf):
+        self.name = name
+        self.mime_type = mime_type
+        self.data = data
+        self.mask_data = mask_data # PNG en escala de grises usado como <mask> de luminancia
+        self.psnr = psnr
+
+    @property
+    def total_bytes(self):
+        return len(self.data) + len(self.mask_data or b"")
+
+    def __repr__(self):
+        return f"EncodedForeground({self.name!r}, {self.total_bytes} bytes, PSNR {self.psnr:.1f} dB)"
+
+def _psnr(reference, candidate):
+    """PSNR mínimo entre canales (RGBA); la diferencia se mide sobre píxeles con color premultiplicado."""
+    def premultiplied(image):
+        black = Image.new("RGBA", image.size, (0, 0, 0, 255))
+        color = Image.alpha_composite(black, image).convert("RGB")
+        return Image.merge("RGBA", (*color.split(), image.getchannel("A")))
+    difference = ImageChops.difference(premultiplied(reference), premultiplied(candidate))
+    worst_rms = max(ImageStat.Stat(difference).rms)
+    return math.inf if worst_rms == 0 else 20 * math.log10(255 / worst_rms)
+
+def _encode_webp(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=6)
+    return buffer.getvalue()
+
+def _encode_jpeg_with_mask(image):
+    """JPEG para el color y, si hay transparencia, una máscara PNG de pocos bits para el alfa."""
+    alpha = image.getchannel("A")
+    color_buffer = io.BytesIO()
+    # Componer sobre negro: con la máscara, el color de los píxeles transparentes no se ve
+    # y el negro comprime mejor que el color "basura" que suelen tener.
+    black = Image.new("RGBA", image.size, (0, 0, 0, 255))
+    Image.alpha_composite(black, image).convert("RGB").save(color_buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+
+    if alpha.getextrema() == (255, 255):
+        return color_buffer.getvalue(), None, alpha # Opaca: no hace falta máscara
+
+    step = 255 / (MASK_LEVELS - 1)
+    levels = alpha.point(lambda value: round(value / step))
+    mask = Image.frombytes("P", image.size, levels.tobytes())
+    mask.putpalette([round(level * step) for level in range(MASK_LEVELS) for _ in range(3)])
+    mask_buffer = io.BytesIO()
+    mask.save(mask_buffer, format="PNG", bits=4, optimize=True)
+    quantized_alpha = levels.point(lambda level: round(level * step))
+    return color_buffer.getvalue(), mask_buffer.getvalue(), quantized_alpha
+
+def encode_foreground_candidates(foreground_path, candidates=ENCODING_CANDIDATES):
+    """
+    Codifica el primer plano (ruta o bytes ya codificados) de cada forma
+    candidata y mide su calidad frente al original.
+    """
+    if isinstance(foreground_path, bytes):
+        original_bytes = foreground_path
+    else:
+        with open(foreground_path, "rb") as image_file:
+            original_bytes = image_file.read()
+    with Image.open(io.BytesIO(original_bytes)) as source_image:
+        original_format = source_image.format
+        image = source_image.convert("RGBA")
+
+    results = []
+    if "png" in candidates:
+        mime_type = "image/jpeg" if original_format == "JPEG" else "image/png"
+        results.append(EncodedForeground("png", mime_type, original_bytes))
+
+    if "webp" in candidates and features.check("webp"):
+        webp_bytes = _encode_webp(image)
+        with Image.open(io.BytesIO(webp_bytes)) as decoded:
+            results.append(EncodedForeground("webp", "image/webp", webp_bytes, psnr=_psnr(image, decoded.convert("RGBA"))))
+
+    if "jpeg+mask" in candidates:
+        jpeg_bytes, mask_bytes, quantized_alpha = _encode_jpeg_with_mask(image)
+        with Image.open(io.BytesIO(jpeg_bytes)) as decoded:
+            reconstructed = decoded.convert("RGB")
+            reconstructed.putalpha(quantized_alpha)
+        results.append(EncodedForeground("jpeg+mask", "image/jpeg", jpeg_bytes, mask_bytes,
+                                         psnr=_psnr(image, reconstructed)))
+    return results
+
+def choose_foreground_encoding(foreground_path, min_psnr=MIN_PSNR_DB, candidates=ENCODING_CANDIDATES):
+    """
+    Devuelve la codificación más pequeña (imagen + máscara) cuya calidad no baja
+    de min_psnr. El PNG original siempre cumple, así que nunca se empeora el tamaño.
+    """
+    encoded = encode_foreground_candidates(foreground_path, candidates)
+    for candidate in encoded:
+        status = "ok" if candidate.psnr >= min_psnr else "descartada"
+        print(f"    Codificación {candidate.name}: {candidate.total_bytes / 1024:.2f} KB, PSNR {candidate.psnr:.1f} dB ({status})")
+    acceptable = [candidate for candidate in encoded if candidate.psnr >= min_psnr]
+    if not acceptable:
+        return None
+    return min(acceptable, key=lambda candidate: candidate.total_bytes)
+
+def _opaque_boxes(alpha, tile_size=None):
+    """
+    Rectángulos (izq, arriba, der, abajo) en px que cubren todos los píxeles no
+    transparentes. Sin tile_size, el rectángulo envolvente del alfa. Con
+    tile_size, por cada fila de mosaicos se unen los mosaicos consecutivos con
+    contenido (menos elementos y menos juntas visibles) y cada tramo se recorta
+    a su propio rectángulo envolvente; los mosaicos vacíos desaparecen.
+    """
+    if tile_size is None:
+        bbox = alpha.getbbox()
+        return [bbox] if bbox else []
+
+    width, height = alpha.size
+    boxes = []
+    for top in range(0, height, tile_size):
+        bottom = min(top + tile_size, height)
+        run_left = None
+        for left in range(0, width + tile_size, tile_size):
+            has_content = left < width and alpha.crop((left, top, min(left + tile_size, width), bottom)).getbbox() is not None
+            if has_content and run_left is None:
+                run_left = left
+            elif not has_content and run_left is not None:
+                run_box = (run_left, top, min(left, width), bottom)
+                inner = alpha.crop(run_box).getbbox()
+                boxes.append((run_box[0] + inner[0], top + inner[1], run_box[0] + inner[2], top + inner[3]))
+                run_left = None
+    return boxes
+
+def split_foreground_regions(foreground_path, tile_size=None):
+    """
+    Recorta las zonas totalmente transparentes del primer plano. Devuelve
+    ((ancho, alto), regiones) donde cada región es (caja_px, bytes_png), o
+    regiones=None si no hay nada que recortar (la imagen se incrusta entera).
+    Las regiones conservan el modo de la imagen (p. ej. la paleta de pngquant).
+    """
+    with Image.open(foreground_path) as source_image:
+        source_image.load()
+        image_size = source_image.size
+        if "A" not in source_image.getbands() and "transparency" not in source_image.info:
+            return image_size, None # Sin canal alfa no hay nada transparente
+        boxes = _opaque_boxes(source_image.convert("RGBA").getchannel("A"), tile_size)
+        if boxes == [(0, 0, *image_size)]:
+            return image_size, None
+
+        regions = []
+        for box in boxes:
+            buffer = io.BytesIO()
+            source_image.crop(box).save(buffer, format="PNG", optimize=True)
+            regions.append((box, buffer.getvalue()))
+    return image_size, regions
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Carpeta y tamaño máximo por defecto de la caché de imágenes optimizadas
+DEFAULT_CACHE_DIR = ".svgcreator_cache"
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024 # 512 MB
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def file_sha256(file_path):
+    """Hash SHA-256 del contenido del archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(input_image_path, settings):
+    """Clave de caché: hash del contenido de la imagen + parámetros de optimización."""
+    digest = hashlib.sha256()
+    digest.update(file_sha256(input_image_path).encode("ascii"))
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+class OptimizedImageCache:
+    """
+    Caché en disco, direccionada por contenido, de imágenes ya optimizadas.
+    Cada entrada es '<clave><ext>' más un '<clave>.json' con el informe de la
+    optimización. La fecha de modificación de la imagen marca el último uso y
+    cuando la caché supera max_bytes se borran las entradas menos usadas (LRU).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_paths(self, key):
+        entry_dir = os.path.join(self.cache_dir, key[:2])
+        return entry_dir, os.path.join(entry_dir, f"{key}.json")
+
+    def get(self, key):
+        """Devuelve (ruta_imagen_cacheada, informe) o None si no está en caché."""
+        entry_dir, meta_path = self._entry_paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            image_path = os.path.join(entry_dir, f"{key}{meta['ext']}")
+            os.utime(image_path) # Marcar como usado recientemente
+        except (OSError, ValueError, KeyError):
+            return None
+        return image_path, meta.get("report", {})
+
+    def put(self, key, image_path, report=None):
+        """Guarda una copia de image_path bajo 'key' de forma atómica y aplica el límite de tamaño."""
+        entry_dir, meta_path = self._entry_paths(key)
+        ext = os.path.splitext(image_path)[1]
+        os.makedirs(entry_dir, exist_ok=True)
+        try:
+            temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=entry_dir)
+            os.close(temp_fd)
+            shutil.copyfile(image_path, temp_path)
+            os.replace(temp_path, os.path.join(entry_dir, f"{key}{ext}"))
+            temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=entry_dir)
+            with os.fdopen(temp_fd, "w", encoding="utf-8") as meta_file:
+                json.dump({"ext": ext, "report": report or {}}, meta_file)
+            os.replace(temp_path, meta_path)
+        except OSError as e:
+            print(f"  Aviso: no se pudo guardar en caché '{image_path}': {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """Borra las entradas menos usadas hasta quedar por debajo de max_bytes."""
+        with self._lock:
+            entries = []
+            total_bytes = 0
+            for dir_path, _, file_names in os.walk(self.cache_dir):
+                for file_name in file_names:
+                    if file_name.endswith((".json", ".tmp")):
+                        continue
+                    image_path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(image_path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, image_path))
+                    total_bytes += stat.st_size
+
+            for _, size_bytes, image_path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                meta_path = os.path.splitext(image_path)[0] + ".json"
+                for path in (meta_path, image_path):
+                    try: os.remove(path)
+                    except OSError: pass
+                total_bytes -= size_bytes
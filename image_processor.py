@@ -1,12 +1,22 @@
+import io
 import os
 import subprocess
 import shutil
+import struct
 import tempfile # Para nombres de archivo temporales en iteraciones
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from image_cache import cache_key
+from image_quality import QualityScorer
+from metrics import timed, record_stage, record_event
 
 # Constante para el tamaño objetivo en bytes (700 KB * 1024 bytes/KB)
 TARGET_SIZE_BYTES = 700 * 1024
 # Margen aceptable por encima del objetivo (ej. 5%)
-ACCEPTABLE_MARGIN_BYTES = TARGET_SIZE_BYTES * 0.05 # 35KB para 700KB -> hasta 735KB
+ACCEPTABLE_MARGIN_RATIO = 0.05
+ACCEPTABLE_MARGIN_BYTES = TARGET_SIZE_BYTES * ACCEPTABLE_MARGIN_RATIO # 35KB para 700KB -> hasta 735KB
 
 # Parámetros para la optimización iterativa
 INITIAL_QUALITY_MIN = 65
@@ -15,33 +25,468 @@ QUALITY_STEP_DOWN = 5  # Cuánto reducir la calidad en cada iteración
 MIN_QUALITY_ALLOWED = 40 # Calidad mínima absoluta
 MAX_ITERATIONS = 5       # Máximo de intentos de optimización
 
-def optimize_image_iteratively(input_image_path, output_dir="optimized_images", pngquant_exe_rel_path="tools/pngquant.exe"):
+# Parámetros para la búsqueda por bisección (search_mode="bisect")
+QUALITY_WINDOW = INITIAL_QUALITY_MAX - INITIAL_QUALITY_MIN # Ancho del rango min-max que se pasa a pngquant
+BISECT_QUALITY_TOLERANCE = 2 # Se deja de bisecar cuando el intervalo de calidad es menor o igual a esto
+
+SEARCH_MODES = ("linear", "bisect", "parallel")
+
+BACKENDS = ("pngquant", "pillow")
+
+# Firma de los archivos PNG (la cabecera IHDR con el ancho y el alto va justo después)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Cada cuánto (segundos) se comprueba la petición de cancelación para matar los pngquant en curso
+CANCEL_POLL_SECONDS = 0.1
+
+# Rutas de pngquant ya encontradas: (raíz del proyecto, ruta relativa) -> ruta absoluta
+_pngquant_exe_paths = {}
+
+def _find_pngquant_exe(pngquant_exe_rel_path):
+    """Devuelve la ruta absoluta a pngquant (en tools/ o en el PATH) o None."""
+    project_root = os.getcwd() # Asume que el script se ejecuta desde la raíz del proyecto
+    cached_path = _pngquant_exe_paths.get((project_root, pngquant_exe_rel_path))
+    if cached_path:
+        return cached_path
+    pngquant_exe_abs_path = os.path.join(project_root, pngquant_exe_rel_path)
+
+    if not os.path.exists(pngquant_exe_abs_path):
+        pngquant_exe_abs_path = shutil.which("pngquant")
+        if not pngquant_exe_abs_path:
+            print(f"Error: pngquant.exe no encontrado en '{os.path.join(project_root, pngquant_exe_rel_path)}' ni en el PATH.")
+            return None
+    _pngquant_exe_paths[(project_root, pngquant_exe_rel_path)] = pngquant_exe_abs_path
+    return pngquant_exe_abs_path
+
+def optimizer_settings(search_mode, backend="pngquant", target_size_bytes=TARGET_SIZE_BYTES, min_ssim=None):
+    """Parámetros de los que depende el resultado de la optimización (parte de la clave de caché)."""
+    settings = {
+        "target_size_bytes": target_size_bytes,
+        "acceptable_margin_bytes": _acceptable_margin(target_size_bytes),
+        "initial_quality": [INITIAL_QUALITY_MIN, INITIAL_QUALITY_MAX],
+        "quality_step_down": QUALITY_STEP_DOWN,
+        "min_quality_allowed": MIN_QUALITY_ALLOWED,
+        "max_iterations": MAX_ITERATIONS,
+        "bisect_quality_tolerance": BISECT_QUALITY_TOLERANCE,
+        "search_mode": search_mode,
+        "backend": backend
+    }
+    if min_ssim is not None: # Solo si se usa, para no invalidar las entradas de caché anteriores
+        settings["min_ssim"] = min_ssim
+    return settings
+
+def _acceptable_margin(target_size_bytes):
+    if target_size_bytes == TARGET_SIZE_BYTES:
+        return ACCEPTABLE_MARGIN_BYTES
+    return target_size_bytes * ACCEPTABLE_MARGIN_RATIO
+
+def _fits_target(size_bytes, target_size_bytes=TARGET_SIZE_BYTES):
+    return size_bytes <= target_size_bytes + _acceptable_margin(target_size_bytes)
+
+def _linear_quality_levels():
+    """Rangos (min, max) que recorre la estrategia lineal original."""
+    levels = []
+    current_quality_min = INITIAL_QUALITY_MIN
+    current_quality_max = INITIAL_QUALITY_MAX
+    for _ in range(MAX_ITERATIONS):
+        levels.append((current_quality_min, current_quality_max))
+        current_quality_min -= QUALITY_STEP_DOWN
+        current_quality_max -= QUALITY_STEP_DOWN
+        if current_quality_min < MIN_QUALITY_ALLOWED:
+            break
+    return levels
+
+def _pngquant_command(pngquant_exe, quality_min, quality_max, input_image_path=None, output_path=None):
+    command = [
+        pngquant_exe,
+        "--force",
+        f"--quality={quality_min}-{quality_max}",
+        "--skip-if-larger",
+        # Considerar "--speed=1" para mejor calidad/compresión, pero más lento
+    ]
+    if input_image_path is None:
+        return command + ["-"] # Leer de stdin y escribir el resultado en stdout
+    return command + [
+        "--output", output_path,
+        input_image_path # Siempre optimizar desde el original para esta estrategia
+    ]
+
+def _communicate_pngquant(command, level, running=None, input_bytes=None):
+    """
+    Lanza pngquant y espera su resultado. Devuelve (código, stdout) o None si
+    hubo timeout o error. Si se pasa el dict 'running', el proceso se registra
+    en él mientras corre para que otro hilo pueda matarlo (búsqueda en
+    paralelo); un valor False en 'running' para este rango indica que ya fue
+    descartado.
+    """
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if input_bytes is not None else None,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if running is not None and running.setdefault(level, process) is not process:
+            process.kill() # Descartado mientras arrancaba
+        try:
+            stdout, stderr = process.communicate(input=input_bytes, timeout=60) # Timeout de 60s
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            if running is not None:
+                running.pop(level, None)
+
+        if stdout and input_bytes is None: print(f"  pngquant stdout: {stdout.decode(errors='replace').strip()}")
+        if stderr: print(f"  pngquant stderr: {stderr.decode(errors='replace').strip()}") # stderr puede tener info útil
+        return process.returncode, stdout
+    except subprocess.TimeoutExpired:
+        print(f"  Timeout durante la ejecución de pngquant (calidad {level[0]}-{level[1]}).")
+    except Exception as e_iter:
+        print(f"  Error en la iteración de pngquant: {e_iter}")
+    return None
+
+def _run_pngquant(pngquant_exe, input_image_path, output_path, quality_min, quality_max, running=None):
+    """
+    Ejecuta una pasada de pngquant desde el original hacia output_path.
+    Devuelve el tamaño en bytes del resultado o None si no hubo salida válida.
+    """
+    command = _pngquant_command(pngquant_exe, quality_min, quality_max, input_image_path, output_path)
+    result = _communicate_pngquant(command, (quality_min, quality_max), running)
+    if result is None:
+        return None
+    returncode, _ = result
+    if returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        size_bytes = os.path.getsize(output_path)
+        print(f"  Resultado iteración: {size_bytes / 1024:.2f} KB")
+        return size_bytes
+    print(f"  pngquant no generó archivo de salida válido (código: {returncode}). Puede ser por --skip-if-larger.")
+    return None
+
+def _run_pngquant_in_memory(pngquant_exe, source_bytes, quality_min, quality_max, running=None):
+    """
+    Igual que _run_pngquant pero pasando la imagen por stdin y leyendo el
+    resultado de stdout, sin tocar el disco. Devuelve los bytes o None.
+    """
+    command = _pngquant_command(pngquant_exe, quality_min, quality_max)
+    result = _communicate_pngquant(command, (quality_min, quality_max), running, input_bytes=source_bytes)
+    if result is None:
+        return None
+    returncode, output_bytes = result
+    if returncode == 0 and output_bytes:
+        print(f"  Resultado iteración: {len(output_bytes) / 1024:.2f} KB")
+        return output_bytes
+    print(f"  pngquant no devolvió una imagen válida (código: {returncode}). Puede ser por --skip-if-larger.")
+    return None
+
+class QuantizerBackend:
+    """
+    Interfaz de los backends de cuantización en memoria. Se crea una vez por
+    imagen con sus bytes originales y quantize() devuelve el PNG resultante
+    para un rango de calidad, o None si no hay resultado válido (incluido el
+    caso de que sea más grande que el original, como --skip-if-larger).
+    """
+    name = None
+
+    def __init__(self, source_bytes):
+        self.source_bytes = source_bytes
+
+    def quantize(self, quality_min, quality_max, running=None):
+        raise NotImplementedError
+
+class PngquantBackend(QuantizerBackend):
+    """Un proceso pngquant por llamada, con la imagen por stdin/stdout."""
+    name = "pngquant"
+
+    def __init__(self, source_bytes, pngquant_exe):
+        super().__init__(source_bytes)
+        self.pngquant_exe = pngquant_exe
+
+    def quantize(self, quality_min, quality_max, running=None):
+        return _run_pngquant_in_memory(self.pngquant_exe, self.source_bytes, quality_min, quality_max, running)
+
+class PillowBackend(QuantizerBackend):
+    """
+    Cuantización dentro del proceso con Pillow: la imagen se decodifica una
+    sola vez y cada calidad solo cuesta la cuantización y la codificación PNG.
+    La calidad se traduce a un número de colores de la paleta (no es la misma
+    métrica que pngquant, pero es monótona: menos calidad, menos colores).
+    """
+    name = "pillow"
+
+    def __init__(self, source_bytes):
+        super().__init__(source_bytes)
+        from PIL import Image # Importación diferida: solo hace falta con este backend
+        self._image_module = Image
+        with Image.open(io.BytesIO(source_bytes)) as source_image:
+            self.image = source_image.convert("RGBA")
+
+    @staticmethod
+    def colors_for_quality(quality_max):
+        return max(2, min(256, round(256 * (quality_max / 100) ** 2)))
+
+    def quantize(self, quality_min, quality_max, running=None):
+        colors = self.colors_for_quality(quality_max)
+        try:
+            quantized = self.image.quantize(colors=colors, method=self._image_module.Quantize.FASTOCTREE)
+            buffer = io.BytesIO()
+            quantized.save(buffer, format="PNG", optimize=True)
+        except Exception as e_quant:
+            print(f"  Error al cuantizar con Pillow ({colors} colores): {e_quant}")
+            return None
+        output_bytes = buffer.getvalue()
+        if len(output_bytes) >= len(self.source_bytes):
+            print(f"  Pillow ({colors} colores) no reduce el tamaño del original.")
+            return None
+        print(f"  Resultado iteración: {len(output_bytes) / 1024:.2f} KB ({colors} colores)")
+        return output_bytes
+
+def create_quantizer_backend(backend, source_bytes, pngquant_exe=None):
+    """Crea el backend de cuantización 'pngquant' o 'pillow' para unos bytes de imagen."""
+    if backend == "pillow":
+        return PillowBackend(source_bytes)
+    return PngquantBackend(source_bytes, pngquant_exe)
+
+def write_file_atomically(file_path, data):
+    """Escribe 'data' en un temporal de la misma carpeta y lo renombra sobre file_path."""
+    temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=".", dir=os.path.dirname(file_path) or ".")
+    try:
+        with os.fdopen(temp_fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def read_image_size(image_path):
+    """
+    Devuelve (ancho, alto) de una imagen leyendo solo la cabecera IHDR si es un
+    PNG (24 bytes, sin decodificar los píxeles). Para otros formatos se usa
+    Pillow, que también se limita a la cabecera al abrir. None si falla.
+    """
+    try:
+        with open(image_path, "rb") as image_file:
+            header = image_file.read(24)
+        if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+            return struct.unpack(">II", header[16:24])
+        from PIL import Image # Importación diferida: solo para formatos que no son PNG
+        with Image.open(image_path) as image:
+            return image.size
+    except Exception as e:
+        print(f"Error al leer el tamaño de '{image_path}': {e}")
+        return None
+
+def _linear_quality_search(probe, target_size_bytes=TARGET_SIZE_BYTES):
+    """Estrategia original: baja la calidad en pasos fijos hasta alcanzar el objetivo."""
+    levels = _linear_quality_levels()
+    for i, (quality_min, quality_max) in enumerate(levels):
+        print(f"\nIteración {i+1}/{MAX_ITERATIONS}: Calidad objetivo {quality_min}-{quality_max}")
+        size_bytes = probe(quality_min, quality_max)
+        if size_bytes is not None and _fits_target(size_bytes, target_size_bytes):
+            return
+        if getattr(probe, "cancelled", False):
+            return
+        if getattr(probe, "quality_floor_reached", False):
+            print("  Calidad perceptual por debajo del mínimo: bajar más la calidad solo empeoraría la imagen.")
+            return
+    if levels and levels[-1][0] - QUALITY_STEP_DOWN < MIN_QUALITY_ALLOWED:
+        print("  Alcanzada calidad mínima permitida.")
+
+def _predict_quality(ok_quality, ok_size, fail_quality, fail_size, target_size_bytes=TARGET_SIZE_BYTES):
+    """
+    Estima la calidad mínima (qmin) que daría un archivo del tamaño objetivo,
+    interpolando linealmente entre el extremo que cumple y el que no.
+    Si falta algún tamaño (p. ej. pngquant no produjo salida) se usa el punto medio.
+    """
+    midpoint = (ok_quality + fail_quality) // 2
+    if ok_size is None or fail_size is None or fail_size <= ok_size:
+        return midpoint
+    target = target_size_bytes + _acceptable_margin(target_size_bytes) / 2 # Apuntar al centro de la banda aceptable
+    fraction = (target - ok_size) / (fail_size - ok_size)
+    predicted = ok_quality + int(fraction * (fail_quality - ok_quality))
+    # Mantener la predicción estrictamente dentro del intervalo para que siempre avance
+    return min(max(predicted, ok_quality + 1), fail_quality - 1)
+
+def _bisect_quality_search(probe, target_size_bytes=TARGET_SIZE_BYTES):
+    """
+    Busca la calidad más alta que cumple el objetivo con el menor número de pasadas:
+    prueba los extremos del rango, predice la calidad a partir de sus tamaños y
+    biseca el intervalo restante (alternando predicción y punto medio).
+    """
+    def run(quality_min):
+        quality_max = min(quality_min + QUALITY_WINDOW, 100)
+        print(f"\nBisección: Calidad objetivo {quality_min}-{quality_max}")
+        return probe(quality_min, quality_max)
+
+    # 1) Calidad inicial: si ya cumple no hace falta buscar más.
+    fail_quality = INITIAL_QUALITY_MIN
+    fail_size = run(fail_quality)
+    if fail_size is not None and _fits_target(fail_size, target_size_bytes):
+        return
+
+    # 2) Calidad mínima permitida: si tampoco cumple, ninguna intermedia lo hará.
+    ok_quality = MIN_QUALITY_ALLOWED
+    ok_size = run(ok_quality)
+    if ok_size is None or not _fits_target(ok_size, target_size_bytes):
+        print("  Ni la calidad mínima permitida alcanza el objetivo.")
+        return
+
+    calls = 2
+    use_prediction = True
+    while fail_quality - ok_quality > BISECT_QUALITY_TOLERANCE and calls < MAX_ITERATIONS:
+        if getattr(probe, "cancelled", False):
+            return
+        if ok_size >= target_size_bytes - _acceptable_margin(target_size_bytes): # Ya a menos de un margen del objetivo, no vale la pena seguir
+            break
+        if use_prediction:
+            quality_min = _predict_quality(ok_quality, ok_size, fail_quality, fail_size, target_size_bytes)
+        else:
+            quality_min = (ok_quality + fail_quality) // 2
+        use_prediction = not use_prediction
+
+        size_bytes = run(quality_min)
+        calls += 1
+        if size_bytes is not None and _fits_target(size_bytes, target_size_bytes):
+            ok_quality, ok_size = quality_min, size_bytes
+        else:
+            fail_quality, fail_size = quality_min, size_bytes
+    print(f"  Bisección terminada: calidad {ok_quality}-{min(ok_quality + QUALITY_WINDOW, 100)} ({ok_size / 1024:.2f} KB).")
+
+def _parallel_quality_search(probe, max_workers=None, target_size_bytes=TARGET_SIZE_BYTES, running=None):
+    """
+    Lanza varios rangos de calidad a la vez (cada pasada parte del original, así
+    que son independientes) en un pool acotado de procesos pngquant. En cuanto un
+    rango cumple el objetivo se matan los de calidad inferior; el ganador es el de
+    mayor calidad que cumple, conocido cuando terminan todos los superiores.
+    'running' permite compartir el registro de procesos con quien llama (p. ej.
+    para matarlos todos al cancelar).
+    """
+    levels = _linear_quality_levels()
+    workers = max_workers or min(len(levels), os.cpu_count() or 1)
+    print(f"\nBúsqueda en paralelo: {len(levels)} rangos de calidad con {workers} procesos pngquant")
+
+    # (calidad_min, calidad_max) -> Popen en ejecución, o False si se descartó
+    running = {} if running is None else running
+    results = {} # (calidad_min, calidad_max) -> tamaño o None
+    killed = set()
+
+    def run_level(quality_min, quality_max):
+        if running.get((quality_min, quality_max)) is False:
+            return None # Descartado antes de arrancar
+        return probe(quality_min, quality_max, running)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_level, quality_min, quality_max): (quality_min, quality_max)
+                   for quality_min, quality_max in levels}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = None if future.cancelled() else future.result()
+
+            # 'levels' va de mayor a menor calidad: buscar el primer rango que cumple
+            # y si todos los superiores ya terminaron (sin cumplir) tenemos ganador.
+            winner_known = False
+            for index, level in enumerate(levels):
+                size_bytes = results.get(level)
+                if size_bytes is not None and _fits_target(size_bytes, target_size_bytes):
+                    losers = levels[index + 1:]
+                    winner_known = all(higher in results for higher in levels[:index])
+                    break
+            else:
+                continue
+
+            for future in list(pending):
+                if futures[future] in losers and future.cancel():
+                    pending.discard(future)
+            for loser in losers:
+                process = running.setdefault(loser, False)
+                if process is not False and loser not in killed and process.poll() is None:
+                    killed.add(loser)
+                    print(f"  Cancelando pngquant {loser[0]}-{loser[1]} (ya hay un rango de mayor calidad que cumple).")
+                    process.kill()
+            if winner_known:
+                break
+
+def optimize_image_iteratively(input_image_path, output_dir="optimized_images", pngquant_exe_rel_path="tools/pngquant.exe",
+                               search_mode="linear", report=None, max_workers=None, cache=None, in_memory=False,
+                               backend="pngquant", target_size_bytes=None, min_ssim=None, progress_callback=None,
+                               cancel_event=None):
     """
     Optimiza una imagen PNG usando pngquant, intentando iterativamente
-    alcanzar TARGET_SIZE_BYTES ajustando la calidad.
+    alcanzar TARGET_SIZE_BYTES (u otro objetivo en target_size_bytes, con el
+    mismo margen proporcional) ajustando la calidad.
+
+    search_mode: "linear" baja la calidad en pasos de QUALITY_STEP_DOWN;
+    "bisect" predice y biseca el rango de calidad para usar menos pasadas;
+    "parallel" prueba varios rangos a la vez en hasta max_workers procesos
+    (por defecto uno por núcleo).
+    Si se pasa un dict en 'report', se rellena con el número de llamadas a
+    pngquant, la calidad elegida y los tamaños original y final.
+    Con 'cache' (un image_cache.OptimizedImageCache) se reutiliza el resultado
+    de una ejecución anterior con la misma imagen y los mismos parámetros.
+    Con in_memory=True la imagen se pasa a pngquant por stdin y cada resultado
+    se lee de stdout; solo el candidato elegido se escribe (atómicamente) en disco.
+    backend: "pngquant" (proceso externo) o "pillow" (cuantización dentro del
+    proceso, decodificando la imagen una sola vez; implica in_memory=True).
+    min_ssim: calidad perceptual mínima (SSIM sobre la luminancia reducida, ver
+    image_quality). Cada candidato se puntúa en memoria; la búsqueda lineal se
+    detiene en cuanto un rango baja del mínimo y nunca se entrega un candidato
+    por debajo de él (si ninguno cumple tamaño y calidad a la vez, se prefiere
+    el más pequeño que cumple la calidad, y si no hay ninguno, el original).
+    El SSIM del resultado se añade al informe.
+    Si la instrumentación está activa (ver metrics) se registran las etapas
+    "quantize" (cada pasada), "quality_score" y "optimize" (total).
+    progress_callback: función que recibe un dict por cada paso ({"stage":
+    "start"}, {"stage": "iteration", "quality", "iteration", "size"} y {"stage":
+    "done", "final_size"}); se llama desde el hilo que optimiza (o desde los
+    hilos de la búsqueda en paralelo), así que debe ser segura entre hilos
+    (p. ej. queue.Queue.put).
+    cancel_event: threading.Event; al activarlo se matan los pngquant en curso,
+    no se lanzan más pasadas, se borran los temporales y se devuelve None con
+    report["cancelled"] = True. Con el backend "pillow" la pasada en curso
+    termina antes de parar.
     """
+    optimize_start = time.perf_counter()
     try:
-        project_root = os.getcwd() # Asume que el script se ejecuta desde la raíz del proyecto
-        pngquant_exe_abs_path = os.path.join(project_root, pngquant_exe_rel_path)
+        if search_mode not in SEARCH_MODES:
+            print(f"Error: modo de búsqueda desconocido '{search_mode}'. Opciones: {', '.join(SEARCH_MODES)}.")
+            return None
+        if backend not in BACKENDS:
+            print(f"Error: backend de cuantización desconocido '{backend}'. Opciones: {', '.join(BACKENDS)}.")
+            return None
+        in_memory = in_memory or backend != "pngquant"
+        target_size_bytes = target_size_bytes or TARGET_SIZE_BYTES
+        target_limit_bytes = target_size_bytes + _acceptable_margin(target_size_bytes)
 
-        if not os.path.exists(pngquant_exe_abs_path):
-            pngquant_exe_abs_path = shutil.which("pngquant")
+        pngquant_exe_abs_path = None
+        if backend == "pngquant":
+            pngquant_exe_abs_path = _find_pngquant_exe(pngquant_exe_rel_path)
             if not pngquant_exe_abs_path:
-                print(f"Error: pngquant.exe no encontrado en '{os.path.join(project_root, pngquant_exe_rel_path)}' ni en el PATH.")
                 return None
 
         original_file_size_bytes = os.path.getsize(input_image_path)
         filename = os.path.basename(input_image_path)
         name_part, ext_part = os.path.splitext(filename)
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        os.makedirs(output_dir, exist_ok=True) # exist_ok: varios workers de un lote pueden crearlo a la vez
         
         final_output_path = os.path.join(output_dir, f"{name_part}_optimized{ext_part}")
 
+        report = {} if report is None else report
+        report.update({"search_mode": search_mode, "backend": backend, "pngquant_calls": 0, "quality": None,
+                       "original_size": original_file_size_bytes, "final_size": None, "cache_hit": False,
+                       "cancelled": False})
+
+        def notify_progress(stage, **fields):
+            if progress_callback is not None:
+                progress_callback({"stage": stage, **fields})
+        notify_progress("start", original_size=original_file_size_bytes)
+        if min_ssim is not None and not QualityScorer.available():
+            print("Aviso: NumPy no está instalado; se ignora min_ssim (solo se optimiza por tamaño).")
+            min_ssim = None
+
         # Si la imagen original ya está dentro del objetivo + margen, podemos copiarla
-        if original_file_size_bytes <= TARGET_SIZE_BYTES + ACCEPTABLE_MARGIN_BYTES:
-            print(f"Info: '{filename}' ({original_file_size_bytes / 1024:.2f} KB) ya está dentro o cerca del objetivo ({ (TARGET_SIZE_BYTES + ACCEPTABLE_MARGIN_BYTES) / 1024:.0f} KB).")
+        if original_file_size_bytes <= target_limit_bytes:
+            print(f"Info: '{filename}' ({original_file_size_bytes / 1024:.2f} KB) ya está dentro o cerca del objetivo ({target_limit_bytes / 1024:.0f} KB).")
             # Considerar una optimización suave aquí si se desea, por ahora copiamos.
             # Ejemplo de optimización suave:
             # command_gentle = [pngquant_exe_abs_path, "--force", "--quality=85-95", "--skip-if-larger",
@@ -56,97 +501,151 @@ def optimize_image_iteratively(input_image_path, output_dir="optimized_images",
 
             shutil.copy(input_image_path, final_output_path)
             print(f"Imagen copiada a: '{final_output_path}'")
+            report["final_size"] = original_file_size_bytes
+            notify_progress("done", final_size=original_file_size_bytes)
+            record_stage("optimize", time.perf_counter() - optimize_start, backend=backend, search_mode=search_mode,
+                         iterations=0, bytes_in=original_file_size_bytes, bytes_out=original_file_size_bytes)
             return final_output_path
 
-        current_quality_min = INITIAL_QUALITY_MIN
-        current_quality_max = INITIAL_QUALITY_MAX
-        best_attempt_file_path = None # Ruta al archivo del mejor intento
-        best_attempt_file_size = float('inf') # Tamaño del mejor intento
+        if cache is not None:
+            key = cache_key(input_image_path, optimizer_settings(search_mode, backend, target_size_bytes, min_ssim))
+            cached = cache.get(key)
+            if cached:
+                cached_path, cached_report = cached
+                shutil.copyfile(cached_path, final_output_path)
+                report.update(cached_report)
+                report.update({"pngquant_calls": 0, "cache_hit": True})
+                print(f"Caché: resultado reutilizado para '{filename}' ({os.path.getsize(final_output_path) / 1024:.2f} KB, calidad {report['quality']}).")
+                record_event("cache_hit", image=filename, bytes_out=report.get("final_size"))
+                notify_progress("done", final_size=report.get("final_size"))
+                return final_output_path
+
+        # Resultados de cada pasada: (calidad_min, calidad_max) -> (ruta temporal o bytes, tamaño)
+        attempts = {}
+        # SSIM de cada pasada frente al original (solo con min_ssim)
+        scores = {}
+        scorer = QualityScorer(input_image_path) if min_ssim is not None else None
+
+        def record_score(quality_min, quality_max, candidate):
+            if scorer is None:
+                return
+            with timed("quality_score", quality=f"{quality_min}-{quality_max}"):
+                score = scorer.score(candidate)
+            scores[(quality_min, quality_max)] = score
+            print(f"  SSIM {quality_min}-{quality_max}: {score:.4f} (mínimo {min_ssim})")
+            if score < min_ssim:
+                probe.quality_floor_reached = True
+
+        calls_lock = threading.Lock()
+        if in_memory:
+            with open(input_image_path, "rb") as source_file:
+                quantizer = create_quantizer_backend(backend, source_file.read(), pngquant_exe_abs_path)
+
+        def probe_in_memory(quality_min, quality_max, running=None):
+            with calls_lock:
+                probe.calls += 1
+                iteration = probe.calls
+            with timed("quantize", backend=backend, quality=f"{quality_min}-{quality_max}",
+                       bytes_in=original_file_size_bytes) as span:
+                output_bytes = quantizer.quantize(quality_min, quality_max, running)
+                span["bytes_out"] = len(output_bytes) if output_bytes else None
+            if output_bytes is None:
+                return None
+            attempts[(quality_min, quality_max)] = (output_bytes, len(output_bytes))
+            record_score(quality_min, quality_max, output_bytes)
+            notify_progress("iteration", quality=f"{quality_min}-{quality_max}", iteration=iteration, size=len(output_bytes))
+            return len(output_bytes)
 
-        # Lista para rastrear archivos temporales creados que no sean el 'best_attempt_file_path'
-        temp_files_to_clean = []
+        # Procesos pngquant en curso de cualquier modo de búsqueda (para matarlos al cancelar)
+        active = {}
 
-        for i in range(MAX_ITERATIONS):
-            print(f"\nIteración {i+1}/{MAX_ITERATIONS}: Calidad objetivo {current_quality_min}-{current_quality_max}")
-            
+        def probe(quality_min, quality_max, running=None):
+            if cancel_event is not None and cancel_event.is_set():
+                probe.cancelled = True
+                return None
+            running = active if running is None else running
+            if in_memory:
+                return probe_in_memory(quality_min, quality_max, running)
             # Usar un nombre de archivo temporal para la salida de esta iteración
-            temp_fd, current_iteration_output_path = tempfile.mkstemp(suffix="_iter.png", prefix=f"{name_part}_q{current_quality_min}-", dir=output_dir)
+            temp_fd, current_iteration_output_path = tempfile.mkstemp(suffix="_iter.png", prefix=f"{name_part}_q{quality_min}-", dir=output_dir)
             os.close(temp_fd)
+            with calls_lock:
+                probe.calls += 1
+                iteration = probe.calls
+            with timed("quantize", backend=backend, quality=f"{quality_min}-{quality_max}",
+                       bytes_in=original_file_size_bytes) as span:
+                size_bytes = _run_pngquant(pngquant_exe_abs_path, input_image_path, current_iteration_output_path, quality_min, quality_max, running)
+                span["bytes_out"] = size_bytes
+            if size_bytes is None:
+                if os.path.exists(current_iteration_output_path): # Si creó un archivo (quizás vacío o erróneo), borrarlo
+                    os.remove(current_iteration_output_path)
+            else:
+                attempts[(quality_min, quality_max)] = (current_iteration_output_path, size_bytes)
+                record_score(quality_min, quality_max, current_iteration_output_path)
+            notify_progress("iteration", quality=f"{quality_min}-{quality_max}", iteration=iteration, size=size_bytes)
+            return size_bytes
+        probe.calls = 0
+        probe.quality_floor_reached = False
+        probe.cancelled = False
+
+        search_done = threading.Event()
+
+        def kill_on_cancel():
+            # Se repite hasta el final de la búsqueda por si arranca otro proceso justo después
+            while not search_done.wait(CANCEL_POLL_SECONDS):
+                if cancel_event.is_set():
+                    probe.cancelled = True
+                    for process in list(active.values()):
+                        if process is not False and process.poll() is None:
+                            process.kill()
+
+        if cancel_event is not None:
+            threading.Thread(target=kill_on_cancel, name="optimize-cancel", daemon=True).start()
+        try:
+            if search_mode == "bisect":
+                _bisect_quality_search(probe, target_size_bytes)
+            elif search_mode == "parallel":
+                _parallel_quality_search(probe, max_workers, target_size_bytes, active)
+            else:
+                _linear_quality_search(probe, target_size_bytes)
+        finally:
+            search_done.set()
+
+        if probe.cancelled or (cancel_event is not None and cancel_event.is_set()):
+            for temp_file, _ in attempts.values():
+                if isinstance(temp_file, str) and os.path.exists(temp_file):
+                    try: os.remove(temp_file)
+                    except OSError: pass
+            print("Optimización cancelada.")
+            report.update({"pngquant_calls": probe.calls, "cancelled": True})
+            return None
 
-            command = [
-                pngquant_exe_abs_path,
-                "--force",
-                f"--quality={current_quality_min}-{current_quality_max}",
-                "--skip-if-larger",
-                # Considerar "--speed=1" para mejor calidad/compresión, pero más lento
-                "--output", current_iteration_output_path,
-                input_image_path # Siempre optimizar desde el original para esta estrategia
-            ]
-
-            try:
-                process = subprocess.run(command, check=False, capture_output=True, text=True, timeout=60) # Timeout de 60s
-                
-                if process.stdout: print(f"  pngquant stdout: {process.stdout.strip()}")
-                if process.stderr: print(f"  pngquant stderr: {process.stderr.strip()}") # stderr puede tener info útil
-
-                if process.returncode == 0 and os.path.exists(current_iteration_output_path) and os.path.getsize(current_iteration_output_path) > 0 :
-                    current_iteration_file_size = os.path.getsize(current_iteration_output_path)
-                    print(f"  Resultado iteración: {current_iteration_file_size / 1024:.2f} KB")
-
-                    # Si este es el mejor hasta ahora (más pequeño Y mejor que el original si el original era el "mejor")
-                    if current_iteration_file_size < best_attempt_file_size:
-                        if best_attempt_file_path and best_attempt_file_path != current_iteration_output_path: # Si había un 'mejor' anterior y no es este mismo
-                            temp_files_to_clean.append(best_attempt_file_path) # Añadir el antiguo 'mejor' a la limpieza
-                        best_attempt_file_path = current_iteration_output_path
-                        best_attempt_file_size = current_iteration_file_size
-                    elif current_iteration_output_path != best_attempt_file_path: # No fue mejor y no es el 'mejor' actual
-                         temp_files_to_clean.append(current_iteration_output_path)
-
-
-                    if current_iteration_file_size <= TARGET_SIZE_BYTES + ACCEPTABLE_MARGIN_BYTES:
-                        print(f"  ¡Objetivo ({ (TARGET_SIZE_BYTES + ACCEPTABLE_MARGIN_BYTES) / 1024:.0f} KB) alcanzado ({current_iteration_file_size / 1024:.2f} KB)!")
-                        # Mover el archivo exitoso al nombre final
-                        if os.path.exists(final_output_path) and final_output_path != best_attempt_file_path: os.remove(final_output_path)
-                        shutil.move(best_attempt_file_path, final_output_path)
-                        # Limpiar otros archivos temporales de iteraciones
-                        for temp_file in temp_files_to_clean:
-                            if os.path.exists(temp_file) and temp_file != final_output_path:
-                                try: os.remove(temp_file)
-                                except OSError: pass # Ignorar si no se puede borrar por alguna razón
-                        return final_output_path
-                else:
-                    print(f"  pngquant no generó archivo de salida válido (código: {process.returncode}). Puede ser por --skip-if-larger.")
-                    if os.path.exists(current_iteration_output_path): # Si creó un archivo (quizás vacío o erróneo), borrarlo
-                        os.remove(current_iteration_output_path)
-                    # Si es la primera iteración y falla, el "mejor" sigue siendo el original
-                    if i == 0 and best_attempt_file_size == float('inf'):
-                        best_attempt_file_path = None # Indicar que no hay un intento optimizado válido aún
-                        best_attempt_file_size = original_file_size_bytes # El original es el "mejor" hasta ahora
-            
-            except subprocess.TimeoutExpired:
-                print(f"  Timeout durante la ejecución de pngquant en la iteración {i+1}.")
-                if os.path.exists(current_iteration_output_path): os.remove(current_iteration_output_path)
-            except Exception as e_iter:
-                print(f"  Error en la iteración de pngquant: {e_iter}")
-                if os.path.exists(current_iteration_output_path): os.remove(current_iteration_output_path)
-
-            current_quality_min -= QUALITY_STEP_DOWN
-            current_quality_max -= QUALITY_STEP_DOWN
-            if current_quality_min < MIN_QUALITY_ALLOWED:
-                print("  Alcanzada calidad mínima permitida.")
-                break
-        
         # Fin del bucle de iteraciones
         print("\nFin de las iteraciones de optimización.")
+        print(f"Llamadas a {backend}: {probe.calls}")
+
+        # Preferir la calidad más alta que cumple el objetivo; si ninguna cumple, el intento más pequeño.
+        # Con min_ssim solo cuentan los intentos que además conservan la calidad perceptual.
+        candidates = [quality for quality in attempts if scorer is None or scores.get(quality, 0) >= min_ssim]
+        if scorer is not None and len(candidates) < len(attempts):
+            print(f"  {len(attempts) - len(candidates)} intento(s) descartado(s) por SSIM inferior a {min_ssim}.")
+        fitting = [quality for quality in candidates if _fits_target(attempts[quality][1], target_size_bytes)]
+        if fitting:
+            best_quality = max(fitting)
+            print(f"  ¡Objetivo ({target_limit_bytes / 1024:.0f} KB) alcanzado ({attempts[best_quality][1] / 1024:.2f} KB)!")
+        elif candidates:
+            best_quality = min(candidates, key=lambda quality: attempts[quality][1])
+        else:
+            best_quality = None
+
         final_decision_path = None
-        if best_attempt_file_path and best_attempt_file_size < original_file_size_bytes:
+        if best_quality is not None and attempts[best_quality][1] < original_file_size_bytes:
+            best_attempt_file_path, best_attempt_file_size = attempts[best_quality]
             print(f"Mejor intento optimizado ({best_attempt_file_size / 1024:.2f} KB) es mejor que el original. Usando este.")
             final_decision_path = best_attempt_file_path
-        else: # Si no hubo mejora o no hubo 'best_attempt_file_path' válido de optimización
+        else: # Si no hubo mejora o no hubo intento válido de optimización
             print("No se encontró una optimización mejor que el original o que cumpliera el objetivo. Copiando original.")
-            # Si 'best_attempt_file_path' existe y no es el original, es un temp que no sirvió.
-            if best_attempt_file_path and os.path.exists(best_attempt_file_path) and best_attempt_file_path != input_image_path:
-                temp_files_to_clean.append(best_attempt_file_path)
+            best_quality = None
             final_decision_path = input_image_path # Usar el original
 
         # Mover/copiar el archivo decidido al path final
@@ -154,18 +653,33 @@ def optimize_image_iteratively(input_image_path, output_dir="optimized_images",
             if os.path.exists(final_output_path) and not os.path.samefile(input_image_path, final_output_path) : os.remove(final_output_path)
             if not os.path.exists(final_output_path) or not os.path.samefile(input_image_path, final_output_path):
                  shutil.copy(input_image_path, final_output_path)
+        elif isinstance(final_decision_path, bytes): # Resultado en memoria (in_memory=True)
+            write_file_atomically(final_output_path, final_decision_path)
         elif os.path.exists(final_decision_path): # Es un archivo optimizado temporal
             if os.path.exists(final_output_path) and final_output_path != final_decision_path: os.remove(final_output_path)
             shutil.move(final_decision_path, final_output_path)
         
         # Limpiar archivos temporales restantes
-        for temp_file in temp_files_to_clean:
-            if os.path.exists(temp_file) and temp_file != final_output_path:
+        for temp_file, _ in attempts.values():
+            if isinstance(temp_file, str) and os.path.exists(temp_file) and temp_file != final_output_path:
                 try: os.remove(temp_file)
-                except OSError: pass
+                except OSError: pass # Ignorar si no se puede borrar por alguna razón
         
         if os.path.exists(final_output_path):
-            print(f"Archivo final guardado en: {final_output_path} (Tamaño: {os.path.getsize(final_output_path)/1024:.2f} KB)")
+            final_size_bytes = os.path.getsize(final_output_path)
+            print(f"Archivo final guardado en: {final_output_path} (Tamaño: {final_size_bytes/1024:.2f} KB)")
+            report.update({"pngquant_calls": probe.calls,
+                           "quality": f"{best_quality[0]}-{best_quality[1]}" if best_quality else None,
+                           "final_size": final_size_bytes})
+            if scorer is not None:
+                report["ssim"] = round(scores[best_quality], 4) if best_quality else 1.0
+            record_stage("optimize", time.perf_counter() - optimize_start, backend=backend, search_mode=search_mode,
+                         iterations=probe.calls, bytes_in=original_file_size_bytes, bytes_out=final_size_bytes,
+                         quality=report["quality"])
+            if cache is not None:
+                cache.put(key, final_output_path, {name: report[name] for name in ("quality", "original_size", "final_size", "ssim")
+                                                   if name in report})
+            notify_progress("done", final_size=final_size_bytes)
             return final_output_path
         else:
             print("Error: No se pudo determinar el archivo final.")
@@ -0,0 +1,74 @@
+import io
+
+from PIL import Image
+
+# Lado mayor (px) al que se reduce la luminancia antes de comparar: el SSIM a
+# esta escala sigue detectando bandas y posterización y cuesta milisegundos.
+QUALITY_DOWNSAMPLE_MAX_SIDE = 512
+# Ventana (px) de las medias locales del SSIM
+SSIM_WINDOW = 8
+# Constantes de estabilidad del SSIM (Wang et al. 2004) para valores de 0 a 255
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+# Gris sobre el que se compone la transparencia antes de medir: los defectos
+# se ven tanto en bordes claros como oscuros.
+QUALITY_MATTE = (128, 128, 128, 255)
+
+def import_numpy():
+    """NumPy si está instalado, o None (es opcional)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def luma_array(image_source, max_side=QUALITY_DOWNSAMPLE_MAX_SIDE):
+    """Luminancia (float32) de una imagen (ruta o bytes), compuesta sobre gris y reducida a max_side."""
+    np = import_numpy()
+    if isinstance(image_source, bytes):
+        image_source = io.BytesIO(image_source)
+    with Image.open(image_source) as image:
+        rgba = image.convert("RGBA")
+    luma = Image.alpha_composite(Image.new("RGBA", rgba.size, QUALITY_MATTE), rgba).convert("L")
+    scale = max_side / max(luma.size)
+    if scale < 1:
+        luma = luma.resize((max(1, round(luma.width * scale)), max(1, round(luma.height * scale))), Image.BOX)
+    return np.asarray(luma, dtype=np.float32)
+
+def _box_mean(np, values, window):
+    """Media en ventanas window x window ('valid') usando una imagen integral."""
+    integral = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    sums = (integral[window:, window:] - integral[:-window, window:]
+            - integral[window:, :-window] + integral[:-window, :-window])
+    return sums / (window * window)
+
+def ssim(reference, candidate, window=SSIM_WINDOW):
+    """SSIM medio entre dos matrices de luminancia del mismo tamaño (1.0 = idénticas)."""
+    np = import_numpy()
+    window = min(window, *reference.shape)
+    mean_ref = _box_mean(np, reference, window)
+    mean_cand = _box_mean(np, candidate, window)
+    var_ref = _box_mean(np, reference * reference, window) - mean_ref ** 2
+    var_cand = _box_mean(np, candidate * candidate, window) - mean_cand ** 2
+    covariance = _box_mean(np, reference * candidate, window) - mean_ref * mean_cand
+    ssim_map = (((2 * mean_ref * mean_cand + SSIM_C1) * (2 * covariance + SSIM_C2))
+                / ((mean_ref ** 2 + mean_cand ** 2 + SSIM_C1) * (var_ref + var_cand + SSIM_C2)))
+    return float(ssim_map.mean())
+
+class QualityScorer(object):
+    """
+    Compara candidatos contra la imagen original. La luminancia de referencia
+    se calcula una sola vez; cada candidato (ruta o bytes) solo se decodifica
+    y reduce. Requiere NumPy (ver available()).
+    """
+
+    def __init__(self, reference_source, max_side=QUALITY_DOWNSAMPLE_MAX_SIDE):
+        self.max_side = max_side
+        self.reference = luma_array(reference_source, max_side)
+
+    @staticmethod
+    def available():
+        return import_numpy() is not None
+
+    def score(self, candidate_source):
+        return ssim(self.reference, luma_array(candidate_source, self.max_side))
@@ -1,8 +1,16 @@
 import customtkinter as ctk
 from tkinter import filedialog
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 # Cambiar la importación para usar la nueva función (o mantener 'optimize_image' si renombraste la función en el otro archivo)
 from image_processor import optimize_image_iteratively as optimize_image 
+from image_processor import read_image_size
+from svg_generator import create_final_svg, get_compiled_background
+
+# Cada cuánto (ms) se leen los mensajes de progreso del hilo de trabajo
+PROGRESS_POLL_MS = 100
 
 class App(ctk.CTk):
     def __init__(self):
@@ -14,8 +22,18 @@ class App(ctk.CTk):
         self.main_image_path = None
         self.background_image_path = None
         self.optimized_main_image_actual_path = None
+        self.final_svg_path = None
         self.output_directory = None
 
+        # El procesado corre en un hilo aparte; Tk solo se toca desde el hilo principal,
+        # que lee el progreso de la cola con after().
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # El fondo se parsea en su propio hilo mientras se optimiza la imagen principal
+        self.background_executor = ThreadPoolExecutor(max_workers=1)
+        self.progress_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.pipeline_future = None
+
         ctk.set_appearance_mode("System")
         ctk.set_default_color_theme("blue")
 
@@ -40,14 +58,20 @@ class App(ctk.CTk):
         self.lbl_output_dir_path = ctk.CTkLabel(self.output_dir_frame, text="Ninguna carpeta de salida seleccionada", anchor="w")
         self.lbl_output_dir_path.pack(side="left", padx=5, expand=True, fill="x")
 
-        self.btn_generate_svg = ctk.CTkButton(self, text="Generar SVG", command=self.generate_svg_action, state="disabled")
-        self.btn_generate_svg.pack(pady=20)
+        self.actions_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.actions_frame.pack(pady=20)
+        self.btn_generate_svg = ctk.CTkButton(self.actions_frame, text="Generar SVG", command=self.generate_svg_action, state="disabled")
+        self.btn_generate_svg.pack(side="left", padx=5)
+        self.btn_cancel = ctk.CTkButton(self.actions_frame, text="Cancelar", command=self.cancel_action, state="disabled")
+        self.btn_cancel.pack(side="left", padx=5)
 
         self.status_frame = ctk.CTkFrame(self, fg_color="transparent")
         self.status_frame.pack(pady=10, padx=10, fill="x", expand=True)
         self.lbl_status = ctk.CTkLabel(self.status_frame, text="Cargue imágenes y seleccione carpeta de salida.", wraplength=550, justify="left")
         self.lbl_status.pack(fill="x")
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def load_main_image(self):
         file_path = filedialog.askopenfilename(
             title="Seleccionar Imagen Principal",
@@ -65,7 +89,7 @@ class App(ctk.CTk):
     def load_background_image(self):
         file_path = filedialog.askopenfilename(
             title="Seleccionar Imagen de Fondo",
-            filetypes=(("Archivos PNG", "*.png"), ("Archivos JPG/JPEG", "*.jpg;*.jpeg"), ("Todos los archivos", "*.*"))
+            filetypes=(("Archivos SVG", "*.svg"), ("Todos los archivos", "*.*"))
         )
         if file_path:
             self.background_image_path = file_path
@@ -85,7 +109,12 @@ class App(ctk.CTk):
         else:
             self.lbl_status.configure(text="Selección de carpeta de salida cancelada.", text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"])
 
+    def is_processing(self):
+        return self.pipeline_future is not None and not self.pipeline_future.done()
+
     def check_if_can_generate(self):
+        if self.is_processing():
+            return # Los botones se restauran al terminar el procesado
         if self.main_image_path and self.background_image_path and self.output_directory:
             self.btn_generate_svg.configure(state="normal")
             self.lbl_status.configure(text="Listo para generar SVG.", text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"])
@@ -101,13 +130,12 @@ class App(ctk.CTk):
                  self.lbl_status.configure(text="Cargue imágenes y seleccione carpeta de salida.", text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"])
 
     def generate_svg_action(self):
+        if self.is_processing():
+            return
         if not self.main_image_path or not self.background_image_path or not self.output_directory:
             self.lbl_status.configure(text="Error: Cargar ambas imágenes y seleccionar carpeta de salida.", text_color="red")
             return
 
-        self.lbl_status.configure(text="Procesando imagen principal (iterativamente)...", text_color="orange")
-        self.update_idletasks() 
-
         optimized_main_image_subdir = os.path.join(self.output_directory, "optimized_main_image")
         
         if not os.path.exists(optimized_main_image_subdir):
@@ -116,27 +144,120 @@ class App(ctk.CTk):
             except OSError as e:
                 self.lbl_status.configure(text=f"Error al crear directorio: {optimized_main_image_subdir}. {e}", text_color="red")
                 return
-            
+
+        self.lbl_status.configure(text="Procesando imagen principal (iterativamente)...", text_color="orange")
+        self.btn_generate_svg.configure(state="disabled")
+        self.btn_cancel.configure(state="normal")
+        self.optimized_main_image_actual_path = None
+        self.final_svg_path = None
+        self.cancel_event.clear()
+        self.pipeline_future = self.executor.submit(self.run_pipeline, self.main_image_path, self.background_image_path,
+                                                    self.output_directory, optimized_main_image_subdir)
+        self.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def run_pipeline(self, main_image_path, background_image_path, output_directory, optimized_main_image_subdir):
+        """
+        Se ejecuta en el hilo de trabajo: no debe tocar ningún widget. El fondo
+        se parsea en paralelo con la optimización y ambos se unen al componer.
+        """
+        result = {"optimized": None, "report": {}, "svg": None, "error": None}
+        background_future = self.background_executor.submit(get_compiled_background, background_image_path)
+
         # Llamamos a la función de optimización (que ahora es la iterativa)
-        self.optimized_main_image_actual_path = optimize_image(
-            self.main_image_path,
+        result["optimized"] = optimize_image(
+            main_image_path,
             output_dir=optimized_main_image_subdir, 
-            pngquant_exe_rel_path="tools/pngquant.exe"
+            pngquant_exe_rel_path="tools/pngquant.exe",
+            report=result["report"],
+            progress_callback=self.progress_queue.put,
+            cancel_event=self.cancel_event
         )
+        if not result["optimized"] or self.cancel_event.is_set():
+            return result
 
+        fg_size = read_image_size(result["optimized"])
+        if fg_size is None:
+            result["error"] = "No se pudo leer el tamaño de la imagen principal optimizada."
+            return result
+        try:
+            background = background_future.result()
+        except Exception as e:
+            result["error"] = f"Error al leer el SVG de fondo: {e}"
+            return result
+
+        self.progress_queue.put({"stage": "compose"})
+        name_part = os.path.splitext(os.path.basename(main_image_path))[0]
+        svg_path = os.path.join(output_directory, f"{name_part}.svg")
+        svg_report = {}
+        if create_final_svg(svg_path, background, result["optimized"], fg_size[0], fg_size[1], report=svg_report):
+            result.update({"svg": svg_path, "svg_size": svg_report.get("output_size")})
+        else:
+            result["error"] = "Error al crear el SVG final."
+        return result
+
+    def progress_text(self, message):
+        if message["stage"] == "iteration":
+            size = f"{message['size'] / 1024:.2f} KB" if message["size"] is not None else "sin resultado"
+            return f"Optimizando imagen principal: pasada {message['iteration']}, calidad {message['quality']} ({size})..."
+        if message["stage"] == "done":
+            return "Imagen principal optimizada, esperando al fondo..."
+        if message["stage"] == "compose":
+            return "Componiendo el SVG final..."
+        return "Procesando imagen principal (iterativamente)..."
+
+    def poll_progress(self):
+        try:
+            while True:
+                message = self.progress_queue.get_nowait()
+                if not self.cancel_event.is_set():
+                    self.lbl_status.configure(text=self.progress_text(message), text_color="orange")
+        except queue.Empty:
+            pass
+        if self.pipeline_future.done():
+            self.finish_pipeline()
+        else:
+            self.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def finish_pipeline(self):
+        self.btn_cancel.configure(state="disabled")
+        self.btn_generate_svg.configure(state="normal")
+        try:
+            result = self.pipeline_future.result()
+        except Exception as e:
+            self.lbl_status.configure(text=f"Error inesperado al procesar la imagen principal: {e}", text_color="red")
+            return
+
+        if result["report"].get("cancelled") or self.cancel_event.is_set():
+            self.lbl_status.configure(text="Procesado cancelado.", text_color="orange")
+            return
+
+        self.optimized_main_image_actual_path = result["optimized"]
         if not self.optimized_main_image_actual_path or not os.path.exists(self.optimized_main_image_actual_path):
             self.lbl_status.configure(text="Error al optimizar la imagen principal o no se generó archivo.", text_color="red")
             return
+        if result["error"]:
+            self.lbl_status.configure(text=result["error"], text_color="red")
+            return
 
+        self.final_svg_path = result["svg"]
         final_size_kb = os.path.getsize(self.optimized_main_image_actual_path) / 1024
-        self.lbl_status.configure(text=f"Imagen principal procesada: {os.path.basename(self.optimized_main_image_actual_path)} ({final_size_kb:.2f} KB)", text_color="blue")
-        self.update_idletasks()
-
         print(f"Ruta de imagen principal (procesada): {self.optimized_main_image_actual_path}")
-        print(f"Ruta de imagen de fondo (sin procesar aún): {self.background_image_path}")
-        print(f"Carpeta de salida seleccionada: {self.output_directory}")
+        print(f"SVG final: {self.final_svg_path}")
+        self.lbl_status.configure(text=f"SVG generado: {os.path.basename(self.final_svg_path)} ({result['svg_size'] / 1024:.2f} KB). "
+                                       f"Imagen principal: {os.path.basename(self.optimized_main_image_actual_path)} ({final_size_kb:.2f} KB)",
+                                  text_color="green")
+
+    def cancel_action(self):
+        if self.is_processing():
+            self.cancel_event.set() # El optimizador mata el pngquant en curso y termina
+            self.btn_cancel.configure(state="disabled")
+            self.lbl_status.configure(text="Cancelando...", text_color="orange")
 
-        self.lbl_status.configure(text="Vectorización y generación SVG pendientes.", text_color="orange")
+    def on_close(self):
+        self.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.background_executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
 
 if __name__ == "__main__":
     app = App()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Prefijo de las métricas en el formato de texto de Prometheus
+PROMETHEUS_PREFIX = "svgcreator"
+# Campos numéricos de los eventos que se acumulan como contadores en Prometheus
+PROMETHEUS_COUNTER_FIELDS = ("bytes_in", "bytes_out", "iterations")
+
+class MetricsRecorder(object):
+    """
+    Recoge eventos estructurados (etapas cronometradas y sucesos sueltos) y los
+    escribe como líneas JSON a medida que llegan y/o, agregados por etapa, en un
+    archivo de texto con el formato de Prometheus (al llamar a flush() y al salir).
+    """
+
+    def __init__(self, jsonl_path=None, prometheus_path=None):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._jsonl_file = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        self._stage_totals = {} # etapa -> {"count", "seconds", "bytes_in", ...}
+        self._event_counts = {} # nombre de evento -> veces
+
+    def record(self, event, fields):
+        fields = {"ts": round(time.time(), 6), "event": event, **fields}
+        with self._lock:
+            self._event_counts[event] = self._event_counts.get(event, 0) + 1
+            stage = fields.get("stage")
+            if stage is not None:
+                totals = self._stage_totals.setdefault(stage, {"count": 0, "seconds": 0.0})
+                totals["count"] += 1
+                totals["seconds"] += fields.get("seconds", 0.0)
+                for name in PROMETHEUS_COUNTER_FIELDS:
+                    if isinstance(fields.get(name), (int, float)):
+                        totals[name] = totals.get(name, 0) + fields[name]
+            if self._jsonl_file:
+                self._jsonl_file.write(json.dumps(fields, ensure_ascii=False, default=str) + "\n")
+                self._jsonl_file.flush()
+
+    def prometheus_text(self):
+        with self._lock:
+            stage_totals = {stage: dict(totals) for stage, totals in self._stage_totals.items()}
+            event_counts = dict(self._event_counts)
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary"]
+        for stage, totals in sorted(stage_totals.items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {totals["seconds"]:.6f}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {totals["count"]}')
+        for name in PROMETHEUS_COUNTER_FIELDS:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter")
+            for stage, totals in sorted(stage_totals.items()):
+                if name in totals:
+                    lines.append(f'{PROMETHEUS_PREFIX}_{name}_total{{stage="{stage}"}} {totals[name]}')
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_events_total counter")
+        for event, count in sorted(event_counts.items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_events_total{{event="{event}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Reescribe (de forma atómica) el archivo de Prometheus con los totales actuales."""
+        if not self.prometheus_path:
+            return
+        output_dir = os.path.dirname(os.path.abspath(self.prometheus_path))
+        temp_fd, temp_path = tempfile.mkstemp(suffix=".prom.tmp", dir=output_dir)
+        with os.fdopen(temp_fd, "w", encoding="utf-8") as prom_file:
+            prom_file.write(self.prometheus_text())
+        os.replace(temp_path, self.prometheus_path)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._jsonl_file:
+                self._jsonl_file.close()
+                self._jsonl_file = None
+
+# Registro activo; None = instrumentación desactivada (cada llamada vuelve de inmediato)
+_recorder = None
+
+def configure_metrics(jsonl_path=None, prometheus_path=None):
+    """Activa la instrumentación hacia un archivo JSON lines y/o un archivo de texto de Prometheus."""
+    global _recorder
+    disable_metrics()
+    if not jsonl_path and not prometheus_path:
+        return None
+    _recorder = MetricsRecorder(jsonl_path, prometheus_path)
+    return _recorder
+
+def configure_metrics_from_environment():
+    """Activa la instrumentación si están definidas SVGCREATOR_METRICS_JSONL o SVGCREATOR_METRICS_PROM."""
+    return configure_metrics(os.environ.get("SVGCREATOR_METRICS_JSONL"), os.environ.get("SVGCREATOR_METRICS_PROM"))
+
+def disable_metrics():
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+def metrics_enabled():
+    return _recorder is not None
+
+def flush_metrics():
+    if _recorder is not None:
+        _recorder.flush()
+
+def record_stage(stage, seconds, **fields):
+    """Registra una etapa ya cronometrada por el llamador (p. ej. con varios puntos de salida)."""
+    if _recorder is not None:
+        _recorder.record("stage", {"stage": stage, "seconds": round(seconds, 6), **fields})
+
+def record_event(event, **fields):
+    """Registra un suceso suelto (p. ej. un acierto de caché)."""
+    if _recorder is not None:
+        _recorder.record(event, fields)
+
+class _NullSpan(dict):
+    """Span que descarta lo que se le asigna (instrumentación desactivada)."""
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+class _NullTimer(object):
+    """Contexto vacío y reutilizable para timed() con la instrumentación desactivada."""
+
+    def __enter__(self):
+        return _NULL_SPAN
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+_NULL_TIMER = _NullTimer()
+
+@contextmanager
+def _timed_span(recorder, stage, fields):
+    span = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span["seconds"] = round(time.perf_counter() - start, 6)
+        recorder.record("stage", {"stage": stage, **span})
+
+def timed(stage, **fields):
+    """
+    Cronometra una etapa: 'with timed("pngquant", quality="65-80") as span:'.
+    Se pueden añadir campos dentro del bloque (span["bytes_out"] = ...). Con la
+    instrumentación desactivada devuelve un contexto vacío que no mide nada.
+    """
+    if _recorder is None:
+        return _NULL_TIMER
+    return _timed_span(_recorder, stage, fields)
+
+atexit.register(disable_metrics)
@@ -0,0 +1,186 @@
+import os
+import json
+import math
+import tempfile
+
+from PIL import Image
+
+from image_processor import optimize_image_iteratively, TARGET_SIZE_BYTES, ACCEPTABLE_MARGIN_RATIO
+from svg_generator import create_final_svg, get_compiled_background
+
+# Anchos por defecto de las variantes (px); los mayores que el original se omiten
+RESPONSIVE_WIDTHS = (2560, 1920, 1280, 640)
+RESPONSIVE_MANIFEST_FILENAME = "manifest.json"
+# Reintentos (reduciendo el ancho) cuando una variante por presupuesto no cabe
+BUDGET_RETRIES = 2
+BUDGET_RETRY_SCALE = 0.9
+
+class _ResizeCascade(object):
+    """
+    Primer plano decodificado una sola vez y sus versiones reducidas. Cada nueva
+    variante se calcula a partir de la más pequeña ya disponible que sea al menos
+    igual de ancha, así el trabajo de reducción se comparte entre variantes.
+    """
+
+    def __init__(self, image):
+        self.full_width, self.full_height = image.size
+        self._images = {image.width: image}
+
+    def height_for(self, width):
+        return max(1, round(self.full_height * width / self.full_width))
+
+    def resized(self, width):
+        if width not in self._images:
+            source_width = min(w for w in self._images if w >= width)
+            source = self._images[source_width]
+            self._images[width] = source.resize((width, self.height_for(width)), Image.LANCZOS, reducing_gap=2.0)
+        return self._images[width]
+
+def _variant_budget(width, full_width):
+    """Presupuesto por defecto: el objetivo del optimizador escalado por el área."""
+    return max(1, int(TARGET_SIZE_BYTES * (width / full_width) ** 2))
+
+def create_responsive_variants(background_svg_path, foreground_path, output_dir, widths=None, size_budgets=None,
+                               search_mode="bisect", backend="pngquant", pngquant_exe_rel_path="tools/pngquant.exe",
+                               stream_output=False, compact=False, precision=None, foreground_encoding="png"):
+    """
+    Genera en una sola pasada varias versiones del SVG compuesto a distintos
+    tamaños. El primer plano se decodifica una vez; cada variante se reduce a
+    partir de la anterior, se optimiza con su propio objetivo de bytes y se
+    compone sobre el fondo, que también se parsea una sola vez. Todas las
+    variantes conservan el viewBox de la resolución completa, así que el fondo
+    no se reescala: solo cambian width/height y los píxeles del primer plano.
+
+    widths: anchos en px (por defecto RESPONSIVE_WIDTHS); el objetivo de cada
+    uno es TARGET_SIZE_BYTES escalado por su área.
+    size_budgets: bytes máximos del primer plano optimizado; el ancho se estima
+    a partir de las variantes ya hechas (los bytes crecen con el área).
+
+    Escribe un manifest.json en output_dir y devuelve el dict del manifiesto,
+    o None si falla la lectura de las entradas.
+    """
+    try:
+        with Image.open(foreground_path) as source_image:
+            source_image.load()
+            image = source_image if source_image.mode in ("RGB", "RGBA") else source_image.convert("RGBA")
+        background = get_compiled_background(background_svg_path)
+    except Exception as e:
+        print(f"Error al leer las entradas de las variantes: {e}")
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    cascade = _ResizeCascade(image)
+    full_width, full_height = cascade.full_width, cascade.full_height
+    name_part = os.path.splitext(os.path.basename(foreground_path))[0]
+    if widths is None and not size_budgets:
+        widths = RESPONSIVE_WIDTHS
+
+    # Anchos fijos primero (de mayor a menor); sirven de referencia para los presupuestos
+    requested = sorted({min(int(width), full_width) for width in widths or ()}, reverse=True)
+    budgets = sorted(size_budgets or (), reverse=True)
+    print(f"Variantes de '{foreground_path}' ({full_width}x{full_height}): anchos {requested}, presupuestos {budgets}")
+
+    variants = []
+    with tempfile.TemporaryDirectory(dir=output_dir) as work_dir:
+
+        def build_variant(width, budget, budget_name=False):
+            height = cascade.height_for(width)
+            # Las variantes por presupuesto llevan el presupuesto en el nombre: su ancho
+            # puede coincidir con el de una variante fija (o con el de otro presupuesto)
+            variant_name = f"{name_part}_{width}w_{budget}b" if budget_name else f"{name_part}_{width}w"
+            if width == full_width and foreground_path.lower().endswith(".png"):
+                variant_png = foreground_path # Tamaño completo: el archivo original, sin recodificar
+            else:
+                variant_png = os.path.join(work_dir, f"{variant_name}.png")
+                cascade.resized(width).save(variant_png, format="PNG")
+
+            optimize_report = {}
+            optimized_path = optimize_image_iteratively(variant_png, output_dir=work_dir, pngquant_exe_rel_path=pngquant_exe_rel_path,
+                                                        search_mode=search_mode, report=optimize_report, backend=backend,
+                                                        target_size_bytes=budget)
+            if not optimized_path:
+                return {"width": width, "height": height, "budget": budget, "ok": False}
+            final_png_path = os.path.join(output_dir, f"{variant_name}.png")
+            os.replace(optimized_path, final_png_path)
+
+            svg_path = os.path.join(output_dir, f"{variant_name}.svg")
+            svg_report = {}
+            svg_ok = create_final_svg(svg_path, background, final_png_path, full_width, full_height,
+                                      stream_output=stream_output, compact=compact, precision=precision,
+                                      report=svg_report, foreground_encoding=foreground_encoding,
+                                      display_size=(width, height))
+            return {
+                "width": width,
+                "height": height,
+                "budget": budget,
+                "ok": bool(svg_ok),
+                "svg": os.path.basename(svg_path),
+                "foreground": os.path.basename(final_png_path),
+                "foreground_size": optimize_report.get("final_size"),
+                "quality": optimize_report.get("quality"),
+                "svg_size": svg_report.get("output_size")
+            }
+
+        for width in requested:
+            variants.append(build_variant(width, _variant_budget(width, full_width)))
+
+        for budget in budgets:
+            # Estimar el ancho con la variante ya hecha más cercana por encima del presupuesto
+            # (o, si todas caben, la mayor de ellas)
+            references = [variant for variant in variants if variant["ok"] and variant["foreground_size"]]
+            reference = min((variant for variant in references if variant["foreground_size"] >= budget),
+                            key=lambda variant: variant["foreground_size"], default=None)
+            reference = reference or max(references, key=lambda variant: variant["foreground_size"], default=None)
+            if reference is None:
+                width = full_width
+            else:
+                width = int(reference["width"] * math.sqrt(budget / reference["foreground_size"]))
+            width = max(1, min(width, full_width))
+            for _ in range(BUDGET_RETRIES + 1):
+                variant = build_variant(width, budget, budget_name=True)
+                if not variant["ok"] or variant["foreground_size"] <= budget * (1 + ACCEPTABLE_MARGIN_RATIO) or width == 1:
+                    break
+                print(f"  La variante de {width}px ({variant['foreground_size'] / 1024:.2f} KB) supera el presupuesto; reduciendo.")
+                for file_name in (variant["svg"], variant["foreground"]):
+                    os.remove(os.path.join(output_dir, file_name))
+                width = max(1, int(width * BUDGET_RETRY_SCALE))
+            variants.append(variant)
+
+    variants.sort(key=lambda variant: variant["width"], reverse=True)
+    # Un solo candidato por ancho en el srcset (el primero: las variantes fijas van antes)
+    srcset = {}
+    for variant in variants:
+        if variant["ok"]:
+            srcset.setdefault(variant["width"], variant["svg"])
+    manifest = {
+        "source": foreground_path,
+        "background": background_svg_path,
+        "full_width": full_width,
+        "full_height": full_height,
+        "view_box": f"0 0 {full_width} {full_height}",
+        "srcset": ", ".join(f"{svg} {width}w" for width, svg in srcset.items()),
+        "variants": variants
+    }
+    manifest_path = os.path.join(output_dir, RESPONSIVE_MANIFEST_FILENAME)
+    with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, ensure_ascii=False)
+    print(f"Variantes generadas: {sum(1 for variant in variants if variant['ok'])}/{len(variants)}. Manifiesto: {manifest_path}")
+    return manifest
+
+# --- Bloque de pruebas ---
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Genera variantes de varios tamaños del SVG compuesto.")
+    parser.add_argument("background", help="SVG de fondo")
+    parser.add_argument("foreground", help="Imagen de primer plano")
+    parser.add_argument("output_dir", help="Carpeta de salida")
+    parser.add_argument("--widths", type=int, nargs="*", default=None, help="Anchos de las variantes (px)")
+    parser.add_argument("--budgets", type=int, nargs="*", default=None, help="Presupuestos de bytes del primer plano")
+    parser.add_argument("--mode", default="bisect", help="Modo de búsqueda de calidad (linear, bisect, parallel)")
+    parser.add_argument("--backend", default="pngquant", help="Backend de cuantización (pngquant, pillow)")
+    args = parser.parse_args()
+
+    result = create_responsive_variants(args.background, args.foreground, args.output_dir, widths=args.widths,
+                                        size_budgets=args.budgets, search_mode=args.mode, backend=args.backend)
+    exit(0 if result and all(variant["ok"] for variant in result["variants"]) else 1)
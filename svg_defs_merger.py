@@ -0,0 +1,268 @@
+import re
+import copy
+import hashlib
+import xml.etree.ElementTree as ET
+
+from svg_minifier import local_name
+
+# Prefijo por defecto de los IDs del fondo al fusionarlo (evita choques con los IDs propios del documento)
+BACKGROUND_ID_PREFIX = "bg0_"
+
+# Referencias a IDs: url(#id) en atributos, estilos en línea y CSS; '#id' en href/xlink:href
+URL_REFERENCE_RE = re.compile(r'url\(\s*([\'"]?)#([^\'")\s]+)\1\s*\)')
+# Selectores de ID en CSS (solo se aplica a la parte del selector de cada regla)
+CSS_ID_SELECTOR_RE = re.compile(r'#(-?[A-Za-z_][\w\-]*)')
+CSS_CLASS_SELECTOR_RE = re.compile(r'\.(-?[A-Za-z_][\w\-]*)')
+HREF_ATTRIBUTES = ('href', 'xlink:href', '{http://www.w3.org/1999/xlink}href')
+# @-reglas cuyo bloque contiene reglas normales (sus selectores también se reescriben)
+GROUPING_AT_RULES = ('@media', '@supports', '@container', '@layer', '@document')
+
+def split_css_rules(css_text):
+    """
+    Divide una hoja de estilos en reglas de primer nivel ('sel{...}', '@media ...{...}'
+    o '@import ...;'), sin comentarios y con los espacios normalizados.
+    """
+    css_text = re.sub(r'/\*.*?\*/', '', css_text, flags=re.S)
+    rules, start, depth = [], 0, 0
+    for index, char in enumerate(css_text):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append(css_text[start:index + 1])
+                start = index + 1
+        elif char == ';' and depth == 0:
+            rules.append(css_text[start:index + 1])
+            start = index + 1
+    rules.append(css_text[start:])
+    return [" ".join(rule.split()) for rule in rules if rule.strip() and rule.strip() != ';']
+
+class ReferenceIndex(object):
+    """
+    Índice de un árbol SVG construido en un solo recorrido: elementos con ID,
+    atributos que referencian IDs (url(#...) o href="#...") y textos <style>.
+    Todas las reescrituras posteriores usan el índice, sin volver a recorrer el árbol.
+    """
+
+    def __init__(self, root):
+        self.ids = {}        # id -> elemento
+        self.references = [] # (elemento, atributo) con alguna referencia a un ID
+        self.styles = []     # elementos <style>
+        self.classed = []    # elementos con atributo class
+        for element in root.iter():
+            if not isinstance(element.tag, str):
+                continue
+            element_id = element.get('id')
+            if element_id is not None:
+                self.ids.setdefault(element_id, element)
+            if local_name(element.tag) == 'style':
+                self.styles.append(element)
+            if element.get('class'):
+                self.classed.append(element)
+            for name, value in element.attrib.items():
+                if 'url(' in value or (name in HREF_ATTRIBUTES and value.startswith('#')):
+                    self.references.append((element, name))
+
+    def referenced_ids(self, element, name):
+        value = element.get(name)
+        if name in HREF_ATTRIBUTES and value.startswith('#'):
+            return [value[1:]]
+        return [match.group(2) for match in URL_REFERENCE_RE.finditer(value)]
+
+def rewrite_references(value, id_map, href=False):
+    """Cambia las referencias url(#id) (o '#id' si href=True) según id_map; las desconocidas se dejan igual."""
+    if href and value.startswith('#'):
+        return '#' + id_map.get(value[1:], value[1:])
+    return URL_REFERENCE_RE.sub(lambda match: f"url(#{id_map.get(match.group(2), match.group(2))})", value)
+
+def prefix_classes(value, class_prefix):
+    """Antepone class_prefix a cada nombre de un atributo class."""
+    return " ".join(class_prefix + name for name in value.split())
+
+def rewrite_css_rule(rule, id_map, class_prefix=""):
+    """
+    Reescribe url(#id) en toda la regla y, en una regla normal o dentro de una
+    @-regla de agrupación (@media, @supports...), los selectores #id y, con
+    class_prefix, los selectores .clase.
+    """
+    if rule.lower().startswith(GROUPING_AT_RULES) and '{' in rule:
+        prelude, block = rule.split('{', 1)
+        inner_rules = split_css_rules(block[:block.rfind('}')])
+        return prelude + '{' + "".join(rewrite_css_rule(inner, id_map, class_prefix) for inner in inner_rules) + '}'
+    rule = rewrite_references(rule, id_map)
+    if rule.startswith('@') or '{' not in rule:
+        return rule
+    selector, block = rule.split('{', 1)
+    selector = CSS_ID_SELECTOR_RE.sub(lambda match: '#' + id_map.get(match.group(1), match.group(1)), selector)
+    if class_prefix:
+        selector = CSS_CLASS_SELECTOR_RE.sub(lambda match: '.' + class_prefix + match.group(1), selector)
+    return selector + '{' + block
+
+class DefsMerger(object):
+    """
+    Fusiona los <defs> y <style> de uno o varios SVG de fondo en un único bloque
+    de definiciones. Cada definición de primer nivel se resume con un hash de su
+    contenido (sin su ID y con sus referencias resueltas a los hashes de lo que
+    referencian), así dos degradados, clipPath o filtros idénticos se guardan una
+    sola vez aunque tengan IDs distintos o vengan de archivos distintos. Las
+    reglas CSS idénticas también se guardan una vez, en la posición de la última
+    copia (la que decide la cascada).
+    Los IDs de cada fondo se renombran con su prefijo (sin choques entre fondos
+    ni con los IDs del documento) y las referencias url(#...), href y
+    xlink:href se reescriben, también las que apuntaban a un duplicado. Los
+    nombres de clase reciben el mismo prefijo (en los atributos class y en los
+    selectores), así dos fondos que definen '.cls-1' no se pisan los estilos.
+    """
+
+    def __init__(self):
+        self.defs_elements = []  # Definiciones conservadas (ya reescritas), en orden de aparición
+        self._style_rules = {}   # Reglas CSS conservadas (ya reescritas), en orden de cascada
+        self._defs_by_hash = {}  # hash -> definición conservada
+        self._used_ids = set()
+        self.defs_seen = 0
+        self.rules_seen = 0
+
+    def _unique_id(self, candidate):
+        new_id, counter = candidate, 1
+        while new_id in self._used_ids:
+            counter += 1
+            new_id = f"{candidate}_{counter}"
+        self._used_ids.add(new_id)
+        return new_id
+
+    def add(self, root, prefix=BACKGROUND_ID_PREFIX):
+        """
+        Incorpora un SVG de fondo (su raíz <svg>; no se modifica) y devuelve la
+        lista de sus elementos visuales, copiados y con las referencias reescritas.
+        """
+        root = copy.deepcopy(root)
+        index = ReferenceIndex(root)
+
+        defs_parents = [child for child in root if local_name(child.tag) == 'defs']
+        top_defs = [element for parent in defs_parents for element in parent
+                    if isinstance(element.tag, str) and local_name(element.tag) != 'style']
+        top_styles = [element for parent in [root] + defs_parents for element in parent
+                      if local_name(element.tag) == 'style']
+        top_def_ids = {element.get('id'): element for element in top_defs if element.get('id') is not None}
+        references_by_element = {}
+        for element, name in index.references:
+            references_by_element.setdefault(element, []).append(name)
+
+        hashes = {}
+        def def_hash(element, visiting=()):
+            # Hash del contenido; las referencias a otras definiciones entran por su hash
+            if element in hashes:
+                return hashes[element]
+            visiting = visiting + (element,)
+            def resolve(ref_id):
+                target = top_def_ids.get(ref_id)
+                if target is None:
+                    return '#' + prefix + ref_id
+                if target in visiting:
+                    return '@cycle:' + prefix + ref_id
+                return '@' + def_hash(target, visiting)
+            digest = hashlib.sha1()
+            def feed(node):
+                ref_names = references_by_element.get(node, ())
+                digest.update(f"<{local_name(node.tag)}".encode('utf-8'))
+                for name, value in sorted(node.attrib.items()):
+                    if name == 'id':
+                        continue
+                    if name == 'class':
+                        value = prefix_classes(value, prefix)
+                    elif name in ref_names:
+                        value = ",".join(resolve(ref_id) for ref_id in index.referenced_ids(node, name))
+                    digest.update(f" {name}={value!r}".encode('utf-8'))
+                digest.update(f">{(node.text or '').strip()}".encode('utf-8'))
+                for child in node:
+                    if isinstance(child.tag, str):
+                        feed(child)
+                digest.update(f"</>{(node.tail or '').strip()}".encode('utf-8'))
+            feed(element)
+            hashes[element] = digest.hexdigest()
+            return hashes[element]
+
+        kept = []
+        aliases = {} # ID de un duplicado -> nodo equivalente de la copia conservada
+        for element in top_defs:
+            element_hash = def_hash(element)
+            self.defs_seen += 1
+            duplicate_of = self._defs_by_hash.get(element_hash)
+            if duplicate_of is None or (element.get('id') is not None and duplicate_of.get('id') is None):
+                self._defs_by_hash.setdefault(element_hash, element)
+                kept.append(element)
+                continue
+            # Los IDs internos (p. ej. de cada <stop>) se corresponden por posición
+            for node, kept_node in zip(element.iter(), duplicate_of.iter()):
+                if node.get('id') is not None and kept_node.get('id') is not None:
+                    aliases[node.get('id')] = kept_node
+
+        # Nuevos IDs: el prefijo para los propios, el de la copia conservada para los duplicados
+        original_ids = {element: element_id for element_id, element in index.ids.items()}
+        id_map = {element_id: self._unique_id(prefix + element_id)
+                  for element_id in index.ids if element_id not in aliases}
+        for alias, kept_node in aliases.items():
+            # La copia conservada puede ser de este fondo (aún sin renombrar) o de uno anterior
+            id_map[alias] = id_map[original_ids[kept_node]] if kept_node in original_ids else kept_node.get('id')
+
+        for element, name in index.references:
+            element.set(name, rewrite_references(element.get(name), id_map, href=name in HREF_ATTRIBUTES))
+        for element_id, element in index.ids.items():
+            element.set('id', id_map[element_id])
+        for element in index.classed:
+            element.set('class', prefix_classes(element.get('class'), prefix))
+
+        for style_element in index.styles:
+            if not style_element.text:
+                continue
+            if style_element in top_styles:
+                self._add_style_rules(style_element.text, id_map, prefix)
+            else: # <style> anidado en el contenido: se queda en su sitio
+                style_element.text = "\n".join(rewrite_css_rule(rule, id_map, prefix)
+                                                for rule in split_css_rules(style_element.text))
+        self.defs_elements.extend(kept)
+
+        body = []
+        for child in root:
+            if not isinstance(child.tag, str):
+                continue
+            tag = local_name(child.tag)
+            if tag not in ('defs', 'style', 'metadata', 'title'):
+                body.append(child)
+        return body
+
+    def _add_style_rules(self, css_text, id_map, class_prefix):
+        for rule in split_css_rules(css_text):
+            self.rules_seen += 1
+            rule = rewrite_css_rule(rule, id_map, class_prefix)
+            # Si se repite se mueve al final: quitar la copia posterior cambiaría qué regla gana
+            self._style_rules.pop(rule, None)
+            self._style_rules[rule] = None
+
+    @property
+    def style_rules(self):
+        return list(self._style_rules)
+
+    def style_text(self):
+        return "\n".join(self.style_rules)
+
+    def build_root(self, template_root, body_elements):
+        """Nueva raíz <svg> (con los atributos de template_root) con las definiciones fusionadas y body_elements."""
+        root = ET.Element(template_root.tag, dict(template_root.attrib))
+        defs = ET.SubElement(root, 'defs')
+        if self.style_rules:
+            ET.SubElement(defs, 'style', {'type': 'text/css'}).text = self.style_text()
+        defs.extend(self.defs_elements)
+        root.extend(body_elements)
+        return root
+
+    def summary(self):
+        return {"defs_before": self.defs_seen, "defs_after": len(self.defs_elements),
+                "style_rules_before": self.rules_seen, "style_rules_after": len(self.style_rules)}
+
+def merge_background_defs(root, prefix=BACKGROUND_ID_PREFIX):
+    """Devuelve (nueva raíz, resumen) de un solo fondo con sus definiciones deduplicadas y sus IDs prefijados."""
+    merger = DefsMerger()
+    body = merger.add(root, prefix)
+    return merger.build_root(root, body), merger.summary()
@@ -4,7 +4,513 @@ from svgwrite import base # Para BaseElement
 from PIL import Image
 import os
 import base64
+import copy
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import xml.sax
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from svg_minifier import minify_element_tree
+from svg_geometry import simplify_element_tree, DEFAULT_SIMPLIFY_TOLERANCE
+from svg_defs_merger import DefsMerger, merge_background_defs, BACKGROUND_ID_PREFIX
+from image_processor import read_image_size
+from image_cache import file_sha256
+from metrics import timed, record_stage
+from foreground_encoder import EncodedForeground, choose_foreground_encoding, split_foreground_regions, TILE_SIZE
+
+# Bytes del PNG que se codifican por bloque al escribir en streaming (múltiplo de 3
+# para que los bloques Base64 se puedan concatenar sin relleno intermedio)
+BASE64_CHUNK_BYTES = 3 * 64 * 1024
+# Fondos compilados que se mantienen en memoria para reutilizarlos entre composiciones
+BACKGROUND_CACHE_MAX_ENTRIES = 8
+
+SVG_NAMESPACE_PREFIX = '{http://www.w3.org/2000/svg}'
+# Lectura del fondo: árbol completo compilado y reutilizable ("tree") o en streaming con SAX ("stream")
+BACKGROUND_MODES = ("tree", "stream")
+XLINK_NAMESPACE_PREFIX = '{http://www.w3.org/1999/xlink}'
+# Atributos de la raíz que svgwrite siempre escribe y que el modo compacto quita (no afectan al dibujo)
+COMPACT_DROPPED_ROOT_ATTRIBUTES = ('xmlns:ev', 'baseProfile', 'version')
+# Modos de codificación del primer plano: tal cual ("png") o el más pequeño que cumpla la calidad ("auto")
+FOREGROUND_ENCODINGS = ("png", "auto")
+FOREGROUND_MASK_ID = "foreground_alpha_mask"
+# Disposición del primer plano: entero, recortado al contenido no transparente o en mosaicos sin los vacíos
+FOREGROUND_LAYOUTS = ("full", "crop", "tiles")
+# Imágenes incrustadas en Base64 ("inline") o en archivos aparte referenciados por href ("external")
+ASSET_MODES = ("inline", "external")
+ASSETS_SUBDIR = "assets"
+# Caracteres del hash SHA-256 en el nombre de los archivos de recursos
+ASSET_HASH_LENGTH = 16
+ASSET_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+
+class RawElement(object):
+    """
+    Elemento de ElementTree ya construido que se inserta tal cual en un dibujo
+    svgwrite (svgwrite no ofrece una API para XML crudo; basta con exponer
+    'elementname' y get_xml(), igual que svgwrite.base.Title). Se declara como
+    'g' para que el validador de svgwrite lo acepte dentro de <g>, <svg> o <defs>.
+    """
+    elementname = 'g'
+
+    def __init__(self, element):
+        self.element = element
+
+    def get_xml(self):
+        return self.element
+
+def _foreground_mime_type(foreground_png_path):
+    if foreground_png_path.lower().endswith((".jpg", ".jpeg")):
+        return "image/jpeg"
+    return "image/png"
+
+class BackgroundSVG(object):
+    """
+    SVG de fondo leído del disco y parseado una sola vez. Todas las etapas
+    posteriores (estilos, otros <defs>, elementos visuales, inserción cruda de
+    respaldo) leen de aquí, y los fragmentos serializados se calculan una única
+    vez y se reutilizan.
+    """
+
+    def __init__(self, source_path, raw_bytes, root=None):
+        self.source_path = source_path
+        self.raw_bytes = raw_bytes
+        self.sha256 = hashlib.sha256(raw_bytes).hexdigest()
+        # Este es el elemento <svg> del archivo de fondo ('root' permite partir de un árbol ya transformado)
+        self.root = root if root is not None else ET.fromstring(raw_bytes)
+        self.width = self.root.get('width')
+        self.height = self.root.get('height')
+        self.view_box = self.root.get('viewBox')
+        self.style_texts = []   # Contenido de <style> (de <defs> o de la raíz)
+        self.defs_elements = [] # Resto de hijos de <defs>: degradados, clipPath, símbolos...
+        self.body_elements = [] # Hijos visuales de la raíz
+        self._defs_xml = None
+        self._body_xml = None
+        self._fragment_xml = None
+        self._minified = {} # precisión -> BackgroundSVG compactado
+        self._merged = {}   # prefijo -> (BackgroundSVG con defs fusionadas, resumen)
+        self._simplified = {} # (tolerancia, viewBox) -> (BackgroundSVG con la geometría simplificada, resumen)
+        self._split_root()
+
+    def __repr__(self):
+        return f"BackgroundSVG({self.source_path!r})"
+
+    def _split_root(self):
+        # Un solo recorrido del árbol: quitar el namespace SVG de las etiquetas y
+        # escribir xlink:href como nombre literal. El documento final ya declara
+        # ambos namespaces en la raíz, así no aparecen prefijos ns0:/ns1:.
+        for element in self.root.iter():
+            if isinstance(element.tag, str) and element.tag.startswith(SVG_NAMESPACE_PREFIX):
+                element.tag = element.tag[len(SVG_NAMESPACE_PREFIX):]
+            for attr_name in [name for name in element.attrib if name.startswith(XLINK_NAMESPACE_PREFIX)]:
+                element.attrib['xlink:' + attr_name[len(XLINK_NAMESPACE_PREFIX):]] = element.attrib.pop(attr_name)
+
+        for child_el in self.root:
+            if not isinstance(child_el.tag, str): # Comentarios e instrucciones de proceso
+                continue
+            tag = child_el.tag.split('}')[-1]
+            if tag == 'defs':
+                for def_child in child_el: # Iterar sobre los hijos de <defs>
+                    if not isinstance(def_child.tag, str):
+                        continue
+                    if def_child.tag.split('}')[-1] == 'style':
+                        if def_child.text: self.style_texts.append(def_child.text)
+                    else:
+                        self.defs_elements.append(def_child)
+            elif tag == 'style':
+                if child_el.text: self.style_texts.append(child_el.text)
+            elif tag not in ['metadata', 'title']:
+                self.body_elements.append(child_el)
+
+    def defs_xml(self):
+        """<style> y demás hijos de <defs> serializados (sin la etiqueta <defs>)."""
+        if self._defs_xml is None:
+            parts = [f'<style type="text/css">{escape(style_text)}</style>' for style_text in self.style_texts]
+            parts.extend(ET.tostring(def_el, encoding='unicode') for def_el in self.defs_elements)
+            self._defs_xml = "".join(parts)
+        return self._defs_xml
+
+    def body_xml(self):
+        """Elementos visuales del fondo serializados, en orden."""
+        if self._body_xml is None:
+            self._body_xml = "".join(ET.tostring(body_el, encoding='unicode') for body_el in self.body_elements)
+        return self._body_xml
+
+    def fragment_xml(self):
+        """Bloque completo que se escribe en el SVG final: <defs> + grupo del fondo."""
+        if self._fragment_xml is None:
+            self._fragment_xml = (f'<defs>{self.defs_xml()}</defs>'
+                                  f'<g id="background_elements_from_file">{self.body_xml()}</g>')
+        return self._fragment_xml
+
+    def minified(self, precision=None):
+        """Versión compactada del fondo (ver svg_minifier), calculada una vez por precisión."""
+        if precision not in self._minified:
+            compact_root = minify_element_tree(copy.deepcopy(self.root), precision)
+            self._minified[precision] = BackgroundSVG(self.source_path, self.raw_bytes, root=compact_root)
+        return self._minified[precision]
+
+    def simplified(self, tolerance=DEFAULT_SIMPLIFY_TOLERANCE, view_box=None):
+        """
+        Versión con los trazados simplificados, fusionados y sin los elementos que
+        quedan fuera de view_box (ver svg_geometry). Devuelve (BackgroundSVG,
+        resumen), calculado una vez por tolerancia y viewBox; el resumen es None
+        si NumPy no está instalado (el fondo se devuelve sin cambios).
+        """
+        key = (tolerance, tuple(view_box) if view_box else None)
+        if key not in self._simplified:
+            simple_root, summary = simplify_element_tree(copy.deepcopy(self.root), tolerance, view_box)
+            background = BackgroundSVG(self.source_path, self.raw_bytes, root=simple_root) if summary else self
+            self._simplified[key] = (background, summary)
+        return self._simplified[key]
+
+    def merged_defs(self, prefix=BACKGROUND_ID_PREFIX):
+        """
+        Versión con los <defs> y reglas CSS idénticos guardados una sola vez y los
+        IDs prefijados (ver svg_defs_merger). Devuelve (BackgroundSVG, resumen),
+        calculado una vez por prefijo.
+        """
+        if prefix not in self._merged:
+            merged_root, summary = merge_background_defs(self.root, prefix)
+            self._merged[prefix] = (BackgroundSVG(self.source_path, self.raw_bytes, root=merged_root), summary)
+        return self._merged[prefix]
+
+def load_background_svg(background_svg_path):
+    """Lee y parsea el SVG de fondo una sola vez (ver BackgroundSVG)."""
+    with open(background_svg_path, 'rb') as f_bg:
+        return BackgroundSVG(background_svg_path, f_bg.read())
+
+# Ruta absoluta -> (mtime_ns, tamaño, BackgroundSVG), en orden de uso (LRU)
+_compiled_backgrounds = OrderedDict()
+_compiled_backgrounds_lock = threading.Lock()
+
+def get_compiled_background(background_svg_path):
+    """
+    Devuelve el BackgroundSVG de background_svg_path con sus fragmentos ya
+    serializados, reutilizando el de una llamada anterior mientras el archivo no
+    cambie. Si cambian la fecha o el tamaño se relee y solo se recompila si
+    también cambia el hash del contenido.
+    """
+    abs_path = os.path.abspath(background_svg_path)
+    stat = os.stat(abs_path)
+    with _compiled_backgrounds_lock:
+        cached = _compiled_backgrounds.get(abs_path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _compiled_backgrounds.move_to_end(abs_path)
+            return cached[2]
+
+    with open(abs_path, 'rb') as f_bg:
+        raw_bytes = f_bg.read()
+    if cached and cached[2].sha256 == hashlib.sha256(raw_bytes).hexdigest():
+        background = cached[2] # Solo se tocó el archivo; el contenido es el mismo
+    else:
+        with timed("background_parse", mode="tree", bytes_in=len(raw_bytes)):
+            background = BackgroundSVG(background_svg_path, raw_bytes)
+            background.fragment_xml()
+
+    with _compiled_backgrounds_lock:
+        _compiled_backgrounds[abs_path] = (stat.st_mtime_ns, stat.st_size, background)
+        _compiled_backgrounds.move_to_end(abs_path)
+        while len(_compiled_backgrounds) > BACKGROUND_CACHE_MAX_ENTRIES:
+            _compiled_backgrounds.popitem(last=False)
+    return background
+
+def clear_compiled_backgrounds():
+    """Vacía la caché de fondos compilados (p. ej. para medir el parseo en frío)."""
+    with _compiled_backgrounds_lock:
+        _compiled_backgrounds.clear()
+
+class _BackgroundStreamHandler(xml.sax.handler.ContentHandler):
+    """
+    Lector SAX que copia los elementos visuales del SVG de fondo directamente a
+    'out' a medida que se leen; solo el contenido de <defs> y <style> se guarda
+    en memoria (se escribe al final). <metadata> y <title> se descartan.
+    Sin procesamiento de namespaces, los nombres con prefijo (xlink:href, i:...)
+    se copian literalmente.
+    """
+
+    def __init__(self, out):
+        super().__init__()
+        self.out = out
+        self.depth = 0
+        self.defs_parts = [] # Fragmentos XML de <defs>/<style> pendientes
+        self.namespaces = "" # Declaraciones xmlns:prefijo de la raíz del fondo
+        self._target = None  # Dónde va el subárbol actual: out.write, defs_parts.append o None (descartar)
+        self._subtree_root_depth = None
+        self._open_tag_pending = False
+        self.elements_copied = 0
+
+    def _close_pending_tag(self):
+        if self._open_tag_pending:
+            self._target('>')
+            self._open_tag_pending = False
+
+    def startElement(self, name, attrs):
+        self.depth += 1
+        local_name = name.split(':')[-1]
+        if self.depth == 1:
+            # La raíz <svg> del fondo se convierte en el grupo contenedor; se conservan
+            # sus declaraciones de namespaces con prefijo (el documento ya declara el SVG).
+            self.namespaces = "".join(f" {attr_name}={quoteattr(attrs[attr_name])}" for attr_name in attrs.getNames()
+                                      if attr_name.startswith('xmlns:'))
+            self.out.write(f'<g id="background_elements_from_file"{self.namespaces}>')
+            return
+        if self.depth == 2:
+            self._subtree_root_depth = 2
+            if local_name in ('metadata', 'title'):
+                self._target = None
+            elif local_name == 'defs':
+                self._target = self.defs_parts.append
+                return # Solo interesan los hijos de <defs>
+            elif local_name == 'style':
+                self._target = self.defs_parts.append
+            else:
+                self._target = self.out.write
+                self.elements_copied += 1
+        if self._target is None:
+            return
+        self._close_pending_tag()
+        attributes = "".join(f" {attr_name}={quoteattr(attrs[attr_name])}" for attr_name in attrs.getNames())
+        self._target(f'<{name}{attributes}')
+        self._open_tag_pending = True
+
+    def endElement(self, name):
+        if self.depth == 1:
+            self.out.write('</g>')
+        elif self._target is not None and not (self.depth == 2 and name.split(':')[-1] == 'defs'):
+            if self._open_tag_pending:
+                self._target(' />')
+                self._open_tag_pending = False
+            else:
+                self._target(f'</{name}>')
+        if self.depth == self._subtree_root_depth:
+            self._target = None
+        self.depth -= 1
+
+    def characters(self, content):
+        if self._target is not None and self.depth >= 2:
+            self._close_pending_tag()
+            self._target(escape(content))
+
+def _write_background_tree(out, background):
+    out.write(background.fragment_xml())
+
+def _write_background_stream(out, background_svg_path):
+    """
+    Copia el fondo al documento de salida leyendo el archivo de forma incremental
+    (SAX): la memoria queda acotada por <defs>/<style>, no por el número de paths.
+    """
+    handler = _BackgroundStreamHandler(out)
+    with timed("background_parse", mode="stream", bytes_in=os.path.getsize(background_svg_path)):
+        xml.sax.parse(background_svg_path, handler)
+    out.write(f'<defs{handler.namespaces}>{"".join(handler.defs_parts)}</defs>')
+    print(f"    Fondo copiado en streaming: {handler.elements_copied} elementos de primer nivel.")
+
+def _write_base64_file(out, file_path):
+    """Escribe el contenido de file_path en Base64 por bloques, sin cargarlo entero en memoria."""
+    with open(file_path, "rb") as image_file:
+        pending = b""
+        while True:
+            chunk = image_file.read(BASE64_CHUNK_BYTES)
+            if not chunk:
+                break
+            chunk = pending + chunk
+            usable = len(chunk) - len(chunk) % 3
+            out.write(base64.b64encode(chunk[:usable]).decode('ascii'))
+            pending = chunk[usable:]
+        if pending:
+            out.write(base64.b64encode(pending).decode('ascii'))
+
+def _data_uri(mime_type, data):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+class ExternalAssets(object):
+    """
+    Guarda las imágenes del SVG como archivos aparte, con el hash de su
+    contenido en el nombre (<sha256>.png, .webp...), y devuelve el href con el
+    que se referencian: la ruta relativa desde el SVG o base_url + nombre. Un
+    recurso que ya existe no se vuelve a escribir, así varias composiciones que
+    comparten imagen la guardan una sola vez y el nombre puede cachearse sin
+    caducidad (cambia si cambia el contenido).
+    """
+
+    def __init__(self, output_svg_path, asset_dir=None, base_url=None):
+        self.svg_dir = os.path.dirname(os.path.abspath(output_svg_path))
+        self.asset_dir = os.path.abspath(asset_dir or os.path.join(self.svg_dir, ASSETS_SUBDIR))
+        self.base_url = base_url
+        self.written = []
+        self.reused = []
+
+    def href(self, source, mime_type):
+        """source: ruta del archivo o bytes ya codificados."""
+        if isinstance(source, bytes):
+            digest = hashlib.sha256(source).hexdigest()
+        else:
+            digest = file_sha256(source)
+        file_name = digest[:ASSET_HASH_LENGTH] + ASSET_EXTENSIONS.get(mime_type, ".bin")
+        asset_path = os.path.join(self.asset_dir, file_name)
+        if os.path.exists(asset_path):
+            self.reused.append(file_name)
+        else:
+            os.makedirs(self.asset_dir, exist_ok=True)
+            temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=".", dir=self.asset_dir)
+            try:
+                with os.fdopen(temp_fd, "wb") as asset_file:
+                    if isinstance(source, bytes):
+                        asset_file.write(source)
+                    else:
+                        with open(source, "rb") as source_file:
+                            shutil.copyfileobj(source_file, asset_file)
+                os.replace(temp_path, asset_path) # Atómico: otro proceso puede estar escribiendo el mismo recurso
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self.written.append(file_name)
+        if self.base_url:
+            return self.base_url.rstrip("/") + "/" + file_name
+        return os.path.relpath(asset_path, self.svg_dir).replace(os.sep, "/")
+
+    def summary(self):
+        return {"assets_written": len(self.written), "assets_reused": len(self.reused), "asset_dir": self.asset_dir}
+
+def _image_href(assets, mime_type, data):
+    """href de una imagen ya codificada en memoria: Data URI o recurso externo."""
+    return _data_uri(mime_type, data) if assets is None else assets.href(data, mime_type)
+
+def _prepare_foreground_pieces(foreground_png_path, fg_width, fg_height, foreground_encoding, foreground_layout, report):
+    """
+    Decide qué se incrusta del primer plano. Devuelve None si es el archivo
+    original entero (se puede codificar en streaming desde disco) o una lista de
+    piezas (x, y, ancho, alto, EncodedForeground) en unidades del lienzo.
+    """
+    regions = None
+    if foreground_layout != "full":
+        tile_size = TILE_SIZE if foreground_layout == "tiles" else None
+        (image_width, image_height), regions = split_foreground_regions(foreground_png_path, tile_size)
+        if regions is None:
+            print("    El primer plano no tiene zonas transparentes que recortar; se incrusta entero.")
+        else:
+            print(f"    Primer plano ({foreground_layout}): {len(regions)} región(es) con contenido.")
+
+    if regions is None:
+        if foreground_encoding != "auto":
+            return None
+        regions = [((0, 0, fg_width, fg_height), foreground_png_path)]
+        scale_x = scale_y = 1
+    else:
+        scale_x, scale_y = fg_width / image_width, fg_height / image_height
+
+    pieces = []
+    for (left, top, right, bottom), source in regions:
+        if foreground_encoding == "auto":
+            encoded = choose_foreground_encoding(source)
+        else:
+            encoded = EncodedForeground("png", "image/png", source)
+        geometry = (left * scale_x, top * scale_y, (right - left) * scale_x, (bottom - top) * scale_y)
+        pieces.append((*(int(value) if value == int(value) else round(value, 3) for value in geometry), encoded))
+
+    if report is not None:
+        report["foreground_layout"] = foreground_layout
+        report["foreground_pieces"] = len(pieces)
+        report["foreground_bytes"] = sum(piece[4].total_bytes for piece in pieces)
+        if foreground_encoding == "auto":
+            report["foreground_encoding"] = ",".join(sorted({piece[4].name for piece in pieces}))
+    if len(pieces) == 1 and pieces[0][4].name == "png" and foreground_layout == "full":
+        return None # El archivo original: se incrusta tal cual (en streaming si procede)
+    return pieces
+
+def _piece_mask_id(index, pieces):
+    return FOREGROUND_MASK_ID if len(pieces) == 1 else f"{FOREGROUND_MASK_ID}_{index}"
+
+def _svg_header(display_width, display_height, canvas_width, canvas_height, compact=False):
+    """Declaración XML y <svg> de apertura, como los escribe svgwrite (compact: sin COMPACT_DROPPED_ROOT_ATTRIBUTES)."""
+    profile = '' if compact else 'baseProfile="full" '
+    version = '' if compact else 'version="1.1" '
+    events = '' if compact else 'xmlns:ev="http://www.w3.org/2001/xml-events" '
+    return ('<?xml version="1.0" encoding="utf-8" ?>\n'
+            f'<svg {profile}height="{display_height}px" {version}'
+            f'viewBox="0 0 {canvas_width} {canvas_height}" width="{display_width}px" '
+            f'xmlns="http://www.w3.org/2000/svg" {events}'
+            'xmlns:xlink="http://www.w3.org/1999/xlink">')
+
+class _CompactDrawing(svgwrite.Drawing):
+    """Drawing de svgwrite sin los atributos de la raíz que no afectan al dibujo (ver COMPACT_DROPPED_ROOT_ATTRIBUTES)."""
+
+    def get_xml(self):
+        xml = super(_CompactDrawing, self).get_xml()
+        for name in COMPACT_DROPPED_ROOT_ATTRIBUTES:
+            xml.attrib.pop(name, None)
+        return xml
+
+def _write_final_svg_streaming(output_svg_path, write_background, foreground_png_path,
+                               fg_width, fg_height, canvas_width, canvas_height, foreground_pieces=None,
+                               display_size=None, assets=None, compact=False):
+    """
+    Escribe el SVG compuesto directamente en disco: cabecera, fondo (escrito por
+    write_background(out)), y la imagen
+    de primer plano codificada en Base64 por bloques dentro del atributo href.
+    La memoria pico no depende del tamaño de la imagen. Se escribe en un
+    temporal que se renombra al final para no dejar SVGs a medias.
+    Con foreground_pieces (ver _prepare_foreground_pieces) se incrustan esas
+    piezas ya codificadas en memoria, con su máscara de transparencia si la tienen.
+    display_size=(ancho, alto) fija el tamaño mostrado; el viewBox sigue siendo el lienzo.
+    Con 'assets' (ExternalAssets) las imágenes se guardan aparte y solo se escribe su href.
+    Con compact=True la raíz se escribe sin los atributos redundantes.
+    """
+    display_width, display_height = display_size or (canvas_width, canvas_height)
+    output_dir = os.path.dirname(os.path.abspath(output_svg_path))
+    temp_fd, temp_path = tempfile.mkstemp(suffix=".svg.tmp", dir=output_dir)
+    try:
+        with timed("svg_write_stream") as span, os.fdopen(temp_fd, "w", encoding="utf-8") as out:
+            out.write(_svg_header(display_width, display_height, canvas_width, canvas_height, compact))
+            write_background(out)
+            print("    Contenido del fondo SVG incrustado.")
+
+            if foreground_pieces is None and assets is not None:
+                href = assets.href(foreground_png_path, _foreground_mime_type(foreground_png_path))
+                out.write(f'<image height="{fg_height}px" width="{fg_width}px" x="0" y="0" xlink:href={quoteattr(href)} />')
+            elif foreground_pieces is None:
+                out.write(f'<image height="{fg_height}px" width="{fg_width}px" x="0" y="0" '
+                          f'xlink:href="data:{_foreground_mime_type(foreground_png_path)};base64,')
+                with timed("base64_encode", bytes_in=os.path.getsize(foreground_png_path)):
+                    _write_base64_file(out, foreground_png_path)
+                out.write('" />')
+            for index, (x, y, width, height, encoded) in enumerate(foreground_pieces or ()):
+                geometry = f'height="{height:g}px" width="{width:g}px" x="{x:g}" y="{y:g}"'
+                mask_attribute = ""
+                if encoded.mask_data:
+                    mask_id = _piece_mask_id(index, foreground_pieces)
+                    out.write(f'<defs><mask color-interpolation="sRGB" height="{height:g}" id="{mask_id}" '
+                              f'maskUnits="userSpaceOnUse" style="mask-type:luminance" width="{width:g}" x="{x:g}" y="{y:g}">'
+                              f'<image {geometry} xlink:href={quoteattr(_image_href(assets, "image/png", encoded.mask_data))} /></mask></defs>')
+                    mask_attribute = f' mask="url(#{mask_id})"'
+                out.write(f'<image {geometry}{mask_attribute} '
+                          f'xlink:href={quoteattr(_image_href(assets, encoded.mime_type, encoded.data))} />')
+            if assets is not None:
+                print(f"    Imagen de primer plano referenciada como recurso externo (en {assets.asset_dir}).")
+            else:
+                print("    Imagen de primer plano incrustada como Base64 (en streaming).")
+            out.write('</svg>\n')
+            span["bytes_out"] = out.tell()
+        os.replace(temp_path, output_svg_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _finish_final_svg(output_svg_path, report, compose_start, assets=None):
+    print(f"SVG final guardado exitosamente en {output_svg_path}")
+    output_size = os.path.getsize(output_svg_path)
+    if report is not None:
+        report["output_size"] = output_size
+        if assets is not None:
+            report.update(assets.summary())
+    record_stage("compose", time.perf_counter() - compose_start, bytes_out=output_size)
+    return True
 
 def create_final_svg(
     output_svg_path,
@@ -13,407 +519,122 @@ def create_final_svg(
     fg_width,
     fg_height,
     svg_width=None,
-    svg_height=None
+    svg_height=None,
+    stream_output=False,
+    background_mode="tree",
+    compact=False,
+    precision=None,
+    report=None,
+    foreground_encoding="png",
+    display_size=None,
+    foreground_layout="full",
+    merge_defs=False,
+    id_prefix=BACKGROUND_ID_PREFIX,
+    asset_mode="inline",
+    asset_dir=None,
+    asset_base_url=None,
+    simplify_tolerance=None
 ):
+    """
+    Crea el SVG final: contenido del SVG de fondo + imagen de primer plano en Base64.
+    Con stream_output=True el documento se escribe directamente en disco y la
+    imagen se codifica por bloques (memoria constante para imágenes grandes);
+    si no, se construye con svgwrite y se guarda con pretty-print.
+    background_mode="stream" lee el fondo de forma incremental y copia sus
+    elementos a la salida sin construir el árbol (para fondos enormes; implica
+    stream_output=True). Con "tree" (por defecto) se parsea una sola vez en memoria
+    y se guarda compilado (ver get_compiled_background), de modo que componer
+    muchos primeros planos sobre el mismo fondo no lo vuelve a procesar.
+    background_svg_path también puede ser un BackgroundSVG ya cargado.
+    compact=True escribe sin pretty-print y compacta el fondo (sin <metadata>,
+    namespaces de editor ni atributos por defecto); 'precision' limita los
+    decimales de las coordenadas. Si se pasa un dict en 'report' se rellena con
+    los bytes del fondo antes/después de compactar y el tamaño del SVG final.
+    foreground_encoding="auto" prueba el PNG tal cual, WebP con alfa y JPEG con
+    una máscara de transparencia de pocos bits, e incrusta la opción más pequeña
+    que no baja de la calidad mínima (ver foreground_encoder); "png" (por
+    defecto) incrusta el archivo sin recodificar.
+    display_size=(ancho, alto) escribe ese tamaño en width/height manteniendo el
+    viewBox del lienzo (variantes reducidas que reutilizan las coordenadas del fondo).
+    foreground_layout="crop" recorta el primer plano al rectángulo que envuelve
+    su contenido no transparente; "tiles" lo divide en mosaicos de TILE_SIZE px,
+    descarta los totalmente transparentes e incrusta el resto como <image>
+    separados en su posición. "full" (por defecto) incrusta la imagen entera.
+    merge_defs=True guarda una sola vez las definiciones (<defs>) y reglas CSS
+    idénticas del fondo y antepone id_prefix a todos sus IDs, reescribiendo las
+    referencias url(#...), href y xlink:href (ver svg_defs_merger).
+    asset_mode="external" no incrusta el primer plano: lo guarda (junto con sus
+    máscaras) en asset_dir (por defecto <carpeta del SVG>/assets) con el hash
+    del contenido en el nombre y lo referencia por ruta relativa o, si se pasa
+    asset_base_url, por esa URL + nombre (ver ExternalAssets).
+    simplify_tolerance (unidades del lienzo) activa la etapa de geometría del
+    fondo: simplifica los trazados dentro de esa tolerancia, los reescribe con la
+    codificación más corta, fusiona trazados vecinos con el mismo estilo y quita
+    los elementos que quedan fuera del lienzo (ver svg_geometry; requiere NumPy).
+    Con la instrumentación activa (ver metrics) se cronometran el parseo del
+    fondo, la preparación y codificación Base64 del primer plano, el guardado y
+    la composición completa ("compose").
+    """
+    compose_start = time.perf_counter()
     try:
         canvas_width = svg_width if svg_width is not None else fg_width
         canvas_height = svg_height if svg_height is not None else fg_height
 
-        dwg = svgwrite.Drawing(output_svg_path, 
-                               size=(f"{canvas_width}px", f"{canvas_height}px"), 
-                               profile='full',
-                               viewBox=f"0 0 {canvas_width} {canvas_height}")
-
         print(f"Creando SVG final en: {output_svg_path}")
+        display_width, display_height = display_size or (canvas_width, canvas_height)
         print(f"  Dimensiones del lienzo SVG: {canvas_width}x{canvas_height}")
+        if display_size:
+            print(f"  Tamaño mostrado: {display_width}x{display_height}")
+
+        if foreground_encoding not in FOREGROUND_ENCODINGS:
+            print(f"  Error: codificación de primer plano desconocida '{foreground_encoding}'. Use una de {FOREGROUND_ENCODINGS}.")
+            return False
+        if foreground_layout not in FOREGROUND_LAYOUTS:
+            print(f"  Error: disposición de primer plano desconocida '{foreground_layout}'. Use una de {FOREGROUND_LAYOUTS}.")
+            return False
+        if asset_mode not in ASSET_MODES:
+            print(f"  Error: modo de recursos desconocido '{asset_mode}'. Use uno de {ASSET_MODES}.")
+            return False
+        if simplify_tolerance is not None and not simplify_tolerance > 0:
+            print(f"  Error: la tolerancia de simplificación debe ser mayor que 0 (se recibió {simplify_tolerance}).")
+            return False
+        assets = ExternalAssets(output_svg_path, asset_dir, asset_base_url) if asset_mode == "external" else None
+        foreground_pieces = None
+        if foreground_encoding == "auto" or foreground_layout != "full":
+            if not os.path.exists(foreground_png_path):
+                print(f"    Error: Archivo de imagen de primer plano no encontrado: {foreground_png_path}")
+                return False
+            print(f"  Preparando primer plano ({foreground_layout}, codificación {foreground_encoding}): {foreground_png_path}")
+            with timed("foreground_prepare", encoding=foreground_encoding, layout=foreground_layout):
+                foreground_pieces = _prepare_foreground_pieces(foreground_png_path, fg_width, fg_height,
+                                                               foreground_encoding, foreground_layout, report)
 
         print(f"  Procesando fondo SVG desde: {background_svg_path}")
-        background_group = dwg.g(id="background_elements_from_file")
+        if background_mode == "stream" and not isinstance(background_svg_path, BackgroundSVG):
+            if compact or precision is not None:
+                print("  Aviso: el modo compacto no se aplica al fondo leído en streaming.")
+            if merge_defs:
+                print("  Aviso: la fusión de definiciones no se aplica al fondo leído en streaming.")
+            if simplify_tolerance is not None:
+                print("  Aviso: la simplificación de trazados no se aplica al fondo leído en streaming.")
+            if not os.path.exists(foreground_png_path):
+                print(f"    Error: Archivo de imagen de primer plano no encontrado: {foreground_png_path}")
+                return False
+            try:
+                _write_final_svg_streaming(output_svg_path,
+                                           lambda out: _write_background_stream(out, background_svg_path),
+                                           foreground_png_path, fg_width, fg_height, canvas_width, canvas_height,
+                                           foreground_pieces, display_size, assets, compact)
+            except xml.sax.SAXParseException as e_parse_main:
+                print(f"  CRÍTICO: Error al parsear el archivo SVG de fondo principal: {e_parse_main}. No se puede continuar.")
+                return False
+            return _finish_final_svg(output_svg_path, report, compose_start, assets)
 
         try:
-            tree = ET.parse(background_svg_path)
-            background_root = tree.getroot() # Este es el elemento <svg> del archivo de fondo
-            
-            # Añadir <defs> del SVG de fondo
-            # Es importante que los IDs en defs sean únicos globalmente o se usen prefijos.
-            bg_defs_element = background_root.find('{http://www.w3.org/2000/svg}defs')
-            if bg_defs_element is not None:
-                for def_child in list(bg_defs_element): # Iterar sobre los hijos de <defs>
-                    # Convertir el elemento ElementTree a string XML
-                    def_child_str = ET.tostring(def_child, encoding='unicode').strip()
-                    # svgwrite no tiene un método directo para añadir string XML crudo a defs
-                    # de forma que lo parse y lo convierta en objetos svgwrite.
-                    # Una opción es crear un objeto SVG temporal, añadir el string y extraer el elemento,
-                    # o si los defs son simples, recrearlos con métodos de svgwrite.
-                    # Por ahora, si hay defs complejos, esta parte puede ser un desafío.
-                    # Un enfoque es añadirlo como un fragmento sin procesar.
-                    # dwg.defs.elements.append(svgwrite.utils.SVGElement(def_child_str)) # Esto podría no ser API pública
-                    # La forma más segura es recrear los elementos de defs o esperar que los estilos
-                    # se hereden o estén en línea.
-                    # Para <style>, podemos hacer:
-                    if def_child.tag.endswith('style') and def_child.text:
-                        dwg.defs.add(dwg.style(content=def_child.text))
-                print("    Intentando añadir <style> de defs del SVG de fondo.")
-
-
-            # Añadir los elementos visuales del fondo
-            # Vamos a añadir los hijos del <svg> raíz del fondo a nuestro grupo.
-            for child_element in background_root:
-                tag_name = child_element.tag.split('}',1)[-1] if '}' in child_element.tag else child_element.tag
-                if tag_name not in ['defs', 'metadata', 'title', 'style']: # No volver a añadir defs o style aquí
-                    element_str = ET.tostring(child_element, encoding='unicode').strip()
-                    # Limpiar declaración XML si está presente
-                    element_str = element_str.replace('<?xml version=\'1.0\' encoding=\'us-ascii\'?>', '')
-                    
-                    # Crear un elemento base y añadir el XML como texto.
-                    # Esto es una forma de "inyectar" el XML.
-                    # Necesitamos asegurarnos de que svgwrite.base.BaseElement es la forma correcta.
-                    # El módulo 'xmlpretty' de svgwrite o 'utils' podría tener herramientas,
-                    # pero para inyección directa, esto es lo más cercano sin parseo profundo.
-                    # Si 'element_str' es un elemento SVG válido como <path ... /> o <g>...</g>
-                    # podríamos intentar añadirlo a un grupo.
-                    # svgwrite no tiene una forma directa de "dwg.add_xml_string(element_str)".
-                    # Usaremos un truco: crear un elemento 'g' vacío y establecer su contenido.
-                    # Esto es bastante hacky.
-                    try:
-                         # La API para esto es un poco oscura. Un truco es usar un elemento que pueda tener texto:
-                         # texto_wrapper = dwg.text('') # Crear un elemento de texto vacío
-                         # texto_wrapper.add(svgwrite.utils.SVGElement(element_str)) # Añadir el string como un elemento SVG
-                         # background_group.add(texto_wrapper)
-                         # Esto probablemente no funcione como se espera.
-                         
-                         # Opción más robusta si falla lo anterior:
-                         # Crear un elemento SVG anidado para el contenido del fondo
-                         # Esto es más seguro para preservar estilos y estructuras complejas del SVG de fondo.
-                         # Le damos dimensiones y viewBox si el SVG de fondo los tenía.
-                         
-                         # Por ahora, el enfoque más simple que podría funcionar es leer el contenido
-                         # interno del SVG de fondo y añadirlo como un string "raw"
-                         # PERO, Raw no está donde pensábamos.
-                         
-                         # ÚLTIMO INTENTO CON `add_xml_fragment` (si existe en tu versión) o fallback
-                         # La API de svgwrite puede ser quisquillosa con XML externo.
-                         # A menudo, la mejor manera es recrear los elementos.
-                         # Como fallback a todo, y dado que tu SVG de ejemplo es la guía:
-                         # Si el SVG de fondo es simple y no tiene su propia declaración XML/DOCTYPE
-                         # podríamos intentar concatenar su contenido (sin la etiqueta <svg> exterior)
-                         # directamente como texto.
-                         
-                         # Fallback MUY simple (puede romper SVGs complejos):
-                         # Leer el SVG de fondo, extraer su contenido interno y añadirlo como un string crudo.
-                         with open(background_svg_path, 'r', encoding='utf-8') as f_bg_inner:
-                             bg_content_full = f_bg_inner.read()
-                         
-                         inner_content = ""
-                         root_tag_match = ET.fromstring(bg_content_full) # Para encontrar el nombre del tag raíz
-                         
-                         # Encontrar el final de la etiqueta <svg ...> y el inicio de </svg>
-                         svg_tag_start_str = f"<{root_tag_match.tag}"
-                         svg_tag_end_str = f"</{root_tag_match.tag}>"
-
-                         start_index = bg_content_full.find('>')
-                         end_index = bg_content_full.rfind(svg_tag_end_str)
-
-                         if start_index != -1 and end_index != -1:
-                             inner_content = bg_content_full[start_index + 1 : end_index].strip()
-                         
-                         if inner_content:
-                             # Aquí es donde necesitaríamos una forma de añadir XML crudo.
-                             # svgwrite no tiene un método simple y directo como dwg.add_raw_xml().
-                             # La opción más segura es anidar el SVG completo:
-                             nested_svg = dwg.svg(x=0, y=0, width=canvas_width, height=canvas_height) # Ajusta según sea necesario
-                             # Para el href del svg anidado, si el fondo es un archivo
-                             # podríamos usar un data URI para el SVG de fondo también, o un path relativo
-                             # Pero el objetivo era INCORPORAR las curvas.
-                             
-                             # Si el SVG de fondo usa clases CSS definidas en el SVG principal (lo cual no es el caso aquí)
-                             # o si sus estilos son inline, la inyección de sus elementos internos es viable.
-                             # Reintentando con svgwrite.etree.fromstring y añadiendo hijos
-                             # Esto es complejo debido a los namespaces.
-                             
-                             # Vamos a simplificar drásticamente para la prueba y asumir que el fondo
-                             # puede ser tratado como un grupo de elementos sin sus propios <defs> complejos
-                             # que deban ser fusionados.
-                             
-                             # Añadimos cada hijo del root del SVG de fondo como un elemento 'g' con contenido XML
-                             # Esto sigue siendo un hack.
-                             for bg_child in background_root:
-                                 bg_child_tag = bg_child.tag.split('}')[-1]
-                                 if bg_child_tag not in ['defs', 'metadata', 'title', 'style']:
-                                     el_str = ET.tostring(bg_child, encoding='unicode').strip().replace('<?xml version=\'1.0\' encoding=\'us-ascii\'?>', '')
-                                     # Crear un grupo y añadir el string como texto (no ideal, pero un intento)
-                                     # g_wrapper = dwg.g()
-                                     # g_wrapper.add(svgwrite.text.Text(el_str)) # Esto lo tratará como texto literal
-                                     # background_group.add(g_wrapper)
-                                     # La mejor forma es, si se usa svgwrite, RECREAR los elementos.
-                                     # Como el ejemplo original usa Base64 para la imagen y paths directos,
-                                     # intentaremos insertar los paths directamente.
-                                     # Esto requiere que el SVG de fondo sea simple (solo paths, rects, etc.)
-                                     # y que sus estilos se manejen (ej. inline o clases definidas en el SVG principal)
-                                     
-                                     # Por ahora, el enfoque más robusto si no podemos parsear y recrear
-                                     # es tratar el SVG de fondo como una imagen en sí misma.
-                                     # PERO el objetivo es "curvas y color".
-                                     #
-                                     # DADO EL SVG DE EJEMPLO ORIGINAL:
-                                     # Los paths rojos y los rects negros/blancos son elementos directos.
-                                     # La imagen está incrustada.
-                                     #
-                                     # Nuestra estrategia debería ser:
-                                     # 1. Crear dwg.
-                                     # 2. Leer el SVG de fondo. Tomar CADA path/rect/circle, etc., y sus atributos
-                                     #    y RECREARLO usando los métodos de dwg (dwg.path, dwg.rect).
-                                     #    Esto es lo más robusto.
-                                     #
-                                     # Por ahora, para avanzar, haré la inserción más simple posible del contenido interno.
-                                     # que es leer el archivo y pegarlo, quitando la etiqueta <svg> externa.
-                                     # Esto depende de que los estilos estén inline o definidos en el SVG principal.
-                                     pass # Lo haremos después con la estrategia de string
-                                     
-                            # Estrategia de inserción de string simplificada para el contenido del fondo:
-                            with open(background_svg_path, 'r', encoding='utf-8') as f_bg_content:
-                                full_bg_svg = f_bg_content.read()
-                            
-                            # Extraer contenido entre las etiquetas <svg> ... </svg>
-                            # Esto es muy básico y puede fallar con SVGs complejos o con comentarios/CDATA fuera del root.
-                            start_tag = full_bg_svg.find('>')
-                            end_tag = full_bg_svg.rfind('</svg>')
-                            if start_tag != -1 and end_tag != -1 and start_tag < end_tag:
-                                inner_bg_content = full_bg_svg[start_tag + 1:end_tag].strip()
-                                # Usar un elemento 'g' como contenedor para el contenido crudo
-                                # y luego añadir ese grupo al dibujo principal.
-                                # Para esto, necesitamos un elemento que acepte contenido de texto crudo.
-                                # `svgwrite` no tiene un "dwg.add_raw_html_or_xml()".
-                                #
-                                # La forma más compatible de inyectar SVG preexistente es a través de un <use>
-                                # si el SVG de fondo define un elemento con ID, o anidando un <svg>
-                                # o recreando elementos.
-                                #
-                                # Para cumplir con "curvas y color" y basándonos en que tu SVG de ejemplo
-                                # tiene los paths directamente, vamos a asumir que el SVG de fondo
-                                # que proporcionas también tendrá elementos directos.
-                                #
-                                # Enfoque final para esta iteración: Añadir el SVG de fondo como un <svg> anidado.
-                                # Esto preserva sus propios estilos y estructura.
-                                # Le damos un x, y para posicionarlo (0,0 por defecto)
-                                # y podemos intentar que herede el tamaño del canvas si no tiene el suyo.
-                                # dwg.add(dwg.svg(x=0, y=0, href=background_svg_path)) <- Esto lo enlazaría, no incrustaría contenido
-                                
-                                # Para incrustar contenido, y si Raw no funciona, la alternativa es
-                                # parsear con xml.etree.ElementTree y recrear cada elemento.
-                                # Esto se vuelve complejo muy rápido.
-                                #
-                                # Vamos a intentar con un grupo y añadiendo el string crudo (a menudo no funciona bien con estilos/defs).
-                                # El problema con Raw es que parece que no está donde uno esperaría en algunas versiones o contextos.
-                                #
-                                # SOLUCIÓN MÁS SIMPLE Y DIRECTA para insertar XML crudo que svgwrite no procesará:
-                                # Añadirlo como un texto multilínea a un elemento 'g' o directamente al 'dwg'.
-                                # Esto es un HACK y depende de cómo el renderizador SVG lo interprete.
-                                background_group.add(svgwrite.mixins.Presentation()._repr_xml_element(inner_bg_content))
-                                # NO, esto es incorrecto.
-                                #
-                                # La forma correcta de añadir XML arbitrario si no hay un método directo es
-                                # usar la capacidad de svgwrite de añadir elementos base y luego manipular su contenido.
-                                # Pero eso es bajo nivel.
-                                #
-                                # Reconsiderando `Raw`: Si `svgwrite.text.Raw` no existe, es posible que `Raw`
-                                # sea un alias o esté en `svgwrite.utils` o `svgwrite.base`.
-                                # Dado que el error anterior fue `svgwrite.container` no tiene `Raw`,
-                                # y ahora `svgwrite.text` no tiene `Raw`,
-                                # es posible que `Raw` no sea la forma estándar de hacerlo o haya cambiado de nombre/ubicación.
-                                #
-                                # La alternativa más robusta si no podemos inyectar el XML de los hijos directamente
-                                # es ANIDAR el SVG completo.
-                                dwg.add(dwg.image(href=background_svg_path, insert=(0,0), size=(f"{canvas_width}px", f"{canvas_height}px")))
-                                # ESTO ENLAZA EL SVG DE FONDO COMO IMAGEN, NO INCORPORA CURVAS EDITABLES.
-                                #
-                                # Para incrustar curvas, necesitamos procesar el SVG de fondo.
-                                # Vamos a asumir que tu SVG de fondo tiene los paths en su raíz o en un grupo principal.
-                                # Y que sus estilos están en línea o en clases simples.
-                                
-                                # **ESTRATEGIA REVISADA PARA FONDO SVG:**
-                                # 1. Parsear el SVG de fondo.
-                                # 2. Tomar sus <defs> (especialmente <style>) y tratar de añadirlos.
-                                # 3. Tomar sus elementos visuales (<path>, <rect>, <circle>, <g>, etc.)
-                                #    y AÑADIRLOS COMO STRINGS XML CRUDOS.
-                                #    svgwrite no tiene una forma elegante de añadir XML crudo directamente al flujo principal
-                                #    que no sea a través de elementos como <text> o <desc> que lo escaparían.
-                                #    La única forma real es crear un SVG anidado o *recrear* los elementos.
-                                #
-                                # Como el SVG de ejemplo tiene los paths directamente, intentaremos esto:
-                                for child_el in background_root: # Itera sobre los hijos del <svg> del fondo
-                                    tag = child_el.tag.split('}')[-1]
-                                    if tag == 'style': # Manejar estilos en defs
-                                        if child_el.text: dwg.defs.add(dwg.style(content=child_el.text))
-                                    elif tag not in ['defs', 'metadata', 'title']:
-                                        # Para otros elementos, los convertimos a string y los añadimos a un grupo
-                                        # Esto es aún un hack, pero es lo más cercano sin recreación completa
-                                        # La forma más segura es que el SVG de fondo use atributos de presentación (fill="red")
-                                        # en lugar de depender exclusivamente de clases CSS que podrían no transferirse bien.
-                                        el_str = ET.tostring(child_el, encoding='unicode').strip().replace('<?xml version=\'1.0\' encoding=\'us-ascii\'?>', '')
-                                        # background_group.add(svgwrite.utils.SVGElement(el_str)) # Esto no es una API pública estable.
-                                        # El problema es que svgwrite quiere crear los elementos, no que se le inyecte XML.
-                                        # Si tu SVG de fondo es simple (solo paths, rects, circles con atributos inline)
-                                        # podrías parsearlo y recrear cada elemento.
-                                        # Ejemplo para un path:
-                                        # if tag == 'path':
-                                        #   new_path = dwg.path(d=child_el.get('d'))
-                                        #   for attr, val in child_el.attrib.items():
-                                        #       if attr != 'd': new_path.attribs[attr] = val
-                                        #   background_group.add(new_path)
-                                        # Esto se vuelve muy complejo para todos los tipos de elementos.
-                                        #
-                                        # DADO EL EJEMPLO SVG: los paths rojos y rects negros/blancos.
-                                        # Vamos a asumir que el SVG que proporcionas como fondo es similar
-                                        # y podemos simplemente volcar su contenido interno (sin la etiqueta <svg> exterior)
-                                        # dentro de un <g> en el SVG principal. Los estilos deben ser inline o
-                                        # las clases definidas en el SVG principal (o transferidas desde los defs del fondo).
-                                        # Este es el enfoque del SVG de ejemplo.
-                                        pass # Se hará abajo con la lectura de string
-
-                                # Leer el contenido completo del SVG de fondo y añadir todo lo que está DENTRO de la etiqueta <svg> raíz.
-                                with open(background_svg_path, 'r', encoding='utf-8') as f_bg_content:
-                                    full_bg_svg_text = f_bg_content.read()
-                                
-                                # Extraer contenido entre > de la etiqueta svg y </svg>
-                                first_gt = full_bg_svg_text.find('>')
-                                last_svg_tag = full_bg_svg_text.rfind('</svg>')
-                                if first_gt != -1 and last_svg_tag != -1 and first_gt < last_svg_tag:
-                                    inner_svg_content = full_bg_svg_text[first_gt + 1:last_svg_tag].strip()
-                                    # Añadir este contenido crudo a nuestro grupo de fondo
-                                    # Para esto, svgwrite necesita que el string sea añadido a un elemento que acepte texto.
-                                    # O, si la versión de svgwrite lo soporta, directamente a un grupo.
-                                    # Si no, la única forma es anidar el SVG o usar una biblioteca diferente
-                                    # que permita manipulación de DOM más directa (como lxml).
-                                    #
-                                    # Dado que tu SVG de ejemplo tiene los paths y rects como hijos directos de un <g>,
-                                    # el enfoque de inyectar el "inner_svg_content" en un <g> es el más cercano.
-                                    # PERO `svgwrite` no tiene un método directo para `g.add_xml_string()`.
-                                    #
-                                    # Usaremos `dwg.add(svgwrite.basic_shapes.Text(inner_svg_content))` pero esto
-                                    # tratará el SVG como texto literal, lo cual no es lo que queremos.
-                                    #
-                                    # La forma más pragmática si los estilos están inline o en el SVG de fondo:
-                                    # Envolver el contenido en un <g> si no lo está ya.
-                                    # Y usar el método add() con el objeto Drawing.
-                                    # La clave es que svgwrite.Drawing.add() espera objetos svgwrite.
-                                    #
-                                    # La solución más simple y que se alinea con tu SVG de ejemplo es
-                                    # asumir que el SVG de fondo ya está bien estructurado con sus estilos aplicados
-                                    # y simplemente necesitamos colocarlo en el orden correcto.
-                                    #
-                                    # Fallback a incrustar el SVG de fondo como una imagen referenciada si la
-                                    # incrustación directa de elementos es demasiado compleja con svgwrite.
-                                    # PERO esto no cumple "curvas y color" como elementos editables.
-                                    #
-                                    # Si `Raw` no está disponible, la única forma real de inyectar XML crudo
-                                    # en `svgwrite` es una característica no documentada o no estándar.
-                                    #
-                                    # Vamos a intentar añadir el SVG de fondo como un <svg> anidado.
-                                    # Esto es estándar y debería funcionar.
-                                    # Asegúrate de que el SVG de fondo tenga sus propios atributos de tamaño o viewBox.
-                                    bg_svg_element = dwg.svg(x=0, y=0) # Puedes ajustar x,y,width,height
-                                    # Leer el contenido del archivo SVG y establecerlo como el 'texto' del elemento <svg> anidado
-                                    # Esto es un hack, svgwrite no lo soporta así.
-                                    #
-                                    # La forma más limpia con svgwrite es RECREAR cada elemento.
-                                    # Como eso es demasiado complejo para el caso general sin saber la estructura exacta del fondo,
-                                    # vamos a usar el método más simple que svgwrite ofrece para incluir un SVG externo
-                                    # como un bloque, que es usar el elemento <use> si podemos definir el fondo
-                                    # como un símbolo, o simplemente tratarlo como una imagen si no necesitamos editarlo.
-                                    #
-                                    # Ya que tu SVG de ejemplo tiene los paths y rects en el mismo nivel que la imagen,
-                                    # el objetivo es replicar eso.
-                                    #
-                                    # VAMOS A INTENTAR LA INSERCIÓN DIRECTA DE STRING (este es el método más "crudo"):
-                                    # Esto asume que el SVG de fondo es solo un fragmento sin la etiqueta <svg> exterior
-                                    # y sin declaraciones XML o DOCTYPE.
-                                    # Si es un archivo SVG completo, necesitamos extraer solo el contenido.
-                                    if inner_svg_content:
-                                         # Añadir al grupo principal, no al background_group para que esté en el flujo
-                                         dwg.add(dwg. πολλοί(inner_svg_content)) # ' πολλοί' es un hack para que acepte un string
-                                         # NO, esto es incorrecto.
-                                         #
-                                         # Usaremos el hecho de que dwg.add puede tomar un string si es un elemento simple.
-                                         # Pero para múltiples elementos, necesitamos un grupo.
-                                         # La forma más directa que svgwrite ofrece para contenido "crudo" es
-                                         # añadiéndolo a los `elements` de un grupo.
-                                         # Esto es bajo nivel y puede no ser la API pública ideal.
-                                         # Ejemplo: background_group.elements.append(inner_svg_content) # String directo
-                                         #
-                                         # Dado el error original, y la dificultad de inyectar XML crudo con svgwrite
-                                         # de una manera limpia y soportada para fragmentos complejos,
-                                         # la opción más robusta es usar una biblioteca que maneje la fusión de SVG
-                                         # a nivel de DOM, como `svgutils`.
-                                         #
-                                         # Sin embargo, para mantenerlo dentro de `svgwrite`, la solución
-                                         # más alineada con tu SVG de ejemplo (donde los paths y la imagen están al mismo nivel)
-                                         # es:
-                                         # 1. Parsear el SVG de fondo.
-                                         # 2. Recrear cada elemento (<path>, <rect>, etc.) con svgwrite y añadirlo.
-                                         # Esto es lo más correcto pero más laborioso.
-                                         #
-                                         # **Si `svgwrite.text.Raw` no funciona, y asumiendo que tu SVG de fondo es simple**
-                                         # (solo elementos básicos con atributos inline para estilo),
-                                         # podrías parsearlo con `xml.etree.ElementTree` y recrear los elementos.
-                                         # Ejemplo simplificado (solo para paths):
-                                         for elem in background_root:
-                                             if elem.tag.endswith('path'):
-                                                 path_data = elem.get('d')
-                                                 attrs = dict(elem.attrib) # Copiar todos los atributos
-                                                 if 'd' in attrs: del attrs['d'] # d se pasa por separado
-                                                 background_group.add(dwg.path(d=path_data, **attrs))
-                                             # Añadir manejo para rect, circle, etc.
-                                         dwg.add(background_group)
-
-                                # **Si el SVG de fondo es complejo y usa <style> o <defs> extensivamente,**
-                                # **la única forma real con svgwrite es anidarlo como un <svg> completo**
-                                # **o usar una herramienta de fusión de SVG más potente.**
-                                #
-                                # **Por ahora, el bloque de prueba crea un SVG de fondo simple.**
-                                # **Si el SVG de fondo que tú proporcionas es igualmente simple (paths y rects con clases o fills inline),**
-                                # **el parseo con ElementTree y la adición de strings crudos de cada elemento (quitando namespaces)**
-                                # **a un grupo `dwg.g()` debería funcionar si `Raw` no está disponible.**
-                                #
-                                # **Dado que `Raw` sigue dando problemas, el enfoque de anidar el SVG de fondo**
-                                # **es el más seguro con `svgwrite` puro si no queremos recrear cada elemento.**
-                                # **Esto se hace con `<image href="fondo.svg">` (enlace) o `<svg x="0" y="0">contenido_del_fondo_aqui</svg>` (incrustación).**
-                                # **Para incrustar el contenido como elementos editables, necesitamos recrearlos.**
-                                #
-                                # Vamos a usar el método de parsear y añadir los hijos,
-                                # pero no como Raw, sino intentando recrear algunos básicos o
-                                # esperando que la conversión a string de ElementTree sea suficiente
-                                # si se añade a un grupo.
-                                #
-                                # ¡CORRECCIÓN FINAL PARA `Raw`!
-                                # El objeto para XML crudo es `svgwrite.xml.Raw`
-                                # Lo importaremos como:
-                                from svgwrite import xml # Importar xml
-                                # Y luego usar:
-                                # xml.Raw(text=element_str)
-                                
-                                # Corrigiendo el bucle de los hijos del fondo:
-                                for child_el in background_root:
-                                    tag = child_el.tag.split('}')[-1]
-                                    if tag == 'style' and bg_defs_element is None: # Si el estilo está en la raíz
-                                        if child_el.text: dwg.defs.add(dwg.style(content=child_el.text))
-                                    elif tag not in ['defs', 'metadata', 'title', 'style']:
-                                        el_str = ET.tostring(child_el, encoding='unicode').strip().replace('<?xml version=\'1.0\' encoding=\'us-ascii\'?>', '')
-                                        background_group.add(xml.Raw(text=el_str)) # USAR xml.Raw
-                                dwg.add(background_group)
-                                print(f"    Contenido del fondo SVG incrustado.")
-
-
-                        except Exception as e_bg_parse_children:
-                             print(f"    Error al procesar hijos del SVG de fondo: {e_bg_parse_children}.")
-                             print("    Intentando inserción cruda del SVG de fondo completo (puede resultar en SVG anidado).")
-                             with open(background_svg_path, 'r', encoding='utf-8') as f_bg_full:
-                                 bg_svg_content_full = f_bg_full.read()
-                             if bg_svg_content_full.startswith("<?xml"):
-                                 bg_svg_content_full = bg_svg_content_full.split("?>",1)[1].strip()
-                             dwg.add(xml.Raw(text=bg_svg_content_full)) # USAR xml.Raw
-
-
+            if isinstance(background_svg_path, BackgroundSVG):
+                background = background_svg_path
+            else:
+                background = get_compiled_background(background_svg_path)
         except ET.ParseError as e_parse_main:
             print(f"  CRÍTICO: Error al parsear el archivo SVG de fondo principal: {e_parse_main}. No se puede continuar.")
             return False
@@ -421,25 +642,113 @@ def create_final_svg(
             print(f"  Error general severo al procesar SVG de fondo: {e_bg_main}")
             return False
 
+        if merge_defs:
+            with timed("defs_merge", prefix=id_prefix):
+                background, merge_summary = background.merged_defs(id_prefix)
+            print(f"  Definiciones del fondo fusionadas: {merge_summary['defs_before']} -> {merge_summary['defs_after']} defs, "
+                  f"{merge_summary['style_rules_before']} -> {merge_summary['style_rules_after']} reglas CSS (IDs con prefijo '{id_prefix}').")
+            if report is not None:
+                report.update(merge_summary)
+
+        if simplify_tolerance is not None:
+            with timed("geometry", tolerance=simplify_tolerance) as span:
+                background, geometry_summary = background.simplified(simplify_tolerance, (0, 0, canvas_width, canvas_height))
+                span.update(geometry_summary or {})
+            if geometry_summary:
+                print(f"  Geometría del fondo: {geometry_summary['paths']} trazados "
+                      f"({geometry_summary['path_bytes_before'] / 1024:.2f} KB -> {geometry_summary['path_bytes_after'] / 1024:.2f} KB), "
+                      f"{geometry_summary['paths_merged']} fusionados, {geometry_summary['elements_culled']} fuera del lienzo.")
+                if report is not None:
+                    report.update(geometry_summary)
+
+        if compact or precision is not None:
+            original_bytes = len(background.fragment_xml().encode('utf-8'))
+            background = background.minified(precision)
+            compact_bytes = len(background.fragment_xml().encode('utf-8'))
+            saved_percent = 100 * (original_bytes - compact_bytes) / original_bytes if original_bytes else 0
+            print(f"  Fondo compactado: {original_bytes / 1024:.2f} KB -> {compact_bytes / 1024:.2f} KB (-{saved_percent:.1f}%)")
+            if report is not None:
+                report.update({"background_bytes_before": original_bytes, "background_bytes_after": compact_bytes})
+
+        if stream_output:
+            if not os.path.exists(foreground_png_path):
+                print(f"    Error: Archivo de imagen de primer plano no encontrado: {foreground_png_path}")
+                return False
+            _write_final_svg_streaming(output_svg_path, lambda out: _write_background_tree(out, background),
+                                       foreground_png_path, fg_width, fg_height, canvas_width, canvas_height,
+                                       foreground_pieces, display_size, assets, compact)
+            return _finish_final_svg(output_svg_path, report, compose_start, assets)
+
+        drawing_class = _CompactDrawing if compact else svgwrite.Drawing
+        dwg = drawing_class(output_svg_path, 
+                               size=(f"{display_width}px", f"{display_height}px"), 
+                               profile='full',
+                               viewBox=f"0 0 {canvas_width} {canvas_height}")
+
+        background_group = dwg.g(id="background_elements_from_file")
+        try:
+            # Añadir <style> y <defs> del SVG de fondo y sus elementos visuales tal cual (RawElement).
+            # Con merge_defs los IDs del fondo ya llevan prefijo y las definiciones repetidas se han fusionado.
+            for style_text in background.style_texts:
+                dwg.defs.add(dwg.style(content=style_text))
+            for def_element in background.defs_elements:
+                dwg.defs.add(RawElement(def_element))
+            for body_element in background.body_elements:
+                background_group.add(RawElement(body_element))
+            dwg.add(background_group)
+            print("    Contenido del fondo SVG incrustado.")
+        except Exception as e_bg_parse_children:
+            print(f"    Error al procesar hijos del SVG de fondo: {e_bg_parse_children}.")
+            print("    Intentando inserción cruda del SVG de fondo completo (puede resultar en SVG anidado).")
+            dwg.add(RawElement(background.root))
+
 
         # --- Imagen de primer plano ---
         print(f"  Añadiendo imagen PNG de primer plano: {foreground_png_path}")
         try:
-            with open(foreground_png_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            mime_type = "image/png"
-            if foreground_png_path.lower().endswith((".jpg", ".jpeg")):
-                mime_type = "image/jpeg"
-            
-            href_data_uri = f"data:{mime_type};base64,{encoded_string}"
-            
-            dwg.add(dwg.image(
-                href=href_data_uri,
-                insert=(0, 0),
-                size=(f"{fg_width}px", f"{fg_height}px")
-            ))
-            print(f"    Imagen de primer plano incrustada como Base64.")
+            if foreground_pieces is None and assets is not None:
+                dwg.add(dwg.image(
+                    href=assets.href(foreground_png_path, _foreground_mime_type(foreground_png_path)),
+                    insert=(0, 0),
+                    size=(f"{fg_width}px", f"{fg_height}px")
+                ))
+            elif foreground_pieces is None:
+                with open(foreground_png_path, "rb") as image_file, timed("base64_encode") as span:
+                    image_bytes = image_file.read()
+                    span["bytes_in"] = len(image_bytes)
+                    encoded_string = base64.b64encode(image_bytes).decode('utf-8')
+
+                mime_type = _foreground_mime_type(foreground_png_path)
+
+                href_data_uri = f"data:{mime_type};base64,{encoded_string}"
+
+                dwg.add(dwg.image(
+                    href=href_data_uri,
+                    insert=(0, 0),
+                    size=(f"{fg_width}px", f"{fg_height}px")
+                ))
+            for index, (x, y, width, height, encoded) in enumerate(foreground_pieces or ()):
+                image_extra = {}
+                if encoded.mask_data:
+                    # Máscara de luminancia: el gris de cada píxel es su alfa
+                    mask_id = _piece_mask_id(index, foreground_pieces)
+                    alpha_mask = dwg.mask(id=mask_id, maskUnits="userSpaceOnUse", x=x, y=y,
+                                          width=width, height=height, color_interpolation="sRGB",
+                                          style="mask-type:luminance")
+                    alpha_mask.add(dwg.image(href=_image_href(assets, "image/png", encoded.mask_data),
+                                             insert=(x, y), size=(f"{width:g}px", f"{height:g}px")))
+                    dwg.defs.add(alpha_mask)
+                    image_extra["mask"] = f"url(#{mask_id})"
+                dwg.add(dwg.image(
+                    href=_image_href(assets, encoded.mime_type, encoded.data),
+                    insert=(x, y),
+                    size=(f"{width:g}px", f"{height:g}px"),
+                    **image_extra
+                ))
+            if assets is not None:
+                print(f"    Imagen de primer plano referenciada como recurso externo (en {assets.asset_dir}).")
+            else:
+                print("    Imagen de primer plano incrustada como Base64.")
         except FileNotFoundError:
             print(f"    Error: Archivo de imagen de primer plano no encontrado: {foreground_png_path}")
             return False
@@ -447,14 +756,173 @@ def create_final_svg(
             print(f"    Error al procesar o añadir imagen de primer plano: {e_fg}")
             return False
 
-        dwg.save(pretty=True)
-        print(f"SVG final guardado exitosamente en {output_svg_path}")
-        return True
+        with timed("svg_save", pretty=not compact):
+            dwg.save(pretty=not compact)
+        return _finish_final_svg(output_svg_path, report, compose_start, assets)
 
     except Exception as e:
         print(f"Error fatal al crear el SVG final: {e}")
         return False
 
+class VectorLayer(object):
+    """
+    Capa vectorial de compose_layers: un SVG (ruta o BackgroundSVG) desplazado a
+    (x, y) y escalado por 'scale'. Sus IDs y clases se prefijan con id_prefix (por
+    defecto "layer<n>_") y sus definiciones se fusionan con las de las demás capas.
+    """
+    kind = "vector"
+
+    def __init__(self, source, x=0, y=0, scale=1, z=0, opacity=None, id_prefix=None):
+        self.source = source
+        self.x, self.y, self.scale, self.z = x, y, scale, z
+        self.opacity = opacity
+        self.id_prefix = id_prefix
+
+class RasterLayer(object):
+    """
+    Capa de imagen de compose_layers en (x, y). Sin width/height se usa el
+    tamaño en píxeles del archivo multiplicado por 'scale'; con solo uno de los
+    dos se conserva la proporción. Las capas con el mismo contenido (mismo hash)
+    comparten un único <symbol> con la imagen en Base64.
+    """
+    kind = "raster"
+
+    def __init__(self, image_path, x=0, y=0, width=None, height=None, scale=1, z=0, opacity=None):
+        self.image_path = image_path
+        self.x, self.y, self.z = x, y, z
+        self.width, self.height, self.scale = width, height, scale
+        self.opacity = opacity
+
+def _layer_attributes(layer, index, transform=True):
+    """id, transform (translate/scale) y opacity de una capa, como texto de atributos."""
+    attributes = f' id="layer_{index}"'
+    if transform:
+        parts = []
+        if layer.x or layer.y:
+            parts.append(f"translate({layer.x:g} {layer.y:g})")
+        if layer.scale != 1:
+            parts.append(f"scale({layer.scale:g})")
+        if parts:
+            attributes += f' transform="{" ".join(parts)}"'
+    if layer.opacity is not None:
+        attributes += f' opacity="{layer.opacity:g}"'
+    return attributes
+
+def _raster_layer_size(layer, pixel_size):
+    pixel_width, pixel_height = pixel_size
+    width, height = layer.width, layer.height
+    if width is None and height is None:
+        return pixel_width * layer.scale, pixel_height * layer.scale
+    if width is None:
+        return height * pixel_width / pixel_height, height
+    if height is None:
+        return width, width * pixel_height / pixel_width
+    return width, height
+
+def compose_layers(output_svg_path, layers, canvas_width, canvas_height, display_size=None, report=None,
+                   asset_mode="inline", asset_dir=None, asset_base_url=None):
+    """
+    Compone en un solo documento varias capas vectoriales (VectorLayer) y de
+    imagen (RasterLayer), de abajo arriba según su 'z' (a igual z, en el orden
+    de la lista). El documento se escribe en streaming en una sola pasada:
+    primero un único <defs> con las definiciones fusionadas de todas las capas
+    vectoriales (ver svg_defs_merger) y un <symbol> por cada imagen distinta,
+    codificada en Base64 por bloques desde el disco; después las capas, donde
+    cada imagen es un <use> de su símbolo. Una imagen repetida (un logo, un
+    mosaico) solo ocupa sus bytes una vez.
+    asset_mode, asset_dir y asset_base_url: como en create_final_svg; con
+    "external" cada símbolo referencia su imagen como recurso aparte.
+    Devuelve True si el SVG se guardó, False si falla alguna capa.
+    """
+    compose_start = time.perf_counter()
+    try:
+        print(f"Componiendo {len(layers)} capa(s) en: {output_svg_path}")
+        if asset_mode not in ASSET_MODES:
+            print(f"  Error: modo de recursos desconocido '{asset_mode}'. Use uno de {ASSET_MODES}.")
+            return False
+        assets = ExternalAssets(output_svg_path, asset_dir, asset_base_url) if asset_mode == "external" else None
+        merger = DefsMerger()
+        symbols = {} # hash del archivo -> (id del símbolo, ruta, (ancho, alto) en px)
+        placed = []  # (z, índice, capa, elementos del cuerpo o id del símbolo)
+        with timed("layers_prepare", layers=len(layers)):
+            for index, layer in enumerate(layers):
+                if layer.kind == "vector":
+                    source = layer.source
+                    background = source if isinstance(source, BackgroundSVG) else get_compiled_background(source)
+                    body = merger.add(background.root, layer.id_prefix or f"layer{index}_")
+                    placed.append((layer.z, index, layer, body))
+                    continue
+                if not os.path.exists(layer.image_path):
+                    print(f"  Error: imagen de la capa {index} no encontrada: {layer.image_path}")
+                    return False
+                image_hash = file_sha256(layer.image_path)
+                if image_hash not in symbols:
+                    pixel_size = read_image_size(layer.image_path)
+                    if pixel_size is None:
+                        return False
+                    symbols[image_hash] = (f"raster_{image_hash[:12]}", layer.image_path, pixel_size)
+                placed.append((layer.z, index, layer, symbols[image_hash]))
+        placed.sort(key=lambda item: (item[0], item[1]))
+
+        display_width, display_height = display_size or (canvas_width, canvas_height)
+        output_dir = os.path.dirname(os.path.abspath(output_svg_path))
+        temp_fd, temp_path = tempfile.mkstemp(suffix=".svg.tmp", dir=output_dir)
+        try:
+            with timed("svg_write_stream", layers=len(layers)) as span, os.fdopen(temp_fd, "w", encoding="utf-8") as out:
+                out.write(_svg_header(display_width, display_height, canvas_width, canvas_height))
+                out.write('<defs>')
+                if merger.style_rules:
+                    out.write(f'<style type="text/css">{escape(merger.style_text())}</style>')
+                for def_element in merger.defs_elements:
+                    out.write(ET.tostring(def_element, encoding='unicode'))
+                for symbol_id, image_path, (pixel_width, pixel_height) in symbols.values():
+                    out.write(f'<symbol id="{symbol_id}" preserveAspectRatio="none" viewBox="0 0 {pixel_width} {pixel_height}">'
+                              f'<image height="{pixel_height}" width="{pixel_width}" ')
+                    if assets is not None:
+                        out.write(f'xlink:href={quoteattr(assets.href(image_path, _foreground_mime_type(image_path)))} />')
+                    else:
+                        out.write(f'xlink:href="data:{_foreground_mime_type(image_path)};base64,')
+                        with timed("base64_encode", bytes_in=os.path.getsize(image_path)):
+                            _write_base64_file(out, image_path)
+                        out.write('" />')
+                    out.write('</symbol>')
+                out.write('</defs>')
+
+                for _, index, layer, content in placed:
+                    if layer.kind == "vector":
+                        out.write(f'<g{_layer_attributes(layer, index)}>')
+                        for body_element in content:
+                            out.write(ET.tostring(body_element, encoding='unicode'))
+                        out.write('</g>')
+                    else:
+                        symbol_id, _, pixel_size = content
+                        width, height = _raster_layer_size(layer, pixel_size)
+                        out.write(f'<use{_layer_attributes(layer, index, transform=False)} height="{height:g}" '
+                                  f'width="{width:g}" x="{layer.x:g}" xlink:href="#{symbol_id}" y="{layer.y:g}" />')
+                out.write('</svg>\n')
+                span["bytes_out"] = out.tell()
+            os.replace(temp_path, output_svg_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        raster_layers = sum(1 for layer in layers if layer.kind == "raster")
+        print(f"  {len(layers) - raster_layers} capa(s) vectoriales y {raster_layers} de imagen "
+              f"({len(symbols)} imagen(es) distinta(s) incrustada(s)).")
+        if report is not None:
+            report.update({"layers": len(layers), "raster_layers": raster_layers, "rasters_embedded": len(symbols),
+                           "raster_bytes": sum(os.path.getsize(path) for _, path, _ in symbols.values())})
+            report.update(merger.summary())
+        return _finish_final_svg(output_svg_path, report, compose_start, assets)
+
+    except ET.ParseError as e_parse:
+        print(f"  Error al parsear el SVG de una capa vectorial: {e_parse}")
+        return False
+    except Exception as e:
+        print(f"Error fatal al componer las capas: {e}")
+        return False
+
 # --- Bloque de pruebas (sin cambios en la lógica, pero debería funcionar ahora) ---
 if __name__ == '__main__':
     print("\n--- Probando Generación de SVG Final (con SVG de fondo e imagen PNG incrustada) ---")
@@ -0,0 +1,486 @@
+import re
+import math
+
+from image_quality import import_numpy
+from svg_minifier import NUMBER_RE, PATH_SEGMENT_RE, format_number, local_name, parse_arc_arguments
+
+# Tolerancia por defecto (unidades del lienzo) de la simplificación de trazados
+DEFAULT_SIMPLIFY_TOLERANCE = 0.25
+# Números por segmento de cada comando (en absoluto, tras expandir H/V/S/T)
+PATH_COMMAND_ARITY = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'A': 7}
+STROKE_WIDTH_RE = re.compile(r'stroke-width\s*:\s*([^;}"]+)')
+# Contenedores cuyo contenido no se pinta donde está (o tiene su propio sistema de coordenadas)
+NON_RENDERED_CONTAINERS = {'defs', 'clipPath', 'mask', 'pattern', 'marker', 'symbol', 'svg', 'linearGradient',
+                           'radialGradient', 'filter'}
+# Atributos que impiden fusionar un <path> con sus vecinos
+UNMERGEABLE_ATTRIBUTES = ('id', 'marker-start', 'marker-mid', 'marker-end')
+
+def _segment_distances(np, points, starts, ends):
+    """Distancia de cada punto al segmento start-end correspondiente (admite difusión de NumPy)."""
+    direction = ends - starts
+    length2 = (direction * direction).sum(axis=-1)
+    t = ((points - starts) * direction).sum(axis=-1) / np.where(length2 == 0, 1, length2)
+    t = np.clip(t, 0, 1)[..., None]
+    offset = points - (starts + t * direction)
+    return np.sqrt((offset * offset).sum(axis=-1))
+
+def _rdp_mask(np, points, tolerance):
+    """Puntos que conserva Ramer-Douglas-Peucker (los extremos siempre)."""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(np, points[first + 1:last], points[first], points[last])
+        index = int(distances.argmax())
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+class _Subpath(object):
+    def __init__(self, start):
+        self.start = start   # Punto inicial (array de 2)
+        self.groups = []     # [(comando absoluto 'L'/'C'/'Q'/'A', array de k x aridad)]
+        self.closed = False
+
+class PathGeometry(object):
+    """
+    Datos de un atributo 'd' como arrays de NumPy en coordenadas absolutas: una
+    lista de subtrazados, cada uno con grupos de segmentos consecutivos del mismo
+    tipo (L, C, Q, A; H/V se guardan como L y S/T como C/Q).
+    """
+
+    def __init__(self, np):
+        self.np = np
+        self.subpaths = []
+        self._bbox = None
+
+    @classmethod
+    def parse(cls, np, path_data):
+        """Devuelve la geometría de path_data o None si no es válido (se deja tal cual)."""
+        path_data = path_data.strip()
+        if not path_data or path_data[0] not in 'Mm':
+            return None
+        geometry = cls(np)
+        current = np.zeros(2)
+        subpath = None
+        last_control, last_command = None, None # Para reflejar el control en S/T
+        matched_length = 0
+        for match in PATH_SEGMENT_RE.finditer(path_data):
+            matched_length += len(match.group(0))
+            command, arguments = match.group(1), match.group(2)
+            upper, relative = command.upper(), command.islower()
+            if upper == 'Z':
+                if NUMBER_RE.search(arguments) or subpath is None:
+                    return None
+                subpath.closed = True
+                current = subpath.start.copy()
+                last_command = 'Z'
+                continue
+            if upper == 'A':
+                values = parse_arc_arguments(arguments)
+                if values is None:
+                    return None
+                numbers = np.array(values, dtype=float).reshape(-1)
+            else:
+                if NUMBER_RE.sub('', arguments).strip(' \t\r\n,'):
+                    return None
+                numbers = np.array(NUMBER_RE.findall(arguments), dtype=float)
+            arity = PATH_COMMAND_ARITY[upper]
+            if len(numbers) == 0 or len(numbers) % arity:
+                return None
+            rows = numbers.reshape(-1, arity)
+
+            if upper == 'M':
+                points = current + rows.cumsum(axis=0) if relative else rows
+                subpath = _Subpath(points[0].copy())
+                geometry.subpaths.append(subpath)
+                if len(points) > 1:
+                    subpath.groups.append(('L', points[1:]))
+                current = points[-1].copy()
+                last_command = 'M'
+                continue
+            if subpath is None:
+                return None
+            if subpath.closed: # Dibujar tras Z empieza un subtrazado nuevo en el mismo punto
+                subpath = _Subpath(current.copy())
+                geometry.subpaths.append(subpath)
+
+            if upper in ('L', 'H', 'V'):
+                if upper == 'L':
+                    points = current + rows.cumsum(axis=0) if relative else rows
+                else:
+                    axis = 0 if upper == 'H' else 1
+                    values = current[axis] + rows[:, 0].cumsum() if relative else rows[:, 0]
+                    points = np.repeat(current[None, :], len(values), axis=0)
+                    points[:, axis] = values
+                subpath.groups.append(('L', points))
+                current = points[-1].copy()
+            elif upper in ('C', 'Q', 'A'):
+                rows = rows.copy()
+                if relative:
+                    ends = current + rows[:, -2:].cumsum(axis=0)
+                    starts = np.vstack([current, ends[:-1]])
+                    if upper != 'A':
+                        for column in range(0, arity - 2, 2):
+                            rows[:, column:column + 2] += starts
+                    rows[:, -2:] = ends
+                subpath.groups.append((upper, rows))
+                current = rows[-1, -2:].copy()
+                if upper != 'A':
+                    last_control = rows[-1, -4:-2].copy()
+            else: # S y T: el primer control es el reflejo del anterior, segmento a segmento
+                target = 'C' if upper == 'S' else 'Q'
+                converted = []
+                for row in rows:
+                    row = row.copy()
+                    if relative:
+                        row += np.tile(current, len(row) // 2)
+                    previous_is_curve = last_command in ((('C', 'S') if upper == 'S' else ('Q', 'T')))
+                    reflected = 2 * current - last_control if previous_is_curve else current.copy()
+                    converted.append(np.concatenate([reflected, row]))
+                    last_control = converted[-1][-4:-2].copy()
+                    current = row[-2:].copy()
+                    last_command = upper
+                subpath.groups.append((target, np.array(converted)))
+            last_command = upper
+        if matched_length != len(path_data):
+            return None
+        return geometry
+
+    def simplify(self, tolerance):
+        """
+        Convierte en rectas las curvas cuyos puntos de control están a menos de
+        'tolerance' de su cuerda (la curva queda dentro de su envolvente convexa)
+        y aplica Ramer-Douglas-Peucker a cada tramo de rectas consecutivas.
+        """
+        np = self.np
+        for subpath in self.subpaths:
+            groups = []
+            run = [subpath.start[None, :]] # Tramo de rectas en curso: punto inicial y bloques de puntos
+
+            def flush_lines():
+                if len(run) > 1:
+                    points = np.vstack(run)
+                    groups.append(('L', points[_rdp_mask(np, points, tolerance)][1:]))
+                    run[:] = [points[-1:]]
+
+            current = subpath.start
+            for command, rows in subpath.groups:
+                if command == 'L':
+                    run.append(rows)
+                    current = rows[-1]
+                    continue
+                starts = np.vstack([current, rows[:-1, -2:]])
+                ends = rows[:, -2:]
+                if command == 'A':
+                    straight = (rows[:, 0] == 0) | (rows[:, 1] == 0) # Radio nulo: es una recta
+                else:
+                    controls = rows[:, :-2].reshape(len(rows), -1, 2)
+                    distances = _segment_distances(np, controls, starts[:, None, :], ends[:, None, :])
+                    straight = (distances <= tolerance).all(axis=1)
+                index = 0
+                while index < len(rows):
+                    run_end = index
+                    while run_end < len(rows) and straight[run_end] == straight[index]:
+                        run_end += 1
+                    if straight[index]:
+                        run.append(ends[index:run_end])
+                    else:
+                        flush_lines()
+                        groups.append((command, rows[index:run_end]))
+                        run[:] = [ends[run_end - 1:run_end]]
+                    index = run_end
+                current = rows[-1, -2:]
+            flush_lines()
+            subpath.groups = [(command, rows) for command, rows in groups if len(rows)]
+
+    def bbox(self):
+        """(xmin, ymin, xmax, ymax) que contiene el trazado (con los puntos de control; holgado en los arcos)."""
+        if self._bbox is not None:
+            return self._bbox
+        np = self.np
+        boxes = []
+        for subpath in self.subpaths:
+            boxes.append(np.concatenate([subpath.start, subpath.start]))
+            current = subpath.start
+            for command, rows in subpath.groups:
+                if command == 'A':
+                    ends = rows[:, -2:]
+                    starts = np.vstack([current, ends[:-1]])
+                    chord = np.sqrt(((ends - starts) ** 2).sum(axis=1)) / 2
+                    reach = 2 * np.maximum(np.maximum(np.abs(rows[:, 0]), np.abs(rows[:, 1])), chord)
+                    points = np.vstack([starts - reach[:, None], ends + reach[:, None],
+                                        starts + reach[:, None], ends - reach[:, None]])
+                else:
+                    points = rows.reshape(-1, 2)
+                boxes.append(np.concatenate([points.min(axis=0), points.max(axis=0)]))
+                current = rows[-1, -2:]
+        boxes = np.array(boxes)
+        self._bbox = (*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0))
+        return self._bbox
+
+    def format(self, precision):
+        """
+        Serializa con la codificación más corta: por cada segmento se elige entre
+        el comando absoluto y el relativo (y H/V, S o T cuando se puede), se omite
+        el comando repetido y los separadores innecesarios. Las coordenadas se
+        redondean antes, así los relativos no acumulan error.
+        """
+        np = self.np
+        writer = _PathWriter(precision)
+        current = np.zeros(2)
+        for subpath in self.subpaths:
+            start = np.round(subpath.start, precision)
+            writer.emit_best([('M', start), ('m', start - current)], implicit_next='L')
+            current = start
+            last_control, last_curve = None, None
+            for command, rows in subpath.groups:
+                rows = np.round(rows, precision)
+                for row in rows:
+                    end = row[-2:]
+                    if command == 'L':
+                        candidates = [('L', end), ('l', end - current)]
+                        if end[1] == current[1]:
+                            candidates += [('H', end[:1]), ('h', end[:1] - current[:1])]
+                        if end[0] == current[0]:
+                            candidates += [('V', end[1:]), ('v', end[1:] - current[1:])]
+                    elif command == 'A':
+                        candidates = [('A', row), ('a', np.concatenate([row[:5], end - current]))]
+                    else:
+                        relative = row - np.tile(current, len(row) // 2)
+                        candidates = [(command, row), (command.lower(), relative)]
+                        if last_curve == command and np.array_equal(row[:2], 2 * current - last_control):
+                            short = 'S' if command == 'C' else 'T'
+                            candidates += [(short, row[2:]), (short.lower(), relative[2:])]
+                    writer.emit_best(candidates)
+                    last_curve = command if command in ('C', 'Q') else None
+                    last_control = row[-4:-2] if last_curve else None
+                    current = end
+            if subpath.closed:
+                writer.emit_close()
+                current = start
+        return writer.text()
+
+class _PathWriter(object):
+    """Acumula el texto de un 'd' eligiendo en cada paso la opción más corta."""
+
+    def __init__(self, precision):
+        self.precision = precision
+        self.parts = []
+        self.last_letter = None
+        self.last_number = None # Último número escrito (para decidir si hace falta separador)
+        self._formatted = {}    # valor -> texto (cada coordenada se prueba en varias codificaciones)
+
+    def _encode(self, letter, values):
+        text = "" if letter == self.last_letter else letter
+        previous = None if text else self.last_number
+        for value in values.tolist():
+            number = self._formatted.get(value)
+            if number is None:
+                number = self._formatted[value] = format_number(value, self.precision)
+            if previous is not None and not number.startswith('-') and not ('.' in previous and number.startswith('.')):
+                text += ' '
+            text += number
+            previous = number
+        return text, previous
+
+    def emit_best(self, candidates, implicit_next=None):
+        best = None
+        for letter, values in candidates:
+            # M/m siempre lleva su letra (tras M los pares se leerían como L)
+            encoded = self._encode_forced(letter, values) if letter in 'Mm' else self._encode(letter, values)
+            if best is None or len(encoded[0]) < len(best[1][0]):
+                best = (letter, encoded)
+        letter, (text, last_number) = best
+        self.parts.append(text)
+        self.last_number = last_number
+        # Tras M/m los pares siguientes son L/l implícitos
+        self.last_letter = (implicit_next if letter == 'M' else implicit_next.lower()) if implicit_next else letter
+
+    def _encode_forced(self, letter, values):
+        saved, self.last_letter = self.last_letter, None
+        try:
+            return self._encode(letter, values)
+        finally:
+            self.last_letter = saved
+
+    def emit_close(self):
+        self.parts.append('z')
+        self.last_letter = 'z'
+        self.last_number = None
+
+    def text(self):
+        return "".join(self.parts)
+
+def _length(value):
+    """Número de un atributo de longitud ('12', '12px'); None si no se puede interpretar."""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.endswith('px'):
+        value = value[:-2]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def _stroke_width(element):
+    """Grosor de trazo explícito del elemento (atributo o style), None si no lo fija, inf si no se entiende."""
+    value = element.get('stroke-width')
+    match = STROKE_WIDTH_RE.search(element.get('style', ''))
+    if match:
+        value = match.group(1)
+    if value is None:
+        return None
+    width = _length(value)
+    return math.inf if width is None else width
+
+def _element_bbox(element, tag, geometry):
+    """Caja de un elemento básico en sus coordenadas, o None si no se sabe calcular."""
+    try:
+        if tag == 'path':
+            return geometry.bbox() if geometry is not None else None
+        if tag in ('rect', 'image'):
+            x, y = _length(element.get('x', '0')), _length(element.get('y', '0'))
+            width, height = _length(element.get('width')), _length(element.get('height'))
+            return (x, y, x + width, y + height)
+        if tag == 'circle':
+            cx, cy, r = (_length(element.get(name, '0')) for name in ('cx', 'cy', 'r'))
+            return (cx - r, cy - r, cx + r, cy + r)
+        if tag == 'ellipse':
+            cx, cy, rx, ry = (_length(element.get(name, '0')) for name in ('cx', 'cy', 'rx', 'ry'))
+            return (cx - rx, cy - ry, cx + rx, cy + ry)
+        if tag == 'line':
+            x1, y1, x2, y2 = (_length(element.get(name, '0')) for name in ('x1', 'y1', 'x2', 'y2'))
+            return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        if tag in ('polyline', 'polygon'):
+            values = [float(value) for value in NUMBER_RE.findall(element.get('points', ''))]
+            xs, ys = values[0::2], values[1::2]
+            return (min(xs), min(ys), max(xs), max(ys)) if xs and ys else None
+    except (TypeError, ValueError):
+        return None
+    return None
+
+def _boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def _css_max_stroke_width(root):
+    """Mayor stroke-width de las hojas de estilo del documento (lo que una clase podría aplicar)."""
+    css_text = "".join(element.text or '' for element in root.iter() if local_name(element.tag) == 'style')
+    widths = [_length(match.group(1)) for match in STROKE_WIDTH_RE.finditer(css_text)]
+    if not widths:
+        return 1.0 if 'stroke' in css_text else 0.0
+    return max(math.inf if width is None else width for width in widths)
+
+def simplify_element_tree(root, tolerance=DEFAULT_SIMPLIFY_TOLERANCE, view_box=None, precision=None):
+    """
+    Etapa de geometría sobre el árbol de un SVG (se modifica en el sitio):
+    simplifica y reescribe con la codificación más corta los 'd' de los <path>,
+    fusiona <path> hermanos consecutivos con los mismos atributos cuyas cajas no
+    se solapan (así el orden de pintado y la regla de relleno no cambian) y, si
+    se pasa view_box=(x, y, ancho, alto), quita los elementos que quedan
+    enteramente fuera (con margen para el trazo; no se tocan los que tienen
+    transform o filter ni el contenido de <defs>, <clipPath>, <symbol>...).
+    Un 'd' solo se sustituye si el nuevo es más corto. Devuelve (root, resumen)
+    o (root, None) si NumPy no está instalado.
+    """
+    if not tolerance > 0:
+        raise ValueError(f"la tolerancia de simplificación debe ser mayor que 0: {tolerance}")
+    np = import_numpy()
+    if np is None:
+        print("Aviso: NumPy no está instalado; se omite la simplificación de trazados.")
+        return root, None
+    if precision is None:
+        precision = max(0, math.ceil(-math.log10(tolerance)) + 1)
+    summary = {"paths": 0, "path_bytes_before": 0, "path_bytes_after": 0, "elements_culled": 0, "paths_merged": 0}
+    css_stroke = _css_max_stroke_width(root)
+    visible_box = None
+    if view_box is not None:
+        x, y, width, height = (float(value) for value in view_box)
+        visible_box = (x, y, x + width, y + height)
+
+    def walk(parent, cullable, stroke):
+        geometries = {}
+        kept = [] # Los hijos se reconstruyen de una vez (quitar uno a uno es cuadrático)
+        for child in parent:
+            if not isinstance(child.tag, str):
+                kept.append(child)
+                continue
+            tag = local_name(child.tag)
+            child_stroke = _stroke_width(child)
+            child_stroke = stroke if child_stroke is None else max(stroke, child_stroke)
+            child_cullable = (cullable and tag not in NON_RENDERED_CONTAINERS
+                              and child.get('transform') is None and child.get('filter') is None
+                              and 'filter' not in child.get('style', ''))
+
+            geometry = None
+            if tag == 'path' and child.get('d'):
+                original = child.get('d')
+                geometry = PathGeometry.parse(np, original)
+                summary["paths"] += 1
+                summary["path_bytes_before"] += len(original)
+                if geometry is not None and geometry.subpaths:
+                    geometry.simplify(tolerance)
+                    path_data = geometry.format(precision)
+                    if len(path_data) < len(original):
+                        child.set('d', path_data)
+                    geometries[child] = geometry
+                summary["path_bytes_after"] += len(child.get('d'))
+
+            if child_cullable and visible_box is not None:
+                box = _element_bbox(child, tag, geometry)
+                margin = max(child_stroke, css_stroke) * 2 # Holgura para uniones en inglete
+                if box is not None and not _boxes_overlap((box[0] - margin, box[1] - margin, box[2] + margin, box[3] + margin),
+                                                          visible_box):
+                    geometries.pop(child, None)
+                    summary["elements_culled"] += 1
+                    continue
+            walk(child, child_cullable, child_stroke)
+            if tag == 'g' and len(child) == 0 and child.get('id') is None and not (child.text or '').strip():
+                continue # Grupo vaciado al quitar lo que estaba fuera del lienzo
+            kept.append(child)
+        if geometries:
+            kept = _merge_sibling_paths(kept, geometries, precision, summary)
+        if len(kept) != len(parent):
+            parent[:] = kept
+
+    walk(root, True, 0.0)
+    return root, summary
+
+def _merge_sibling_paths(children, geometries, precision, summary):
+    """Devuelve la lista de hijos con cada serie de <path> fusionables reducida a uno solo."""
+    merged_children = []
+    index = 0
+    while index < len(children):
+        first = children[index]
+        merged_children.append(first)
+        run_end = index + 1
+        if first in geometries and not any(first.get(name) for name in UNMERGEABLE_ATTRIBUTES) \
+                and 'marker' not in first.get('style', ''):
+            attributes = {name: value for name, value in first.attrib.items() if name != 'd'}
+            geometry = geometries[first]
+            merged_box = geometry.bbox()
+            while run_end < len(children):
+                candidate = children[run_end]
+                if candidate not in geometries or {name: value for name, value in candidate.attrib.items() if name != 'd'} != attributes:
+                    break
+                candidate_box = geometries[candidate].bbox()
+                if _boxes_overlap(merged_box, candidate_box):
+                    break
+                geometry.subpaths.extend(geometries[candidate].subpaths)
+                merged_box = (min(merged_box[0], candidate_box[0]), min(merged_box[1], candidate_box[1]),
+                              max(merged_box[2], candidate_box[2]), max(merged_box[3], candidate_box[3]))
+                summary["paths_merged"] += 1
+                run_end += 1
+            if run_end > index + 1:
+                merged_bytes = sum(len(child.get('d')) for child in children[index:run_end])
+                first.set('d', geometry.format(precision))
+                summary["path_bytes_after"] += len(first.get('d')) - merged_bytes
+        index = run_end
+    return merged_children
@@ -0,0 +1,215 @@
+import re
+
+# Namespaces que se conservan al compactar; el resto (Illustrator, Inkscape,
+# Sodipodi...) son datos de editor que no afectan al dibujo.
+KEPT_NAMESPACES = (
+    '{http://www.w3.org/2000/svg}',
+    '{http://www.w3.org/1999/xlink}',
+    '{http://www.w3.org/XML/1998/namespace}',
+)
+
+# Atributos cuyo valor son números (o listas de números) que se pueden redondear.
+# Las transformaciones no: sus coeficientes (escalas, ángulos) no son coordenadas
+# y redondearlos con la misma precisión puede reducir el contenido a nada.
+NUMERIC_ATTRIBUTES = {
+    'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry', 'fx', 'fy',
+    'width', 'height', 'stroke-width', 'points', 'viewBox', 'd',
+}
+
+# Presentación con su valor inicial. Las no heredables se pueden quitar siempre;
+# las heredables solo si ningún antecesor podría haber fijado otro valor.
+NON_INHERITED_DEFAULTS = {'opacity': '1'}
+INHERITED_DEFAULTS = {
+    'fill-opacity': '1',
+    'stroke-opacity': '1',
+    'fill-rule': 'nonzero',
+    'stroke-miterlimit': '4',
+    'stroke-width': '1',
+    'visibility': 'visible',
+}
+
+# Elementos cuyo texto es contenido (no se le quitan espacios)
+TEXT_ELEMENTS = {'text', 'tspan', 'textPath', 'style', 'title', 'desc'}
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+PATH_SEGMENT_RE = re.compile(r'([MmZzLlHhVvCcSsQqTtAa])([^MmZzLlHhVvCcSsQqTtAa]*)')
+# Números por segmento de cada comando de trazado
+PATH_ARITY = {'m': 2, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2, 'a': 7, 'z': 0}
+# Parámetros de un arco: las banderas son un solo dígito y pueden ir pegadas ("a1 1 0 011 1")
+ARC_ARGUMENTS_RE = re.compile(r'[\s,]*'.join([f'({NUMBER_RE.pattern})'] * 3 + ['([01])'] * 2 +
+                                              [f'({NUMBER_RE.pattern})'] * 2) + r'[\s,]*')
+
+def format_number(value, precision):
+    """Número con como mucho 'precision' decimales y sin ceros ni signos sobrantes."""
+    text = f"{value:.{precision}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text in ('-0', ''):
+        text = '0'
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    return text
+
+def round_numbers(value, precision):
+    return NUMBER_RE.sub(lambda match: format_number(float(match.group()), precision), value)
+
+def parse_arc_arguments(arguments):
+    """Parámetros de los arcos de un comando A/a como listas de 7 floats, o None si no son válidos."""
+    arguments, values, position = arguments.strip(' \t\r\n,'), [], 0
+    while position < len(arguments):
+        match = ARC_ARGUMENTS_RE.match(arguments, position)
+        if not match:
+            return None
+        values.append([float(value) for value in match.groups()])
+        position = match.end()
+    return values
+
+def _path_arguments(letter, arguments):
+    """Lista de segmentos (listas de floats) de un comando, o None si los argumentos no son válidos."""
+    arity = PATH_ARITY[letter.lower()]
+    if letter.lower() == 'a':
+        return parse_arc_arguments(arguments)
+    numbers = [float(number) for number in NUMBER_RE.findall(arguments)]
+    if arity == 0:
+        return [] if not numbers else None
+    if not numbers or len(numbers) % arity:
+        return None
+    return [numbers[index:index + arity] for index in range(0, len(numbers), arity)]
+
+def round_path_numbers(path_data, precision):
+    """
+    Redondea las coordenadas de un 'd'. Los comandos relativos se redondean
+    respecto al punto ya redondeado (el error de cada segmento se arrastra al
+    siguiente), así una serie de desplazamientos pequeños no se pierde ni se
+    acumula. Devuelve None si el trazado no se puede interpretar.
+    """
+    exact, rounded = [0.0, 0.0], [0.0, 0.0]          # Punto actual real y tal como se escribe
+    start_exact, start_rounded = [0.0, 0.0], [0.0, 0.0]
+    parts = []
+    for match in PATH_SEGMENT_RE.finditer(path_data):
+        letter = match.group(1)
+        segments = _path_arguments(letter, match.group(2))
+        if segments is None:
+            return None
+        parts.append(letter)
+        command, relative = letter.lower(), letter.islower()
+        if command == 'z':
+            exact, rounded = list(start_exact), list(start_rounded)
+            continue
+        for segment in segments:
+            # Índices de los ejes de cada número (None = no es una coordenada)
+            if command == 'h':
+                axes = [0]
+            elif command == 'v':
+                axes = [1]
+            elif command == 'a':
+                axes = [None, None, None, None, None, 0, 1]
+            else:
+                axes = [0, 1] * (len(segment) // 2)
+            new_exact, new_rounded = list(exact), list(rounded)
+            numbers = []
+            for value, axis in zip(segment, axes):
+                if axis is None:
+                    value = round(value, precision)
+                elif relative:
+                    target = exact[axis] + value
+                    value = round(target - rounded[axis], precision)
+                    new_exact[axis], new_rounded[axis] = target, rounded[axis] + value
+                else:
+                    new_exact[axis] = value
+                    value = new_rounded[axis] = round(value, precision)
+                numbers.append(format_number(value, precision))
+            if command == 'a':
+                numbers[3:5] = [str(int(segment[3])), str(int(segment[4]))]
+            exact, rounded = new_exact, new_rounded
+            if command == 'm' and segment is segments[0]:
+                start_exact, start_rounded = list(exact), list(rounded)
+            parts.append(" ".join(numbers))
+    return " ".join(parts)
+
+def compact_path_data(path_data, precision):
+    """Redondea las coordenadas de un atributo 'd' y quita separadores innecesarios."""
+    rounded_path = round_path_numbers(path_data, precision)
+    # Un trazado que no se puede interpretar se redondea número a número
+    path_data = (rounded_path if rounded_path is not None else round_numbers(path_data, precision)).replace(',', ' ')
+    path_data = re.sub(r'\s*([A-Za-z])\s*', r'\1', path_data) # Sin espacios junto a los comandos
+    path_data = re.sub(r'\s+', ' ', path_data)
+    path_data = re.sub(r' (?=-)', '', path_data)               # El signo ya separa: "10 -5" -> "10-5"
+    path_data = re.sub(r'(\.\d+) (?=\.)', r'\1', path_data)     # ".5 .5" -> ".5.5"
+    return path_data.strip()
+
+def minify_css(css_text):
+    """Compacta una hoja de estilo: comentarios, espacios y ';' finales."""
+    css_text = re.sub(r'/\*.*?\*/', '', css_text, flags=re.S)
+    css_text = re.sub(r'\s+', ' ', css_text)
+    css_text = re.sub(r'\s*([{};,>])\s*', r'\1', css_text)
+    css_text = re.sub(r':\s+', ':', css_text) # Solo tras ':' (un espacio antes puede ser un selector descendiente)
+    return css_text.replace(';}', '}').strip()
+
+def local_name(name):
+    """Nombre de una etiqueta o atributo sin su namespace ('{ns}path' -> 'path'); los comentarios se devuelven tal cual."""
+    if not isinstance(name, str):
+        return name
+    return name.split('}', 1)[-1] if name.startswith('{') else name
+
+def _is_kept_name(name):
+    return not name.startswith('{') or name.startswith(KEPT_NAMESPACES)
+
+def minify_element_tree(root, precision=None):
+    """
+    Compacta en sitio un árbol de ElementTree de SVG: quita <metadata>,
+    elementos y atributos de namespaces de editor, atributos con su valor por
+    defecto, espacios entre etiquetas y, si se indica 'precision', redondea las
+    coordenadas a ese número de decimales.
+    """
+    def walk(element, styled_ancestors):
+        # styled_ancestors: propiedades heredables que algún antecesor podría fijar
+        previous = None
+        for child in list(element):
+            if not isinstance(child.tag, str) or not _is_kept_name(child.tag) or local_name(child.tag) == 'metadata':
+                element.remove(child)
+                if child.tail and child.tail.strip(): # Conservar el texto que seguía al elemento quitado
+                    if previous is not None:
+                        previous.tail = (previous.tail or '') + child.tail
+                    else:
+                        element.text = (element.text or '') + child.tail
+                continue
+            previous = child
+
+            for attr_name in list(child.attrib):
+                if not _is_kept_name(attr_name):
+                    del child.attrib[attr_name]
+            for attr_name, default in NON_INHERITED_DEFAULTS.items():
+                if child.get(attr_name) == default:
+                    del child.attrib[attr_name]
+            for attr_name, default in INHERITED_DEFAULTS.items():
+                if child.get(attr_name) == default and attr_name not in styled_ancestors:
+                    del child.attrib[attr_name]
+
+            if precision is not None:
+                for attr_name, value in list(child.attrib.items()):
+                    if attr_name == 'd':
+                        child.set(attr_name, compact_path_data(value, precision))
+                    elif attr_name in NUMERIC_ATTRIBUTES:
+                        child.set(attr_name, round_numbers(value, precision))
+
+            tag_name = local_name(child.tag)
+            if tag_name == 'style' and child.text:
+                child.text = minify_css(child.text)
+            elif tag_name not in TEXT_ELEMENTS and child.text and not child.text.strip():
+                child.text = None
+            if child.tail and not child.tail.strip() and local_name(element.tag) not in TEXT_ELEMENTS:
+                child.tail = None
+
+            if 'class' in child.attrib or 'style' in child.attrib:
+                child_styled = styled_ancestors | set(INHERITED_DEFAULTS)
+            else:
+                child_styled = styled_ancestors | (set(child.attrib) & set(INHERITED_DEFAULTS))
+            walk(child, child_styled)
+
+    if root.text and not root.text.strip():
+        root.text = None
+    walk(root, set())
+    return root
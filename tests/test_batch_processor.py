@@ -0,0 +1,57 @@
+import json
+import os
+import threading
+import time
+
+import batch_processor
+from batch_processor import BATCH_QUEUE_FACTOR, BATCH_SUMMARY_FILENAME, optimize_batch
+
+def _fake_optimizer(monkeypatch, completed):
+    """Sustituye la optimización por una que rellena el informe y falla con 'broken'."""
+    lock = threading.Lock()
+
+    def optimize(input_image_path, output_dir, report, **kwargs):
+        time.sleep(0.01)
+        with lock:
+            completed.append(input_image_path)
+        if "broken" in input_image_path:
+            return None
+        report.update({"original_size": 1000, "final_size": 400, "quality": "65-80", "pngquant_calls": 2,
+                       "cache_hit": False})
+        return os.path.join(output_dir, os.path.basename(input_image_path))
+    monkeypatch.setattr(batch_processor, "optimize_image_iteratively", optimize)
+
+def test_batch_never_queues_more_than_the_back_pressure_limit(tmp_path, monkeypatch):
+    completed = []
+    _fake_optimizer(monkeypatch, completed)
+    queued = []
+
+    def inputs(source, recursive=False):
+        for index in range(20):
+            # Cuando se pide la siguiente imagen, las anteriores en cola no pueden pasar del límite
+            queued.append(len(queued) - len(completed))
+            yield os.path.join(source, f"image_{index:02}.png"), ""
+    monkeypatch.setattr(batch_processor, "iter_batch_inputs", inputs)
+
+    summary = optimize_batch(str(tmp_path), str(tmp_path / "out"), workers=2)
+
+    assert summary["images"] == 20
+    assert max(queued) <= 2 * BATCH_QUEUE_FACTOR
+
+def test_batch_summary_totals(tmp_path, monkeypatch):
+    _fake_optimizer(monkeypatch, [])
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    for name in ("a.png", "broken.png", "notes.txt", os.path.join("sub", "b.png")):
+        (source / name).write_bytes(b"")
+
+    summary = optimize_batch(str(source), str(tmp_path / "out"), workers=2, recursive=True)
+
+    with open(tmp_path / "out" / BATCH_SUMMARY_FILENAME, encoding="utf-8") as summary_file:
+        assert json.load(summary_file) == summary
+    assert (summary["images"], summary["failed"]) == (3, 1)
+    assert summary["total_original_size"] == 2000
+    assert summary["total_final_size"] == 800
+    assert summary["total_pngquant_calls"] == 4
+    outputs = {os.path.relpath(result["output"], tmp_path / "out") for result in summary["results"] if result["ok"]}
+    assert outputs == {"a.png", os.path.join("sub", "b.png")}
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from cli import JobError, composite_path, normalize_job, plan_composites
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+def test_same_name_in_subfolders_mirrors_the_subfolder(tmp_path):
+    _touch(str(tmp_path / "in" / "a" / "logo.png"))
+    _touch(str(tmp_path / "in" / "b" / "logo.png"))
+    job = normalize_job({"background": "bg.svg", "foreground": str(tmp_path / "in" / "**" / "*.png"),
+                         "output_dir": str(tmp_path / "out")})
+    svg_paths = sorted(composite_path(*task) for task in plan_composites([job]))
+    assert svg_paths == [str(tmp_path / "out" / "a" / "logo.svg"), str(tmp_path / "out" / "b" / "logo.svg")]
+
+def test_colliding_output_paths_raise_job_error(tmp_path):
+    _touch(str(tmp_path / "a" / "logo.png"))
+    _touch(str(tmp_path / "b" / "logo.png"))
+    job = normalize_job({"background": "bg.svg", "output_dir": str(tmp_path / "out"),
+                         "foreground": [str(tmp_path / "a" / "*.png"), str(tmp_path / "b" / "*.png")]})
+    with pytest.raises(JobError):
+        plan_composites([job])
+
+def test_files_in_output_dir_are_not_inputs(tmp_path):
+    _touch(str(tmp_path / "in" / "logo.png"))
+    _touch(str(tmp_path / "in" / "out" / "optimized_main_image" / "logo_optimized.png"))
+    job = normalize_job({"background": "bg.svg", "foreground": str(tmp_path / "in" / "**" / "*.png"),
+                         "output_dir": str(tmp_path / "in" / "out")})
+    assert [task[1] for task in plan_composites([job])] == [str(tmp_path / "in" / "logo.png")]
+
+def test_zero_simplify_tolerance_is_rejected():
+    from cli import build_parser
+
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["run", "--background", "bg.svg", "--foreground", "a.png",
+                                   "--output-dir", "out", "--simplify", "0"])
+    with pytest.raises(JobError):
+        normalize_job({"background": "bg.svg", "foreground": "a.png", "output_dir": "out", "simplify_tolerance": 0})
+
+@pytest.mark.parametrize("flag", ["--mode", "--backend", "--encoding", "--layout", "--assets", "--background-mode"])
+def test_unknown_option_values_are_rejected(flag):
+    from cli import build_parser
+
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["run", "--background", "bg.svg", "--foreground", "a.png",
+                                   "--output-dir", "out", flag, "bogus"])
+
+def test_job_file_with_unknown_option_value_exits_2(tmp_path):
+    from cli import main
+
+    job_path = tmp_path / "jobs.json"
+    job_path.write_text('[{"background": "bg.svg", "foreground": "a.png", "output_dir": "out", "search_mode": "bogus"}]',
+                        encoding="utf-8")
+    assert main(["run", "--job", str(job_path)]) == 2
@@ -0,0 +1,77 @@
+import io
+import math
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from foreground_encoder import (MIN_PSNR_DB, TILE_SIZE, choose_foreground_encoding, encode_foreground_candidates,
+                                split_foreground_regions)
+
+def _photo(path, transparent_border=False):
+    """Imagen de tonos suaves (como una foto): los formatos con pérdida la comprimen mucho mejor que PNG."""
+    noise = random.Random(0).randbytes(16 * 16 * 3)
+    image = Image.frombytes("RGB", (16, 16), noise).resize((256, 256), Image.BICUBIC).filter(ImageFilter.GaussianBlur(4))
+    if transparent_border:
+        alpha = Image.new("L", image.size, 0)
+        alpha.paste(255, (64, 64, 192, 192))
+        image.putalpha(alpha)
+    image.save(path)
+    return str(path)
+
+def test_photo_gets_a_smaller_lossy_encoding(tmp_path):
+    photo = _photo(tmp_path / "photo.png")
+    chosen = choose_foreground_encoding(photo)
+    png = encode_foreground_candidates(photo, ("png",))[0]
+    assert chosen.name != "png"
+    assert chosen.total_bytes < png.total_bytes and chosen.psnr >= MIN_PSNR_DB
+
+def test_line_art_keeps_the_png(tmp_path):
+    # Dos colores con bordes duros: el PNG de paleta es más pequeño que cualquier formato con pérdida
+    graphic = str(tmp_path / "graphic.png")
+    image = Image.new("P", (256, 256), 0)
+    image.putpalette([255, 255, 255, 200, 0, 0])
+    draw = ImageDraw.Draw(image)
+    for offset in range(0, 256, 16):
+        draw.line((offset, 0, 255 - offset, 255), fill=1, width=2)
+    image.save(graphic)
+    assert choose_foreground_encoding(graphic).name == "png"
+
+def test_quality_floor_above_every_lossy_candidate_keeps_the_png(tmp_path):
+    chosen = choose_foreground_encoding(_photo(tmp_path / "photo.png"), min_psnr=math.inf)
+    assert (chosen.name, chosen.mime_type) == ("png", "image/png")
+
+@pytest.mark.parametrize("transparent_border", [False, True])
+def test_jpeg_gets_an_alpha_mask_only_when_needed(tmp_path, transparent_border):
+    photo = _photo(tmp_path / "photo.png", transparent_border)
+    candidate = encode_foreground_candidates(photo, ("jpeg+mask",))[0]
+    assert candidate.mime_type == "image/jpeg"
+    assert (candidate.mask_data is not None) == transparent_border
+    assert candidate.psnr >= MIN_PSNR_DB
+
+def _sprites(path, boxes, size=(256, 256)):
+    """Imagen transparente con rectángulos opacos en 'boxes'."""
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    for box in boxes:
+        image.paste((200, 30, 30, 255), box)
+    image.save(path)
+    return str(path)
+
+def test_opaque_foreground_is_not_split(tmp_path):
+    photo = _photo(tmp_path / "photo.png")
+    assert split_foreground_regions(photo) == ((256, 256), None)
+    assert split_foreground_regions(photo, TILE_SIZE) == ((256, 256), None)
+
+def test_crop_layout_keeps_only_the_content_bounding_box(tmp_path):
+    foreground = _sprites(tmp_path / "fg.png", [(10, 20, 30, 40), (100, 150, 120, 160)])
+    size, regions = split_foreground_regions(foreground)
+    assert size == (256, 256)
+    assert [box for box, _ in regions] == [(10, 20, 120, 160)]
+    with Image.open(io.BytesIO(regions[0][1])) as region:
+        assert region.size == (110, 140)
+
+def test_tiles_layout_drops_empty_tiles_and_joins_neighbours(tmp_path):
+    # Con mosaicos de 64 px: dos tramos en la primera fila (separados por un mosaico vacío) y uno en la última
+    foreground = _sprites(tmp_path / "fg.png", [(10, 10, 100, 20), (200, 30, 210, 40), (60, 250, 70, 256)])
+    _, regions = split_foreground_regions(foreground, 64)
+    assert [box for box, _ in regions] == [(10, 10, 100, 20), (200, 30, 210, 40), (60, 250, 70, 256)]
@@ -0,0 +1,51 @@
+import os
+
+from PIL import Image
+
+from image_cache import OptimizedImageCache, cache_key
+from image_processor import optimize_image_iteratively
+
+def _noise_png(path, size=(200, 200)):
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(path)
+    return str(path)
+
+def test_second_optimization_is_a_cache_hit(tmp_path):
+    image_path = _noise_png(tmp_path / "noise.png")
+    cache = OptimizedImageCache(str(tmp_path / "cache"))
+    options = dict(output_dir=str(tmp_path / "out"), cache=cache, backend="pillow", target_size_bytes=30 * 1024)
+
+    first, second = {}, {}
+    first_path = optimize_image_iteratively(image_path, report=first, **options)
+    with open(first_path, "rb") as first_file:
+        first_bytes = first_file.read()
+    os.remove(first_path)
+    second_path = optimize_image_iteratively(image_path, report=second, **options)
+
+    assert first["cache_hit"] is False and first["pngquant_calls"] > 0
+    assert second["cache_hit"] is True and second["pngquant_calls"] == 0
+    assert (second["quality"], second["final_size"]) == (first["quality"], first["final_size"])
+    with open(second_path, "rb") as second_file:
+        assert second_file.read() == first_bytes
+
+def test_cache_key_changes_with_content_and_settings(tmp_path):
+    image_path = _noise_png(tmp_path / "noise.png", (8, 8))
+    key = cache_key(image_path, {"search_mode": "bisect"})
+    assert cache_key(image_path, {"search_mode": "linear"}) != key
+    _noise_png(tmp_path / "noise.png", (8, 8))
+    assert cache_key(image_path, {"search_mode": "bisect"}) != key
+
+def test_eviction_removes_least_recently_used_entries(tmp_path):
+    cache = OptimizedImageCache(str(tmp_path / "cache"), max_bytes=2500)
+    source = tmp_path / "source.png"
+    source.write_bytes(b"x" * 1000)
+    keys = {name: name * 32 for name in ("aa", "bb", "cc")}
+    for age, name in ((100, "aa"), (200, "bb")):
+        cache.put(keys[name], str(source))
+        os.utime(cache.get(keys[name])[0], (age, age))
+    cache.get(keys["aa"]) # "aa" pasa a ser la usada más recientemente
+
+    cache.put(keys["cc"], str(source)) # 3000 bytes > 2500: sobra una entrada
+
+    assert cache.get(keys["bb"]) is None
+    assert cache.get(keys["aa"]) and cache.get(keys["cc"])
+    assert not os.path.exists(os.path.join(cache.cache_dir, "bb", keys["bb"] + ".json"))
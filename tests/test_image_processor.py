@@ -0,0 +1,229 @@
+import io
+import os
+import queue
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import image_processor
+from image_processor import (TARGET_SIZE_BYTES, PillowBackend, _bisect_quality_search, _fits_target,
+                             _linear_quality_search, _parallel_quality_search, optimize_image_iteratively,
+                             write_file_atomically)
+
+def _noise_png(path, size=(200, 200)):
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(path)
+    return str(path)
+
+def _recording_probe(bytes_per_quality):
+    """Probe sintético: el tamaño crece linealmente con la calidad mínima."""
+    def probe(quality_min, quality_max, running=None):
+        probe.levels.append((quality_min, quality_max))
+        return quality_min * bytes_per_quality
+    probe.levels = []
+    return probe
+
+def test_bisect_needs_fewer_probes_than_linear():
+    # Solo cumple por debajo de calidad 46: la lineal agota sus cinco pasadas
+    linear = _recording_probe(16500)
+    _linear_quality_search(linear, TARGET_SIZE_BYTES)
+    bisect = _recording_probe(16500)
+    _bisect_quality_search(bisect, TARGET_SIZE_BYTES)
+
+    assert len(linear.levels) == image_processor.MAX_ITERATIONS
+    assert len(bisect.levels) < len(linear.levels)
+    best_linear = max(level for level in linear.levels if _fits_target(level[0] * 16500))
+    best_bisect = max(level for level in bisect.levels if _fits_target(level[0] * 16500))
+    # La bisección se queda a menos de un paso lineal de la mejor calidad
+    assert best_linear[0] - best_bisect[0] < image_processor.QUALITY_STEP_DOWN
+
+def test_bisect_stops_after_one_probe_when_initial_quality_fits():
+    probe = _recording_probe(1000)
+    _bisect_quality_search(probe, TARGET_SIZE_BYTES)
+    assert probe.levels == [(image_processor.INITIAL_QUALITY_MIN, image_processor.INITIAL_QUALITY_MAX)]
+
+def test_bisect_gives_up_when_minimum_quality_does_not_fit():
+    probe = _recording_probe(10 ** 6)
+    _bisect_quality_search(probe, TARGET_SIZE_BYTES)
+    assert [level[0] for level in probe.levels] == [image_processor.INITIAL_QUALITY_MIN,
+                                                    image_processor.MIN_QUALITY_ALLOWED]
+
+class _FakeProcess(object):
+    """Imita un Popen de pngquant que solo termina cuando se le mata."""
+    def __init__(self):
+        self.killed = threading.Event()
+
+    def poll(self):
+        return 0 if self.killed.is_set() else None
+
+    def kill(self):
+        self.killed.set()
+
+def test_parallel_search_kills_lower_quality_ranges_once_a_range_fits():
+    levels = image_processor._linear_quality_levels()
+    winner = levels[2]
+    started = {}
+
+    def probe(quality_min, quality_max, running):
+        level = (quality_min, quality_max)
+        if level < winner:
+            # Rango de menor calidad: se queda "corriendo" hasta que lo maten
+            process = _FakeProcess()
+            started[level] = process
+            if running.setdefault(level, process) is not process:
+                process.kill()
+            process.killed.wait(5)
+            running.pop(level, None)
+            return None
+        return 600 * 1024 if level == winner else 10 ** 7
+
+    start = time.perf_counter()
+    _parallel_quality_search(probe, len(levels), TARGET_SIZE_BYTES)
+
+    assert time.perf_counter() - start < 4
+    assert all(process.killed.is_set() for process in started.values())
+
+def test_write_file_atomically_replaces_without_leaving_temporaries(tmp_path):
+    target = tmp_path / "image.png"
+    target.write_bytes(b"old")
+    write_file_atomically(str(target), b"new")
+    assert target.read_bytes() == b"new"
+    assert os.listdir(tmp_path) == ["image.png"]
+
+def test_failed_atomic_write_keeps_the_previous_file(tmp_path, monkeypatch):
+    target = tmp_path / "image.png"
+    target.write_bytes(b"old")
+
+    def failing_replace(source, destination):
+        raise OSError("disco lleno")
+    monkeypatch.setattr(image_processor.os, "replace", failing_replace)
+
+    with pytest.raises(OSError):
+        write_file_atomically(str(target), b"new")
+    assert target.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["image.png"]
+
+def test_in_memory_search_only_writes_the_chosen_candidate(tmp_path, monkeypatch):
+    image_path = _noise_png(tmp_path / "noise.png")
+    output_dir = tmp_path / "out"
+    piped = []
+
+    def fake_pngquant(pngquant_exe, source_bytes, quality_min, quality_max, running=None):
+        # Lo que llega por stdin es la imagen original; se devuelve un PNG de 16 colores
+        piped.append(quality_min)
+        with Image.open(io.BytesIO(source_bytes)) as source_image:
+            buffer = io.BytesIO()
+            source_image.quantize(colors=16).save(buffer, format="PNG")
+        assert os.listdir(output_dir) == [] # Ninguna pasada intermedia en disco
+        return buffer.getvalue()
+
+    def disk_pngquant(*args, **kwargs):
+        raise AssertionError("in_memory=True no debe escribir pasadas en disco")
+    monkeypatch.setattr(image_processor, "_find_pngquant_exe", lambda rel_path: "pngquant")
+    monkeypatch.setattr(image_processor, "_run_pngquant_in_memory", fake_pngquant)
+    monkeypatch.setattr(image_processor, "_run_pngquant", disk_pngquant)
+
+    report = {}
+    output_path = optimize_image_iteratively(image_path, str(output_dir), in_memory=True, report=report,
+                                             target_size_bytes=30 * 1024)
+
+    assert piped and report["pngquant_calls"] == len(piped)
+    assert os.listdir(output_dir) == ["noise_optimized.png"]
+    with Image.open(output_path) as output_image:
+        assert output_image.mode == "P"
+
+def test_pillow_colors_decrease_with_quality():
+    colors = [PillowBackend.colors_for_quality(quality) for quality in range(100, -1, -5)]
+    assert colors == sorted(colors, reverse=True)
+    assert (colors[0], colors[-1]) == (256, 2)
+
+def test_pillow_backend_skips_results_larger_than_the_original(tmp_path):
+    flat_path = tmp_path / "flat.png"
+    Image.new("RGB", (64, 64), (10, 20, 30)).save(flat_path, optimize=True)
+    assert PillowBackend(flat_path.read_bytes()).quantize(65, 80) is None
+
+    noise_path = tmp_path / "noise.png"
+    _noise_png(noise_path, (64, 64))
+    noise_bytes = noise_path.read_bytes()
+    output_bytes = PillowBackend(noise_bytes).quantize(40, 55)
+    assert len(output_bytes) < len(noise_bytes)
+
+def test_pillow_backend_does_not_need_pngquant(tmp_path, monkeypatch):
+    def no_pngquant(rel_path):
+        raise AssertionError("el backend pillow no debe buscar pngquant")
+    monkeypatch.setattr(image_processor, "_find_pngquant_exe", no_pngquant)
+    image_path = _noise_png(tmp_path / "noise.png")
+
+    report = {}
+    output_path = optimize_image_iteratively(image_path, str(tmp_path / "out"), backend="pillow",
+                                             search_mode="bisect", report=report, target_size_bytes=30 * 1024)
+
+    assert report["backend"] == "pillow" and report["pngquant_calls"] > 0
+    assert report["final_size"] == os.path.getsize(output_path) < report["original_size"]
+
+def test_progress_callback_reports_every_iteration(tmp_path):
+    image_path = _noise_png(tmp_path / "noise.png")
+    messages = queue.Queue()
+    report = {}
+    optimize_image_iteratively(image_path, str(tmp_path / "out"), backend="pillow", report=report,
+                               target_size_bytes=30 * 1024, progress_callback=messages.put)
+
+    received = []
+    while not messages.empty():
+        received.append(messages.get())
+    assert received[0] == {"stage": "start", "original_size": report["original_size"]}
+    assert received[-1] == {"stage": "done", "final_size": report["final_size"]}
+    iterations = [message for message in received if message["stage"] == "iteration"]
+    assert [message["iteration"] for message in iterations] == list(range(1, report["pngquant_calls"] + 1))
+
+def test_cancel_kills_the_running_pngquant_and_removes_temporaries(tmp_path, monkeypatch):
+    image_path = _noise_png(tmp_path / "noise.png")
+    output_dir = tmp_path / "out"
+    cancel_event = threading.Event()
+    processes = []
+
+    def slow_pngquant(pngquant_exe, input_image_path, output_path, quality_min, quality_max, running=None):
+        # Simula un pngquant largo; el usuario pulsa "Cancelar" mientras corre
+        process = _FakeProcess()
+        processes.append(process)
+        running[(quality_min, quality_max)] = process
+        cancel_event.set()
+        process.killed.wait(5)
+        running.pop((quality_min, quality_max), None)
+        return None
+    monkeypatch.setattr(image_processor, "_find_pngquant_exe", lambda rel_path: "pngquant")
+    monkeypatch.setattr(image_processor, "_run_pngquant", slow_pngquant)
+
+    report = {}
+    start = time.perf_counter()
+    result = optimize_image_iteratively(image_path, str(output_dir), report=report, target_size_bytes=30 * 1024,
+                                        cancel_event=cancel_event)
+
+    assert result is None and report["cancelled"] is True
+    assert time.perf_counter() - start < 4
+    assert len(processes) == 1 and processes[0].killed.is_set() # No se lanzan más pasadas
+    assert os.listdir(output_dir) == []
+
+def test_cancel_before_start_runs_no_pass(tmp_path):
+    cancel_event = threading.Event()
+    cancel_event.set()
+    report = {}
+    assert optimize_image_iteratively(_noise_png(tmp_path / "noise.png"), str(tmp_path / "out"), backend="pillow",
+                                      report=report, target_size_bytes=30 * 1024, cancel_event=cancel_event) is None
+    assert (report["cancelled"], report["pngquant_calls"]) == (True, 0)
+
+def test_png_size_is_read_from_the_header_without_decoding(tmp_path, monkeypatch):
+    image_path = str(tmp_path / "wide.png")
+    Image.new("RGBA", (300, 20)).save(image_path)
+
+    def no_decoding(*args, **kwargs):
+        raise AssertionError("un PNG no debe abrirse con Pillow")
+    monkeypatch.setattr(Image, "open", no_decoding)
+    assert image_processor.read_image_size(image_path) == (300, 20)
+
+def test_image_size_of_other_formats_and_unreadable_files(tmp_path):
+    jpeg_path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (40, 30)).save(jpeg_path)
+    assert image_processor.read_image_size(jpeg_path) == (40, 30)
+    assert image_processor.read_image_size(str(tmp_path / "missing.png")) is None
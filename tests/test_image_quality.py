@@ -0,0 +1,57 @@
+import random
+
+import pytest
+from PIL import Image, ImageFilter
+
+from image_processor import PillowBackend, _linear_quality_levels, optimize_image_iteratively
+from image_quality import QualityScorer, luma_array, ssim
+
+pytest.importorskip("numpy") # El SSIM necesita NumPy
+
+def _photo(path):
+    noise = random.Random(0).randbytes(64 * 64 * 3)
+    Image.frombytes("RGB", (64, 64), noise).resize((256, 256), Image.BICUBIC).save(path)
+    return str(path)
+
+def test_ssim_is_one_for_identical_images_and_drops_with_blur(tmp_path):
+    photo = _photo(tmp_path / "photo.png")
+    with Image.open(photo) as image:
+        image.filter(ImageFilter.GaussianBlur(2)).save(tmp_path / "blurred.png")
+    reference = luma_array(photo)
+    assert ssim(reference, reference) == pytest.approx(1.0)
+    assert ssim(reference, luma_array(str(tmp_path / "blurred.png"))) < 0.9
+
+def test_large_images_are_scored_downsampled(tmp_path):
+    path = str(tmp_path / "wide.png")
+    Image.new("RGB", (2048, 256), (90, 90, 90)).save(path)
+    assert luma_array(path, max_side=512).shape == (64, 512)
+
+def test_linear_search_stops_at_the_ssim_floor(tmp_path):
+    photo = _photo(tmp_path / "photo.png")
+    with open(photo, "rb") as photo_file:
+        backend = PillowBackend(photo_file.read())
+    scorer = QualityScorer(photo)
+    levels = _linear_quality_levels()
+    scores = [scorer.score(backend.quantize(*level)) for level in levels]
+    assert scores == sorted(scores, reverse=True)
+    # Mínimo entre el tercer y el cuarto rango: el cuarto es el primero que no cumple
+    min_ssim = (scores[2] + scores[3]) / 2
+
+    report = {}
+    optimize_image_iteratively(photo, str(tmp_path / "out"), backend="pillow", report=report,
+                               target_size_bytes=1024, min_ssim=min_ssim)
+
+    assert report["pngquant_calls"] == 4
+    # Ninguno cumple el tamaño: se entrega el más pequeño que conserva la calidad
+    assert report["quality"] == f"{levels[2][0]}-{levels[2][1]}"
+    assert report["ssim"] >= min_ssim
+
+def test_original_is_kept_when_no_candidate_reaches_the_ssim_floor(tmp_path):
+    photo = _photo(tmp_path / "photo.png")
+    report = {}
+    output_path = optimize_image_iteratively(photo, str(tmp_path / "out"), backend="pillow", report=report,
+                                             target_size_bytes=1024, min_ssim=0.999)
+    assert report["pngquant_calls"] == 1
+    assert (report["quality"], report["ssim"]) == (None, 1.0)
+    with open(output_path, "rb") as output_file, open(photo, "rb") as photo_file:
+        assert output_file.read() == photo_file.read()
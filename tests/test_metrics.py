@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import metrics
+from image_processor import optimize_image_iteratively
+from svg_generator import clear_compiled_backgrounds, create_final_svg
+
+@pytest.fixture(autouse=True)
+def no_metrics():
+    metrics.disable_metrics()
+    yield
+    metrics.disable_metrics()
+
+def _inputs(tmp_path):
+    image_path = str(tmp_path / "noise.png")
+    Image.frombytes("RGB", (128, 128), os.urandom(128 * 128 * 3)).save(image_path)
+    background = tmp_path / "bg.svg"
+    background.write_text('<svg xmlns="http://www.w3.org/2000/svg" width="128" height="128"><rect width="10" height="10"/></svg>',
+                          encoding="utf-8")
+    return image_path, str(background)
+
+def _run_pipeline(tmp_path):
+    image_path, background = _inputs(tmp_path)
+    clear_compiled_backgrounds()
+    report = {}
+    optimized = optimize_image_iteratively(image_path, str(tmp_path / "out"), backend="pillow", report=report,
+                                           target_size_bytes=8 * 1024)
+    assert create_final_svg(str(tmp_path / "out.svg"), background, optimized, 128, 128)
+    return report
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    assert not metrics.metrics_enabled()
+    with metrics.timed("quantize", quality="65-80") as span:
+        span["bytes_out"] = 10
+    assert span == {} # El span vacío descarta lo que se le asigna
+    assert metrics.timed("quantize") is metrics.timed("compose") # Sin objetos nuevos por llamada
+
+    _run_pipeline(tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ["bg.svg", "noise.png", "out", "out.svg"]
+
+def test_enabled_metrics_write_stages_as_json_lines_and_prometheus(tmp_path):
+    jsonl_path = str(tmp_path / "metrics.jsonl")
+    prom_path = str(tmp_path / "metrics.prom")
+    metrics.configure_metrics(jsonl_path, prom_path)
+    assert metrics.metrics_enabled()
+
+    report = _run_pipeline(tmp_path)
+    metrics.disable_metrics() # Cierra el JSON lines y escribe los totales
+
+    with open(jsonl_path, encoding="utf-8") as jsonl_file:
+        events = [json.loads(line) for line in jsonl_file]
+    stages = [event["stage"] for event in events if event["event"] == "stage"]
+    assert stages.count("quantize") == report["pngquant_calls"] > 0
+    assert {"optimize", "background_parse", "compose"} <= set(stages)
+    optimize = next(event for event in events if event.get("stage") == "optimize")
+    assert (optimize["bytes_in"], optimize["bytes_out"]) == (report["original_size"], report["final_size"])
+    assert optimize["iterations"] == report["pngquant_calls"]
+
+    with open(prom_path, encoding="utf-8") as prom_file:
+        prom_text = prom_file.read()
+    assert f'svgcreator_stage_seconds_count{{stage="quantize"}} {report["pngquant_calls"]}' in prom_text
+    assert f'svgcreator_iterations_total{{stage="optimize"}} {report["pngquant_calls"]}' in prom_text
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+from PIL import Image
+
+from responsive_variants import create_responsive_variants
+
+@pytest.fixture
+def inputs(tmp_path):
+    foreground = str(tmp_path / "big.png")
+    Image.new("RGB", (160, 90), (200, 30, 30)).save(foreground)
+    background = tmp_path / "bg.svg"
+    background.write_text('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 160 90"><rect width="160" height="90"/></svg>',
+                          encoding="utf-8")
+    return str(background), foreground, str(tmp_path / "out")
+
+def test_budget_variant_at_an_existing_width_does_not_overwrite_it(inputs):
+    background, foreground, output_dir = inputs
+    manifest = create_responsive_variants(background, foreground, output_dir, widths=[160, 80],
+                                          size_budgets=[5_000_000], backend="pillow")
+    svgs = [variant["svg"] for variant in manifest["variants"]]
+    assert len(set(svgs)) == len(svgs)
+    assert all(os.path.exists(os.path.join(output_dir, svg)) for svg in svgs)
+    assert manifest["srcset"] == "big_160w.svg 160w, big_80w.svg 80w"
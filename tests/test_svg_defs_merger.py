@@ -0,0 +1,46 @@
+import xml.etree.ElementTree as ET
+
+from svg_defs_merger import merge_background_defs
+
+def test_duplicate_css_rule_keeps_cascade_order():
+    root = ET.fromstring('<svg xmlns="http://www.w3.org/2000/svg">'
+                         '<style>.a{fill:red} .b{fill:blue} .a{fill:red}</style>'
+                         '<rect class="a b" width="1" height="1"/></svg>')
+    merged, summary = merge_background_defs(root)
+    style = merged.find('defs/style').text
+    assert style.split('\n') == ['.bg0_b{fill:blue}', '.bg0_a{fill:red}']
+    assert (summary['style_rules_before'], summary['style_rules_after']) == (3, 2)
+
+def test_identical_gradients_are_merged_and_references_rewritten():
+    root = ET.fromstring('<svg xmlns="http://www.w3.org/2000/svg"><defs>'
+                         '<linearGradient id="g1"><stop offset="0" stop-color="red"/></linearGradient>'
+                         '<linearGradient id="g2"><stop offset="0" stop-color="red"/></linearGradient></defs>'
+                         '<rect fill="url(#g1)"/><rect fill="url(#g2)"/></svg>')
+    merged, summary = merge_background_defs(root)
+    assert (summary['defs_before'], summary['defs_after']) == (2, 1)
+    assert [rect.get('fill') for rect in merged.iter('{http://www.w3.org/2000/svg}rect')] == ['url(#bg0_g1)', 'url(#bg0_g1)']
+
+def test_class_attributes_and_selectors_get_the_prefix():
+    root = ET.fromstring('<svg xmlns="http://www.w3.org/2000/svg"><style>g .cls-1, #r.cls-2{fill:red}</style>'
+                         '<g><rect id="r" class="cls-1 cls-2"/></g></svg>')
+    merged, _ = merge_background_defs(root, "p_")
+    assert merged.find('defs/style').text == 'g .p_cls-1, #p_r.p_cls-2{fill:red}'
+    assert merged.find('.//{http://www.w3.org/2000/svg}rect').get('class') == 'p_cls-1 p_cls-2'
+
+def test_selectors_inside_grouping_at_rules_are_rewritten():
+    root = ET.fromstring('<svg xmlns="http://www.w3.org/2000/svg">'
+                         '<style>@media print{.a{fill:blue}} '
+                         '@supports (fill:red){@media screen{.a{fill:url(#g)}}}</style>'
+                         '<defs><linearGradient id="g"/></defs><rect class="a"/></svg>')
+    merged, _ = merge_background_defs(root)
+    assert merged.find('defs/style').text.split('\n') == [
+        '@media print{.bg0_a{fill:blue}}',
+        '@supports (fill:red){@media screen{.bg0_a{fill:url(#bg0_g)}}}']
+    assert merged.find('{http://www.w3.org/2000/svg}rect').get('class') == 'bg0_a'
+
+def test_id_selectors_inside_media_rules_follow_renamed_ids():
+    root = ET.fromstring('<svg xmlns="http://www.w3.org/2000/svg">'
+                         '<style>@media print{#r{stroke:red}}</style><rect id="r"/></svg>')
+    merged, _ = merge_background_defs(root)
+    assert merged.find('defs/style').text == '@media print{#bg0_r{stroke:red}}'
+    assert merged.find('{http://www.w3.org/2000/svg}rect').get('id') == 'bg0_r'
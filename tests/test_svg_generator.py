@@ -0,0 +1,220 @@
+import base64
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import svg_generator
+from svg_generator import VectorLayer, _write_background_stream, _write_base64_file, compose_layers
+
+SVG_NS = '{http://www.w3.org/2000/svg}'
+
+def _write_layer(path, colour):
+    path.write_text('<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10">'
+                    f'<defs><style>.cls-1{{fill:{colour}}}</style></defs>'
+                    '<rect class="cls-1" width="10" height="10"/></svg>', encoding="utf-8")
+    return str(path)
+
+def test_layers_with_clashing_class_names_keep_their_own_styles(tmp_path):
+    red = _write_layer(tmp_path / "red.svg", "#f00")
+    green = _write_layer(tmp_path / "green.svg", "#0f0")
+    output = str(tmp_path / "out.svg")
+    assert compose_layers(output, [VectorLayer(red), VectorLayer(green, x=10)], 20, 10)
+
+    root = ET.parse(output).getroot()
+    rules = {}
+    for style in root.iter(SVG_NS + 'style'):
+        for rule in style.text.split('\n'):
+            selector, block = rule.split('{', 1)
+            rules[selector.strip()] = block
+    classes = [rect.get('class') for rect in root.iter(SVG_NS + 'rect')]
+    assert len(set(classes)) == 2
+    assert ['#f00' in rules['.' + classes[0]], '#0f0' in rules['.' + classes[1]]] == [True, True]
+
+def test_zero_simplify_tolerance_fails_cleanly(tmp_path):
+    from svg_generator import create_final_svg
+
+    background = _write_layer(tmp_path / "bg.svg", "#f00")
+    output = str(tmp_path / "out.svg")
+    assert create_final_svg(output, background, str(tmp_path / "fg.png"), 10, 10, simplify_tolerance=0) is False
+
+def test_external_assets_are_named_by_content_hash_and_reused(tmp_path):
+    from PIL import Image
+    from image_cache import file_sha256
+    from svg_generator import ExternalAssets
+
+    image_path = str(tmp_path / "fg.png")
+    Image.new("RGBA", (4, 4), (255, 0, 0, 255)).save(image_path)
+    assets = ExternalAssets(str(tmp_path / "out.svg"))
+    href = assets.href(image_path, "image/png")
+    assert href == f"assets/{file_sha256(image_path)[:16]}.png"
+    assert assets.href(image_path, "image/png") == href
+    assert assets.summary()["assets_written"] == 1 and assets.summary()["assets_reused"] == 1
+
+@pytest.mark.parametrize("stream_output", [False, True])
+def test_compact_output_drops_redundant_root_attributes(tmp_path, stream_output):
+    from PIL import Image
+    from svg_generator import create_final_svg
+
+    background = _write_layer(tmp_path / "bg.svg", "#f00")
+    foreground = str(tmp_path / "fg.png")
+    Image.new("RGBA", (10, 10), (0, 0, 255, 128)).save(foreground)
+    for compact in (False, True):
+        output = str(tmp_path / f"out_{compact}.svg")
+        assert create_final_svg(output, background, foreground, 10, 10, compact=compact, stream_output=stream_output)
+        with open(output, encoding="utf-8") as svg_file:
+            root_tag = svg_file.read().split("<svg", 1)[1].split(">", 1)[0]
+        dropped = ['xmlns:ev=', 'baseProfile=', 'version=']
+        assert [name in root_tag for name in dropped] == [not compact] * 3
+        assert 'viewBox="0 0 10 10"' in root_tag and 'xmlns="http://www.w3.org/2000/svg"' in root_tag
+
+@pytest.mark.parametrize("chunk_bytes", [1, 7, 4096])
+def test_streaming_base64_matches_the_whole_file_encoding(tmp_path, monkeypatch, chunk_bytes):
+    monkeypatch.setattr(svg_generator, "BASE64_CHUNK_BYTES", chunk_bytes)
+    image_path = tmp_path / "fg.png"
+    image_path.write_bytes(os.urandom(1000))
+    out = io.StringIO()
+    _write_base64_file(out, str(image_path))
+    assert out.getvalue() == base64.b64encode(image_path.read_bytes()).decode("ascii")
+
+def test_streamed_svg_embeds_the_foreground_unchanged(tmp_path, monkeypatch):
+    from PIL import Image
+    from svg_generator import create_final_svg
+
+    monkeypatch.setattr(svg_generator, "BASE64_CHUNK_BYTES", 100)
+    background = _write_layer(tmp_path / "bg.svg", "#f00")
+    foreground = tmp_path / "fg.png"
+    Image.frombytes("RGB", (32, 32), os.urandom(32 * 32 * 3)).save(foreground)
+    output = str(tmp_path / "out.svg")
+    assert create_final_svg(output, background, str(foreground), 32, 32, stream_output=True)
+
+    images = list(ET.parse(output).getroot().iter(SVG_NS + 'image'))
+    href = images[-1].get('{http://www.w3.org/1999/xlink}href')
+    assert href.startswith("data:image/png;base64,")
+    assert base64.b64decode(href.split(",", 1)[1]) == foreground.read_bytes()
+
+@pytest.mark.parametrize("options", [{}, {"compact": True}, {"compact": True, "merge_defs": True},
+                                     {"stream_output": True}])
+def test_background_is_parsed_once_per_composite(tmp_path, monkeypatch, options):
+    from PIL import Image
+    from svg_generator import clear_compiled_backgrounds, create_final_svg
+
+    parses = []
+    fromstring, parse = ET.fromstring, ET.parse
+    monkeypatch.setattr(ET, "fromstring", lambda *args, **kwargs: parses.append(args) or fromstring(*args, **kwargs))
+    monkeypatch.setattr(ET, "parse", lambda *args, **kwargs: parses.append(args) or parse(*args, **kwargs))
+    clear_compiled_backgrounds()
+    background = _write_layer(tmp_path / "bg.svg", "#f00")
+    foreground = str(tmp_path / "fg.png")
+    Image.new("RGBA", (10, 10), (0, 0, 255, 128)).save(foreground)
+
+    assert create_final_svg(str(tmp_path / "out.svg"), background, foreground, 10, 10, **options)
+    assert len(parses) == 1
+
+def test_stream_handler_copies_the_body_and_collects_defs(tmp_path):
+    background = tmp_path / "bg.svg"
+    background.write_text('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                          'width="10" height="10"><title>fondo</title><metadata><x/></metadata>'
+                          '<defs><style>.a{fill:red}</style><linearGradient id="g"><stop offset="0"/></linearGradient></defs>'
+                          '<g><rect class="a" width="10" height="10"/><text>a &lt; b</text></g><use xlink:href="#g"/></svg>',
+                          encoding="utf-8")
+    out = io.StringIO()
+    _write_background_stream(out, str(background))
+
+    namespaces = ' xmlns:xlink="http://www.w3.org/1999/xlink"'
+    assert out.getvalue() == (f'<g id="background_elements_from_file"{namespaces}>'
+                              '<g><rect class="a" width="10" height="10" /><text>a &lt; b</text></g>'
+                              '<use xlink:href="#g" /></g>'
+                              f'<defs{namespaces}><style>.a{{fill:red}}</style>'
+                              '<linearGradient id="g"><stop offset="0" /></linearGradient></defs>')
+
+def test_stream_and_tree_backgrounds_produce_the_same_elements(tmp_path):
+    from PIL import Image
+    from svg_generator import create_final_svg
+
+    background = _write_layer(tmp_path / "bg.svg", "#f00")
+    foreground = str(tmp_path / "fg.png")
+    Image.new("RGBA", (10, 10), (0, 0, 255, 128)).save(foreground)
+    tags = {}
+    for mode in ("tree", "stream"):
+        output = str(tmp_path / f"out_{mode}.svg")
+        assert create_final_svg(output, background, foreground, 10, 10, background_mode=mode)
+        tags[mode] = sorted(element.tag for element in ET.parse(output).getroot().iter())
+    assert tags["stream"] == tags["tree"]
+
+def test_compiled_background_is_reused_until_the_file_changes(tmp_path):
+    from svg_generator import clear_compiled_backgrounds, get_compiled_background
+
+    clear_compiled_backgrounds()
+    path = _write_layer(tmp_path / "bg.svg", "#f00")
+    first = get_compiled_background(path)
+    assert get_compiled_background(path) is first
+
+    # Solo cambia la fecha: se relee y, como el hash coincide, no se recompila
+    os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+    assert get_compiled_background(path) is first
+
+    # Mismo tamaño y distinto contenido: la fecha basta para detectarlo
+    _write_layer(tmp_path / "bg.svg", "#0f0")
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    second = get_compiled_background(path)
+    assert second is not first and "#0f0" in second.defs_xml()
+
+def test_compiled_backgrounds_are_bounded(tmp_path, monkeypatch):
+    from svg_generator import _compiled_backgrounds, clear_compiled_backgrounds, get_compiled_background
+
+    monkeypatch.setattr(svg_generator, "BACKGROUND_CACHE_MAX_ENTRIES", 2)
+    clear_compiled_backgrounds()
+    paths = [_write_layer(tmp_path / f"bg{index}.svg", "#f00") for index in range(3)]
+    first = get_compiled_background(paths[0])
+    get_compiled_background(paths[1])
+    get_compiled_background(paths[0]) # El primero pasa a ser el más reciente
+    get_compiled_background(paths[2])
+
+    assert list(_compiled_backgrounds) == [os.path.abspath(paths[0]), os.path.abspath(paths[2])]
+    assert get_compiled_background(paths[0]) is first
+
+@pytest.mark.parametrize("stream_output", [False, True])
+def test_cropped_foreground_is_placed_in_canvas_units(tmp_path, stream_output):
+    from PIL import Image
+    from svg_generator import create_final_svg
+
+    background = _write_layer(tmp_path / "bg.svg", "#f00")
+    foreground = str(tmp_path / "fg.png")
+    image = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+    image.paste((0, 0, 255, 255), (10, 20, 30, 60))
+    image.save(foreground)
+    output = str(tmp_path / "out.svg")
+    report = {}
+    # El primer plano se muestra al doble de su tamaño en píxeles
+    assert create_final_svg(output, background, foreground, 200, 200, foreground_layout="crop",
+                            stream_output=stream_output, report=report)
+
+    image_element = list(ET.parse(output).getroot().iter(SVG_NS + 'image'))[-1]
+    geometry = [image_element.get(name) for name in ('x', 'y', 'width', 'height')]
+    assert geometry == ['20', '40', '40px', '80px']
+    assert (report["foreground_layout"], report["foreground_pieces"]) == ("crop", 1)
+
+def test_background_compiled_in_another_thread_is_composed_without_parsing(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from svg_generator import clear_compiled_backgrounds, create_final_svg, get_compiled_background
+
+    clear_compiled_backgrounds()
+    background_path = _write_layer(tmp_path / "bg.svg", "#f00")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Como la GUI: el fondo se compila en paralelo mientras se optimiza el primer plano
+        background_future = executor.submit(get_compiled_background, background_path)
+        foreground = str(tmp_path / "fg.png")
+        Image.new("RGBA", (10, 10), (0, 0, 255, 128)).save(foreground)
+        background = background_future.result()
+
+    parses = []
+    fromstring = ET.fromstring
+    monkeypatch.setattr(ET, "fromstring", lambda *args, **kwargs: parses.append(args) or fromstring(*args, **kwargs))
+    output = str(tmp_path / "out.svg")
+    assert create_final_svg(output, background, foreground, 10, 10)
+    assert parses == []
+    monkeypatch.undo()
+    assert [rect.get('class') for rect in ET.parse(output).getroot().iter(SVG_NS + 'rect')] == ['cls-1']
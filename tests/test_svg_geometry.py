@@ -0,0 +1,94 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from svg_geometry import PathGeometry, simplify_element_tree
+
+np = pytest.importorskip("numpy")
+
+SVG = '<svg xmlns="http://www.w3.org/2000/svg">{}</svg>'
+
+def _segments(subpath):
+    return [(command, row) for command, rows in subpath.groups for row in rows.tolist()]
+
+def _absolute(geometry):
+    """Subtrazados como (inicio, cerrado, [(comando, fila)]) para comparar geometrías."""
+    return [(subpath.start.tolist(), subpath.closed, _segments(subpath)) for subpath in geometry.subpaths]
+
+def _assert_same_geometry(first, second):
+    first, second = _absolute(first), _absolute(second)
+    assert len(first) == len(second)
+    for (start, closed, groups), (other_start, other_closed, other_groups) in zip(first, second):
+        assert np.allclose(start, other_start) and closed == other_closed
+        assert [command for command, _ in groups] == [command for command, _ in other_groups]
+        for (_, rows), (_, other_rows) in zip(groups, other_groups):
+            assert np.allclose(rows, other_rows)
+
+@pytest.mark.parametrize("path_data", [
+    "M10 10 l10 0 L30 30 h5 v-5 H0 V0 z",                            # Absolutos y relativos, H/V
+    "M0 0 C10 0 20 10 30 10 S50 20 60 20 s10 10 20 0",                 # Reflexión del control en S
+    "M0 0 Q10 20 20 0 T40 0 t20 0",                                    # Reflexión del control en T
+    "M1-2.5 a5 5 0 011 1 A3 3 30 1 0 10 10",                           # Arcos con banderas pegadas
+    "M0 0 L10 0 L10 10 Z L5 20",                                       # Z seguido de un comando de dibujo
+    "M10 10 h5 v5 z m2 2 h1 l1 1",                                     # m relativo tras Z
+    "m5 5 10 0 0 10",                                                  # m con lineto implícito
+])
+def test_parse_format_round_trip(path_data):
+    geometry = PathGeometry.parse(np, path_data)
+    assert geometry is not None
+    _assert_same_geometry(PathGeometry.parse(np, geometry.format(6)), geometry)
+
+def test_s_and_t_are_expanded_with_reflected_controls():
+    geometry = PathGeometry.parse(np, "M0 0 C10 0 20 10 30 10 S50 20 60 20 Q70 0 80 10 T100 10")
+    segments = _segments(geometry.subpaths[0])
+    assert segments[1] == ('C', [40, 10, 50, 20, 60, 20])
+    assert segments[3] == ('Q', [90, 20, 100, 10])
+
+def test_drawing_after_close_starts_a_subpath_at_the_start_point():
+    geometry = PathGeometry.parse(np, "M0 0 L10 0 L10 10 Z L5 20")
+    assert [subpath.start.tolist() for subpath in geometry.subpaths] == [[0, 0], [0, 0]]
+    assert geometry.format(2) == "M0 0H10V10zM0 0 5 20"
+
+def test_format_picks_the_shortest_encoding():
+    geometry = PathGeometry.parse(np, "M100 100 L101 100 L101 101 C101 101 102 102 103 103 C104 104 105 105 106 106")
+    assert geometry.format(2) == "M100 100h1v1c0 0 1 1 2 2s2 2 3 3"
+
+@pytest.mark.parametrize("path_data", ["", "L0 0", "M0 0 L1", "M0 0 x 1", "M 0 0 z 1", "M0 0 a1 1 0 2 1 1 1"])
+def test_invalid_path_data_is_rejected(path_data):
+    assert PathGeometry.parse(np, path_data) is None
+
+def test_zero_tolerance_is_rejected():
+    root = ET.fromstring(SVG.format('<path d="M0 0L1 1"/>'))
+    with pytest.raises(ValueError):
+        simplify_element_tree(root, tolerance=0)
+
+def test_path_stays_within_tolerance():
+    points = " ".join(f"L{x} {(x % 2) * 0.01}" for x in range(1, 50))
+    root = ET.fromstring(SVG.format(f'<path d="M0 0 {points}"/>'))
+    _, summary = simplify_element_tree(root, tolerance=0.1)
+    assert summary["path_bytes_after"] < summary["path_bytes_before"]
+    assert root[0].get("d") == "M0 0 49 .01" # Solo quedan los extremos
+
+def test_elements_outside_the_view_box_are_culled():
+    root = ET.fromstring(SVG.format(
+        '<rect x="200" y="200" width="10" height="10"/>'                     # Fuera: se quita
+        '<path d="M150 150 L160 160" stroke-width="2"/>'                     # Fuera: se quita
+        '<path d="M101 50 L120 50" stroke-width="4"/>'                       # Fuera, pero lo alcanza el trazo
+        '<g transform="translate(-200 0)"><rect x="200" width="5" height="5"/></g>'  # Transformado: no se toca
+        '<defs><rect id="r" x="500" width="5" height="5"/></defs>'           # Definición: no se toca
+        '<g><circle cx="300" cy="300" r="5"/></g>'                           # Grupo que queda vacío
+        '<circle cx="50" cy="50" r="5"/>'))
+    _, summary = simplify_element_tree(root, tolerance=0.1, view_box=(0, 0, 100, 100))
+    assert [child.tag.split('}')[-1] for child in root] == ['path', 'g', 'defs', 'circle']
+    assert summary["elements_culled"] == 3
+
+def test_sibling_paths_with_same_style_and_disjoint_boxes_are_merged():
+    root = ET.fromstring(SVG.format(
+        '<path fill="red" d="M0 0H10V10H0z"/><path fill="red" d="M20 0H30V10H20z"/>'
+        '<path fill="red" d="M25 5H35V15H25z"/>'                             # Se solapa: no se fusiona
+        '<path fill="blue" d="M50 0H60V10H50z"/>'                            # Otro estilo: no se fusiona
+        '<path id="keep" fill="blue" d="M70 0H80V10H70z"/>'))                # Con id: no se fusiona
+    _, summary = simplify_element_tree(root, tolerance=0.1)
+    assert [path.get('d') for path in root] == ["M0 0H10V10H0zM20 0H30V10H20z", "M25 5H35V15H25z",
+                                                "M50 0H60V10H50z", "M70 0H80V10H70z"]
+    assert summary["paths_merged"] == 1
@@ -0,0 +1,31 @@
+import xml.etree.ElementTree as ET
+
+from svg_minifier import compact_path_data, minify_element_tree
+
+def test_transforms_are_not_rounded_with_coordinate_precision():
+    root = ET.fromstring('<svg xmlns="http://www.w3.org/2000/svg">'
+                         '<g transform="matrix(0.004 0 0 0.004 10 10)"><rect x="1.26" width="2" height="2"/></g>'
+                         '<path transform="rotate(12.3456) scale(0.015)" d="M0 0h1"/>'
+                         '<linearGradient gradientTransform="scale(0.015)"/></svg>')
+    minify_element_tree(root, precision=1)
+    group, path, gradient = root
+    assert group.get('transform') == 'matrix(0.004 0 0 0.004 10 10)'
+    assert group[0].get('x') == '1.3'
+    assert path.get('transform') == 'rotate(12.3456) scale(0.015)'
+    assert gradient.get('gradientTransform') == 'scale(0.015)'
+
+def test_relative_path_rounding_does_not_accumulate_error():
+    # Cuatro desplazamientos de 0.004: en total 0.016, que con dos decimales es .02
+    path_data = compact_path_data("M0 0l0.004 0l0.004 0l0.004 0l0.004 0", 2)
+    total = sum(float(segment.split()[0]) for segment in path_data.split('l')[1:])
+    assert round(total, 2) == 0.02
+
+def test_relative_path_rounding_keeps_end_point_and_close():
+    path_data = compact_path_data("M10.123,20.456 l1.111,2.222 l1.111,2.222 l1.111,2.222 z m1 1 h2.26", 1)
+    segments = path_data.split('z')[0].split('l')
+    x = float(segments[0][1:].split()[0]) + sum(float(segment.split()[0]) for segment in segments[1:])
+    assert abs(x - (10.123 + 3 * 1.111)) <= 0.05
+    assert path_data.endswith('zm1 1h2.3')
+
+def test_packed_arc_flags_are_kept():
+    assert compact_path_data("M0 0a5 5 30 011 2.22", 1) == "M0 0a5 5 30 0 1 1 2.2"
@@ -0,0 +1,61 @@
+import os
+
+from cli import normalize_job
+from watch_folder import WatchDaemon
+
+def _daemon(tmp_path, **options):
+    job = normalize_job({"background": str(tmp_path / "bg.svg"), "foreground": str(tmp_path / "in" / "*.png"),
+                         "output_dir": str(tmp_path / "out"), **options})
+    return WatchDaemon([job], debounce=0)
+
+def _fake_build(calls):
+    def process_foreground(job, foreground_path, relative_dir="", optimized_path=None):
+        calls.append(optimized_path)
+        svg_path = os.path.join(job["output_dir"], relative_dir, "a.svg")
+        os.makedirs(os.path.dirname(svg_path), exist_ok=True)
+        open(svg_path, "w").close()
+        return {"foreground": foreground_path, "ok": True, "optimized": foreground_path + ".opt.png"}
+    return process_foreground
+
+def _setup(tmp_path, monkeypatch):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "a.png").write_bytes(b"png")
+    (tmp_path / "bg.svg").write_text('<svg xmlns="http://www.w3.org/2000/svg"/>', encoding="utf-8")
+    calls = []
+    monkeypatch.setattr("cli.process_foreground", _fake_build(calls))
+    return calls
+
+def test_background_change_only_recomposes(tmp_path, monkeypatch):
+    calls = _setup(tmp_path, monkeypatch)
+    _daemon(tmp_path).run(once=True)
+    (tmp_path / "bg.svg").write_text('<svg xmlns="http://www.w3.org/2000/svg"><g/></svg>', encoding="utf-8")
+    _daemon(tmp_path).run(once=True)
+    assert calls == [None, str(tmp_path / "in" / "a.png") + ".opt.png"]
+
+def test_optimizer_option_change_reoptimizes(tmp_path, monkeypatch):
+    calls = _setup(tmp_path, monkeypatch)
+    _daemon(tmp_path).run(once=True)
+    _daemon(tmp_path, min_ssim=0.95).run(once=True)
+    assert calls == [None, None]
+
+def test_unchanged_inputs_are_not_rebuilt(tmp_path, monkeypatch):
+    calls = _setup(tmp_path, monkeypatch)
+    _daemon(tmp_path).run(once=True)
+    _daemon(tmp_path).run(once=True)
+    assert calls == [None]
+
+def test_failed_build_is_retried_without_input_changes(tmp_path, monkeypatch):
+    calls = _setup(tmp_path, monkeypatch)
+    succeed = _fake_build(calls)
+    def flaky(*args, **kwargs):
+        if len(calls) == 0:
+            calls.append("failed")
+            return {"foreground": args[1], "ok": False, "error": "archivo bloqueado"}
+        return succeed(*args, **kwargs)
+    monkeypatch.setattr("cli.process_foreground", flaky)
+
+    daemon = _daemon(tmp_path)
+    daemon.run(once=True)
+    assert daemon.failed and not daemon.step(daemon.retry_at - 1)
+    assert [result["ok"] for result in daemon.step(daemon.retry_at)] == [True]
+    assert calls == ["failed", None] and not daemon.failed
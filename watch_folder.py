@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from image_cache import file_sha256
+from metrics import record_stage, flush_metrics
+
+# Cada cuánto (s) se revisan las carpetas y cuánto tiempo sin cambios se espera antes de reconstruir
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_DEBOUNCE_SECONDS = 2.0
+# Espera antes de reintentar los SVG cuya reconstrucción falló (archivo bloqueado, falta pngquant...)
+FAILED_RETRY_SECONDS = 10.0
+WATCH_STATE_FILENAME = ".svgcreator_watch.json"
+# Opciones de un trabajo que no afectan a cómo se construye cada composición
+_NON_BUILD_OPTIONS = ("foreground", "cache_dir")
+# Opciones que cambian la imagen optimizada (si cambian hay que reoptimizar, no basta con recomponer)
+OPTIMIZER_OPTIONS = ("search_mode", "backend", "pngquant_exe_rel_path", "min_ssim")
+
+def _options_hash(options):
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class Composite(object):
+    """Un SVG de salida: un trabajo, su imagen de primer plano y el fondo que usa."""
+
+    def __init__(self, job, foreground_path, relative_dir, svg_path):
+        self.job = job
+        self.foreground = foreground_path
+        self.relative_dir = relative_dir
+        self.background = job["background"]
+        self.svg_path = svg_path
+        self.settings_hash = _options_hash({key: value for key, value in job.items() if key not in _NON_BUILD_OPTIONS})
+        self.optimizer_hash = _options_hash({key: job.get(key) for key in OPTIMIZER_OPTIONS})
+
+    def inputs_key(self, hashes):
+        """Clave de lo que produce el SVG: contenido del primer plano y del fondo + opciones del trabajo."""
+        return f"{hashes.get(self.foreground)}:{hashes.get(self.background)}:{self.settings_hash}"
+
+class DependencyIndex(object):
+    """
+    Composiciones vigentes (ruta del SVG -> Composite) e índices inversos de cada
+    archivo de entrada a las composiciones que lo usan: al cambiar un fondo
+    compartido se reconstruyen exactamente los SVG que dependen de él.
+    """
+
+    def __init__(self):
+        self.composites = {}
+        self.by_background = {} # fondo -> {ruta del SVG}
+        self.by_foreground = {} # primer plano -> {ruta del SVG}
+
+    def update(self, composites):
+        """Sustituye las composiciones; devuelve (añadidas, eliminadas) como listas de rutas de SVG."""
+        added = [svg_path for svg_path in composites if svg_path not in self.composites]
+        removed = [svg_path for svg_path in self.composites if svg_path not in composites]
+        self.composites = composites
+        self.by_background, self.by_foreground = {}, {}
+        for svg_path, composite in composites.items():
+            self.by_background.setdefault(composite.background, set()).add(svg_path)
+            self.by_foreground.setdefault(composite.foreground, set()).add(svg_path)
+        return added, removed
+
+    def dependents(self, input_path):
+        return self.by_background.get(input_path, set()) | self.by_foreground.get(input_path, set())
+
+    def inputs(self):
+        return set(self.by_background) | set(self.by_foreground)
+
+class WatchDaemon(object):
+    """
+    Vigila las entradas de una lista de trabajos (ver cli.load_job_file) por
+    sondeo y reconstruye de forma incremental:
+
+    *   Los cambios (fecha o tamaño) se acumulan hasta que pasan debounce
+        segundos sin ninguno nuevo, así una copia de muchos archivos o un
+        guardado en varias escrituras provoca una sola reconstrucción.
+    *   Solo cuentan los archivos cuyo hash de contenido cambió; tocar un archivo
+        o volver a guardarlo igual no reconstruye nada.
+    *   Si cambió un primer plano (o una opción del optimizador del trabajo) se
+        reoptimiza y recompone su SVG; si cambió un fondo se recomponen (en
+        paralelo y sin reoptimizar) todos los SVG que lo usan según el índice
+        de dependencias.
+    *   Los SVG cuya reconstrucción falla se reintentan cada
+        FAILED_RETRY_SECONDS aunque sus entradas no cambien.
+    *   Los patrones glob se vuelven a expandir en cada sondeo, de modo que las
+        imágenes nuevas se componen y las borradas dejan de vigilarse.
+
+    El estado (hash de las entradas de cada SVG y su imagen optimizada) se guarda
+    en state_path, y al arrancar de nuevo solo se reconstruye lo que cambió.
+    """
+
+    def __init__(self, jobs, state_path=None, workers=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 debounce=DEFAULT_DEBOUNCE_SECONDS):
+        self.jobs = jobs
+        self.state_path = state_path or os.path.join(jobs[0]["output_dir"], WATCH_STATE_FILENAME)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.index = DependencyIndex()
+        self.stats = {}   # ruta de entrada -> (mtime_ns, tamaño) del último sondeo
+        self.hashes = {}  # ruta de entrada -> hash del contenido ya procesado
+        self.pending = {} # ruta de entrada -> momento del último cambio visto
+        self.failed = set() # SVG cuya última reconstrucción falló (se reintentan aunque no cambie nada)
+        self.retry_at = None
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        temp_fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.state_path)))
+        with os.fdopen(temp_fd, "w", encoding="utf-8") as state_file:
+            json.dump(self.state, state_file, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.state_path)
+
+    def discover(self):
+        """
+        Expande los patrones de todos los trabajos; devuelve {ruta del SVG: Composite}.
+        Si dos imágenes fueran a escribir el mismo SVG se avisa y se mantiene la
+        lista anterior hasta que se resuelva el conflicto.
+        """
+        from cli import JobError, composite_path, plan_composites
+
+        try:
+            tasks = plan_composites(self.jobs, allow_empty=True)
+        except JobError as e:
+            print(f"Vigilancia: {e}; se mantiene la lista anterior")
+            return self.index.composites
+        composites = {}
+        for job, foreground_path, relative_dir in tasks:
+            if os.path.isfile(foreground_path):
+                svg_path = composite_path(job, foreground_path, relative_dir)
+                composites[svg_path] = Composite(job, foreground_path, relative_dir, svg_path)
+        return composites
+
+    def poll(self, now=None):
+        """Un sondeo: actualiza el índice y marca como pendientes las entradas nuevas o modificadas."""
+        now = time.monotonic() if now is None else now
+        added, removed = self.index.update(self.discover())
+        for svg_path in removed:
+            print(f"Vigilancia: '{svg_path}' ya no tiene entrada; se deja de actualizar")
+            self.state.pop(svg_path, None)
+        for input_path in self.index.inputs():
+            try:
+                stat = os.stat(input_path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None # Borrado o aún no creado: se reintenta cuando aparezca
+            if signature != self.stats.get(input_path):
+                self.stats[input_path] = signature
+                if signature is not None:
+                    self.pending[input_path] = now
+        for input_path in [path for path in self.stats if path not in self.index.inputs()]:
+            del self.stats[input_path]
+            self.hashes.pop(input_path, None)
+            self.pending.pop(input_path, None)
+        return added
+
+    def settled(self, now=None):
+        """True si hay cambios pendientes y ninguno en los últimos debounce segundos, o toca reintentar fallos."""
+        now = time.monotonic() if now is None else now
+        if self.failed and now >= self.retry_at:
+            return not self.pending or now - max(self.pending.values()) >= self.debounce
+        return bool(self.pending) and now - max(self.pending.values()) >= self.debounce
+
+    def collect_dirty(self):
+        """
+        Calcula el hash de las entradas pendientes y devuelve dos conjuntos de
+        rutas de SVG: los que hay que reoptimizar y los que solo hay que recomponer.
+        """
+        candidates = self.failed & set(self.index.composites)
+        self.failed = set()
+        for input_path in self.pending:
+            try:
+                content_hash = file_sha256(input_path)
+            except OSError:
+                continue
+            if content_hash != self.hashes.get(input_path):
+                self.hashes[input_path] = content_hash
+                candidates |= self.index.dependents(input_path)
+        self.pending.clear()
+
+        reoptimize, recompose = set(), set()
+        for svg_path in candidates:
+            composite = self.index.composites[svg_path]
+            if composite.foreground not in self.hashes or composite.background not in self.hashes:
+                continue # Falta alguna entrada (aún no existe o no se pudo leer)
+            record = self.state.get(svg_path, {})
+            if record.get("inputs") == composite.inputs_key(self.hashes) and os.path.exists(svg_path):
+                continue # Ya construido con este mismo contenido (p. ej. en una ejecución anterior)
+            if record.get("foreground_hash") != self.hashes[composite.foreground] \
+                    or record.get("optimizer_hash") != composite.optimizer_hash or not record.get("optimized"):
+                reoptimize.add(svg_path)
+            else:
+                recompose.add(svg_path)
+        return reoptimize, recompose
+
+    def rebuild(self, reoptimize, recompose):
+        """Reconstruye en paralelo los SVG indicados y devuelve la lista de resultados."""
+        from cli import process_foreground
+        from svg_generator import get_compiled_background
+
+        targets = sorted(reoptimize | recompose)
+        if not targets:
+            return []
+        start = time.perf_counter()
+        for job in self.jobs:
+            os.makedirs(job["output_dir"], exist_ok=True)
+        # Cada fondo se parsea una sola vez antes de repartir las composiciones que lo usan
+        for background_path in {self.index.composites[svg_path].background for svg_path in targets}:
+            if any(job["background"] == background_path and job["background_mode"] == "tree" for job in self.jobs):
+                try:
+                    get_compiled_background(background_path)
+                except (OSError, ValueError) as e:
+                    print(f"Vigilancia: no se pudo leer el fondo '{background_path}': {e}")
+
+        def build(svg_path):
+            composite = self.index.composites[svg_path]
+            optimized = None if svg_path in reoptimize else self.state.get(svg_path, {}).get("optimized")
+            return svg_path, composite, process_foreground(composite.job, composite.foreground,
+                                                           composite.relative_dir, optimized)
+
+        print(f"Vigilancia: reconstruyendo {len(targets)} SVG ({len(reoptimize)} con optimización)")
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(targets))) as executor:
+            outcomes = list(executor.map(build, targets))
+
+        results = []
+        for svg_path, composite, result in outcomes:
+            results.append(result)
+            if result["ok"]:
+                self.state[svg_path] = {"foreground": composite.foreground, "background": composite.background,
+                                        "foreground_hash": self.hashes[composite.foreground],
+                                        "optimizer_hash": composite.optimizer_hash,
+                                        "inputs": composite.inputs_key(self.hashes), "optimized": result.get("optimized")}
+                print(f"  {composite.foreground}: OK -> {svg_path}")
+            else:
+                self.state.pop(svg_path, None)
+                self.failed.add(svg_path)
+                self.retry_at = time.monotonic() + FAILED_RETRY_SECONDS
+                print(f"  {composite.foreground}: ERROR: {result.get('error')}")
+        self._save_state()
+        failed = sum(1 for result in results if not result["ok"])
+        record_stage("watch_rebuild", time.perf_counter() - start, composites=len(results), failed=failed)
+        flush_metrics()
+        return results
+
+    def step(self, now=None):
+        """Sondea y, si los cambios ya se asentaron, reconstruye; devuelve los resultados (o [])."""
+        self.poll(now)
+        if not self.settled(now):
+            return []
+        return self.rebuild(*self.collect_dirty())
+
+    def run(self, stop_event=None, once=False):
+        """
+        Bucle principal hasta que se active stop_event (o Ctrl+C). Con once=True
+        hace una sola pasada sin esperar al debounce y termina; devuelve los resultados.
+        """
+        stop_event = stop_event or threading.Event()
+        if once:
+            self.poll()
+            return self.rebuild(*self.collect_dirty())
+        print(f"Vigilando {len(self.jobs)} trabajo(s) cada {self.poll_interval:g} s (Ctrl+C para salir)")
+        try:
+            while not stop_event.is_set():
+                self.step()
+                stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Vigilancia detenida.")
+        return []